@@ -0,0 +1,130 @@
+"""
+Compares the disk footprint and read throughput of raw and compressed blockfiles.
+Reads are timed cold, from the disk, as well as warm, from the page cache
+
+Run from the root of the repository with:
+    python benchmarks/compression_benchmark.py [directory]
+The blockfiles are written to a temporary directory inside directory if it is given, so the disk being
+measured can be picked. Cold reads on a virtual disk may still be served from the host's cache
+"""
+import os
+import sys
+import random
+import tempfile
+sys.path.append(sys.path[0] + "/../src/data_structures")
+from time import perf_counter
+from block import BlockBuilder, hash_SHA
+from blockchain import Blockchain, iter_blocks
+from transaction import create_input, create_output
+
+# Number of blocks in each synthetic chain
+BLOCKS = 200
+# Number of transactions in each block
+TRANSACTIONS = 200
+# Number of distinct people sending and receiving coins, keys and recipients repeat across transactions like they do on a real chain
+ADDRESSES = 50
+
+
+def synthetic_chain():
+    """
+    Builds a chain of transaction heavy blocks. Each transaction has one input spending a random earlier output,
+    with a random signature, and two outputs paying people picked out of a small set of addresses
+
+    :returns: list of blocks as byte strings
+    """
+    rng = random.Random(0)
+    public_keys = [rng.randbytes(64) for _ in range(ADDRESSES)]
+    recipients = [hash_SHA(key) for key in public_keys]
+    blocks = []
+    prev_hash = hash_SHA("0".encode())
+    for _ in range(BLOCKS):
+        builder = BlockBuilder()
+        for _ in range(TRANSACTIONS):
+            tx_input = create_input(rng.randbytes(32), rng.randrange(2), rng.randbytes(64), rng.choice(public_keys))
+            outputs = create_output(rng.randrange(10**6), rng.choice(recipients)) + create_output(rng.randrange(10**6), rng.choice(recipients))
+            builder.add_transaction(tx_input + outputs)
+        # A target everything meets, the benchmark is about storage not mining
+        block = builder.build_bytes(prev_hash, 2**256)
+        blocks.append(block)
+        prev_hash = hash_SHA(block[:74])
+    return blocks
+
+
+def evict(filename):
+    """
+    Syncs a blockfile and its index and drops them from the page cache, so the next read has to go to the disk.
+    Does nothing where posix_fadvise() is not available, in which case cold reads are really warm
+
+    :param filename: String, path to the blockfile
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    for path in (filename, filename + '.idx'):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def read_by_height(chain, total):
+    """
+    Reads every block of a chain by height
+
+    :returns: MB/s of block data read
+    """
+    start = perf_counter()
+    for height in range(chain.block_count):
+        chain.get_block_by_height(height)
+    return total / (perf_counter() - start) / 10**6
+
+
+def read_streamed(filename, total):
+    """
+    Reads every block of a blockfile with iter_blocks()
+
+    :returns: MB/s of block data read
+    """
+    start = perf_counter()
+    for _ in iter_blocks(filename):
+        pass
+    return total / (perf_counter() - start) / 10**6
+
+
+def bench(blocks, compression, directory):
+    """
+    Writes the chain to a blockfile with the given compression and syncs it, then reads every block back by
+    height with the cache turned off and with iter_blocks(). Each way of reading is timed cold, straight after
+    the files are dropped from the page cache, and then warm, with the files still in it
+
+    :returns: tuple of the size of the blockfile, seconds to write and sync, and cold then warm MB/s for
+        reads by height and for iter_blocks()
+    """
+    filename = os.path.join(directory, "%s.db" % compression)
+    total = sum(len(block) for block in blocks)
+    start = perf_counter()
+    with Blockchain(filename, cache_size=0, compression=compression) as chain:
+        chain.add_blocks(blocks)
+        chain.sync()
+        write_time = perf_counter() - start
+        evict(filename)
+        by_height_cold = read_by_height(chain, total)
+        by_height_warm = read_by_height(chain, total)
+    evict(filename)
+    streamed_cold = read_streamed(filename, total)
+    streamed_warm = read_streamed(filename, total)
+    return (os.path.getsize(filename), write_time, by_height_cold, by_height_warm, streamed_cold, streamed_warm)
+
+
+if __name__ == '__main__':
+    blocks = synthetic_chain()
+    raw_size = sum(len(block) for block in blocks)
+    print("%d blocks, %.1f MB of block data" % (len(blocks), raw_size / 10**6))
+    with tempfile.TemporaryDirectory(dir=sys.argv[1] if len(sys.argv) > 1 else None) as directory:
+        for compression in (None, 'zlib', 'lzma'):
+            size, write_time, by_height_cold, by_height_warm, streamed_cold, streamed_warm = bench(blocks, compression, directory)
+            print("%-5s %8.2f MB on disk (%3.0f%%)  write %6.2fs  read by height cold %7.1f / warm %7.1f MB/s  "
+                  "iter_blocks cold %7.1f / warm %7.1f MB/s"
+                  % (compression or 'raw', size / 10**6, 100 * size / raw_size, write_time,
+                     by_height_cold, by_height_warm, streamed_cold, streamed_warm))
@@ -0,0 +1,58 @@
+"""
+Compares signing and verifying with cold keys, decoded from bytes every time, and warm keys from the key cache
+
+Run from the root of the repository with:
+    python benchmarks/keys_benchmark.py
+"""
+import sys
+sys.path.append(sys.path[0] + "/../src/data_structures")
+from time import perf_counter
+import ecdsa
+from block import hash_SHA
+from keys import KeyCache, generate_key_set
+
+# Number of signatures made or checked for each measurement
+ROUNDS = 500
+
+
+def bench(function):
+    """
+    Calls function ROUNDS times
+
+    :returns: calls per second
+    """
+    start = perf_counter()
+    for i in range(ROUNDS):
+        function(i)
+    return ROUNDS / (perf_counter() - start)
+
+
+if __name__ == '__main__':
+    key_set = generate_key_set()
+    private_key = key_set["private_key"]
+    public_key = key_set["public_key"]
+    messages = [hash_SHA(str(i).encode()) for i in range(ROUNDS)]
+    signing_key = ecdsa.SigningKey.from_string(private_key, curve=ecdsa.SECP256k1)
+    signatures = [signing_key.sign(message) for message in messages]
+    cache = KeyCache()
+
+    def cold_sign(i):
+        ecdsa.SigningKey.from_string(private_key, curve=ecdsa.SECP256k1).sign(messages[i])
+
+    def warm_sign(i):
+        cache.signing_key(private_key).sign(messages[i])
+
+    def cold_verify(i):
+        ecdsa.VerifyingKey.from_string(public_key, curve=ecdsa.SECP256k1).verify(signatures[i], messages[i])
+
+    def warm_verify(i):
+        cache.verifying_key(public_key).verify(signatures[i], messages[i])
+
+    results = [
+        ("cold sign", bench(cold_sign)),
+        ("warm sign", bench(warm_sign)),
+        ("cold verify", bench(cold_verify)),
+        ("warm verify", bench(warm_verify)),
+    ]
+    for name, rate in results:
+        print("%-12s %8.0f /s" % (name, rate))
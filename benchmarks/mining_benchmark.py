@@ -0,0 +1,85 @@
+"""
+Compares the hash rate of the mining functions in block.py
+
+Run from the root of the repository with:
+    python benchmarks/mining_benchmark.py
+"""
+import sys
+sys.path.append(sys.path[0] + "/../src/data_structures")
+from time import perf_counter
+from block import mine, mine_range, mine_batch, createBlockPoW, hash_SHA, bytes_to_long, long_to_bytes
+
+# Target used for the mine() and createBlockPoW() runs, roughly one in ten thousand hashes meets it
+TARGET = 10**73
+# Number of blocks mined by mine() and createBlockPoW() for each measurement
+ROUNDS = 20
+# Number of nonces tried by mine_range() and mine_batch()
+NONCES = 500000
+# Number of nonces checked by each mine_batch() call
+BATCH_SIZE = 4096
+
+
+def bench_mine():
+    """
+    Mines ROUNDS blocks with mine(), the number of hashes tried is read off the nonce of each header
+
+    :returns: hashes per second
+    """
+    nonce_size = len(long_to_bytes(0))
+    hashes = 0
+    start = perf_counter()
+    for i in range(ROUNDS):
+        header = mine(hash_SHA(str(i).encode()), hash_SHA("bench".encode()), TARGET)
+        hashes += bytes_to_long(header[-nonce_size:]) + 1
+    return hashes / (perf_counter() - start)
+
+
+def bench_create_block_pow():
+    """
+    Mines ROUNDS blocks with createBlockPoW(), the number of hashes tried is read off the nonce of each block
+
+    :returns: hashes per second
+    """
+    hashes = 0
+    start = perf_counter()
+    for i in range(ROUNDS):
+        block = createBlockPoW("bench", str(i), TARGET)
+        hashes += block['nonce'] + 1
+    return hashes / (perf_counter() - start)
+
+
+def bench_mine_range():
+    """
+    Runs mine_range() over NONCES nonces with a target of 1, which no hash will meet, so every nonce gets tried
+
+    :returns: hashes per second
+    """
+    start = perf_counter()
+    mine_range(hash_SHA("0".encode()), hash_SHA("bench".encode()), 1, 0, NONCES)
+    return NONCES / (perf_counter() - start)
+
+
+def bench_mine_batch():
+    """
+    Runs mine_batch() over NONCES nonces, BATCH_SIZE at a time, with a target of 1 so every batch gets checked in full
+
+    :returns: hashes per second
+    """
+    hashes = 0
+    start = perf_counter()
+    for nonce in range(0, NONCES, BATCH_SIZE):
+        mine_batch(hash_SHA("0".encode()), hash_SHA("bench".encode()), 1, nonce, BATCH_SIZE)
+        hashes += BATCH_SIZE
+    return hashes / (perf_counter() - start)
+
+
+if __name__ == '__main__':
+    results = [
+        ("createBlockPoW()", bench_create_block_pow()),
+        ("mine()", bench_mine()),
+        ("mine_range()", bench_mine_range()),
+        ("mine_batch()", bench_mine_batch()),
+    ]
+    baseline = results[1][1]
+    for name, rate in results:
+        print("%-18s %12.0f hashes/s  (%.2fx mine())" % (name, rate, rate / baseline))
@@ -2,7 +2,7 @@
 from hashlib import sha256 as sha
 from binascii import hexlify, unhexlify
 from time import time
-from struct import pack, unpack
+from struct import Struct
 import math
 
 # hash function
@@ -203,7 +203,70 @@ def hash_SHA(byte_string):
     """
 
     return sha(byte_string).digest()
-    
+
+# Fixed little endian layouts of the integers stored in blocks, no matter the platform
+UINT_FORMAT = Struct('<I')
+USHORT_FORMAT = Struct('<H')
+ULONG_FORMAT = Struct('<L')
+
+# Layout of a block header: previous hash, data, timestamp, target exponent and nonce, with no padding
+HEADER_FORMAT = Struct('<32s32sIHL')
+HEADER_SIZE = HEADER_FORMAT.size
+# Layout of the end of a header that changes while mining: timestamp, target exponent and nonce
+HEADER_TAIL_FORMAT = Struct('<IHL')
+# Where the timestamp and nonce start inside a header
+TIMESTAMP_OFFSET = 64
+NONCE_OFFSET = 70
+
+def check_hash_fields(previous_hash, data):
+    """
+    Checks the two 32 byte fields of a block header before they are packed. The struct would otherwise
+    pad shorter strings with zero bytes and cut longer ones down without a word, giving a header that looks
+    normal but does not commit to what it was given
+
+    :param1 previous_hash: the hash of the previous block
+    :param2 data: the data of the block, such as a merkle root
+    :raises ValueError: if either of them is not exactly 32 bytes
+    """
+    if len(previous_hash) != 32 or len(data) != 32:
+        raise ValueError("previous hash and data must be 32 bytes each")
+
+def pack_header(previous_hash, data, timestamp, target_exponent, nonce):
+    """
+    Packs every field of a block header in a single call
+
+    :param1 previous_hash: a 32 byte string, the hash of the previous block
+    :param2 data: a 32 byte string
+    :param3 timestamp: an unsigned integer, time of block creation
+    :param4 target_exponent: an unsigned short, log base 10 of the target
+    :param5 nonce: an unsigned integer
+    :returns: a 74 byte string holding the block header
+    :raises ValueError: if previous_hash or data is not 32 bytes
+    """
+    check_hash_fields(previous_hash, data)
+    return HEADER_FORMAT.pack(previous_hash, data, timestamp, target_exponent, nonce)
+
+def pack_header_into(buffer, offset, previous_hash, data, timestamp, target_exponent, nonce):
+    """
+    Packs every field of a block header straight into a writable buffer, such as a bytearray
+
+    :param1 buffer: a writable buffer with at least 74 bytes free after offset
+    :param2 offset: an integer, where in buffer the header starts
+    :returns: nothing, the rest of the parameters are the same as for pack_header()
+    :raises ValueError: if previous_hash or data is not 32 bytes
+    """
+    check_hash_fields(previous_hash, data)
+    HEADER_FORMAT.pack_into(buffer, offset, previous_hash, data, timestamp, target_exponent, nonce)
+
+def unpack_header(buffer, offset=0):
+    """
+    Unpacks every field of a block header in a single call
+
+    :param1 buffer: a byte string or buffer holding a block header
+    :param2 offset: an integer, default 0. Where in buffer the header starts
+    :returns: a tuple of the previous hash, data, timestamp, target exponent and nonce, with the last three as integers
+    """
+    return HEADER_FORMAT.unpack_from(buffer, offset)
 
 
 def int_to_bytes(val):
@@ -216,7 +279,7 @@ def int_to_bytes(val):
     :param val: integer i 
     :return: integer i in byte form as unsigned int.
     """
-    return pack('I', val)
+    return UINT_FORMAT.pack(val)
 
 def short_to_bytes(val):
     """
@@ -228,7 +291,7 @@ def short_to_bytes(val):
     :param val: short i 
     :return: short i in byte form as unsigned short.
     """
-    return pack('H', val)
+    return USHORT_FORMAT.pack(val)
 
 def long_to_bytes(val):
     """
@@ -240,7 +303,7 @@ def long_to_bytes(val):
     :param val: long i 
     :return: long i in byte form as unsigned long.
     """
-    return pack('L', val)
+    return ULONG_FORMAT.pack(val)
 
 def time_now():
     """
@@ -267,7 +330,7 @@ def bytes_to_int(byte_string):
     :param1 byte_string: a byte string, assumed to be four bytes, holding an integer
     :returns: an unsigned integer, drawn from byte_string
     """
-    return unpack('I', byte_string)[0]
+    return UINT_FORMAT.unpack(byte_string)[0]
 
 def bytes_to_short(byte_string):
     """
@@ -276,7 +339,7 @@ def bytes_to_short(byte_string):
     :param1 byte_string: a byte string, assumed to be four bytes, holding an integer
     :returns: an unsigned short integer, drawn from byte_string
     """
-    return unpack('H', byte_string)[0]
+    return USHORT_FORMAT.unpack(byte_string)[0]
 
 def bytes_to_long(byte_string):
     """
@@ -285,7 +348,7 @@ def bytes_to_long(byte_string):
     :param1 byte_string: a byte string, assumed to be four bytes, holding an integer
     :returns: an unsigned long integer, drawn from byte_string
     """
-    return unpack('L', byte_string)[0]
+    return ULONG_FORMAT.unpack(byte_string)[0]
 
 
 def log_target_bytes(base10_number):
@@ -295,7 +358,16 @@ def log_target_bytes(base10_number):
     :param base10_number: A number of base 10
     :return: The log base 10 of the inputed number as bytes
     """
-    return short_to_bytes(int(math.log10(base10_number)))
+    return short_to_bytes(target_exponent(base10_number))
+
+def target_exponent(target):
+    """
+    Works out the target exponent stored in a block header
+
+    :param target: an unsigned integer, the target
+    :returns: an integer, the log base 10 of target rounded down
+    """
+    return int(math.log10(target))
 
 def mine(previous_hash, data, target):
     """
@@ -309,19 +381,105 @@ def mine(previous_hash, data, target):
     in that order
     """
     nonce = 0
-    timestamp = time_now()
-    # Concatonates the previous hash, data, timestamp, exponent of target, and nonce into a byte string
-    block_header = previous_hash + data + int_to_bytes(timestamp) + log_target_bytes(target) + long_to_bytes(nonce)
+    exponent = target_exponent(target)
+    # Packs the previous hash, data, timestamp, exponent of target, and nonce into a byte string
+    block_header = pack_header(previous_hash, data, time_now(), exponent, nonce)
     block_hash = hash_SHA(block_header)
 
     while not (less_than_target(block_hash, target)):
         nonce += 1
-        timestamp = time_now()
-        block_header = previous_hash + data + int_to_bytes(timestamp) + log_target_bytes(target) + long_to_bytes(nonce)
+        block_header = pack_header(previous_hash, data, time_now(), exponent, nonce)
         block_hash = hash_SHA(block_header)
-        
+
     return block_header
 
+def target_to_bytes(target):
+    """
+    Converts a target into a byte string that can be compared directly against a block hash.
+    Hashes are compared as 32 byte big endian strings, which orders them the same way as hash_to_int()
+
+    :param target: an unsigned integer, the target a block hash has to be less than
+    :returns: a byte string, every hash less than target compares less than it
+    """
+    if target >= 2 ** 256:
+        # Longer than any hash and all 0xff, so every hash compares less than it
+        return b'\xff' * 33
+    return target.to_bytes(32, byteorder='big')
+
+# Number of nonces mine_range() tries before it refreshes the timestamp in the header
+TIMESTAMP_REFRESH_INTERVAL = 2 ** 16
+
+def mine_range(previous_hash, data, target, start_nonce, count, timestamp=None, refresh_interval=TIMESTAMP_REFRESH_INTERVAL):
+    """
+    Searches a fixed range of nonces for a block header whose hash meets the target.
+    Used by the parallel miner so that each worker can be handed its own slice of the nonce space.
+    The header is built once in a preallocated buffer and only the nonce is rewritten for each guess.
+    The previous hash and data fill exactly one SHA-256 block, so they are hashed once up front and
+    every guess only hashes the last 10 bytes of the header on top of a copy of that state.
+
+    :param1 previous_hash: This is a 32 byte string representing the hash of a previous block
+    :param2 data: This is a 32 byte string
+    :param3 target: This is a unsigned integer representing the target number which the hash of the new block has to meet
+    :param4 start_nonce: The first nonce to try
+    :param5 count: The number of nonces to try, starting at start_nonce
+    :param6 timestamp: Integer, the timestamp to put in the header. Defaults to the current time,
+                       refreshed every refresh_interval nonces
+    :param7 refresh_interval: Integer, number of nonces tried between timestamp refreshes
+    :returns: The same header mine() would return for the winning nonce, or None if no nonce in the range works
+    :raises ValueError: if previous_hash or data is not 32 bytes
+    """
+    check_hash_fields(previous_hash, data)
+    target_bytes = target_to_bytes(target)
+    refresh_timestamp = timestamp is None
+    header = bytearray(HEADER_SIZE)
+    pack_header_into(header, 0, previous_hash, data, timestamp or 0, target_exponent(target), 0)
+    midstate = sha(header[:TIMESTAMP_OFFSET])
+    # The rest of the header is the timestamp, target exponent and nonce, rewritten in place below
+    tail = memoryview(header)[TIMESTAMP_OFFSET:]
+    nonce_offset = NONCE_OFFSET - TIMESTAMP_OFFSET
+
+    copy = midstate.copy
+    pack_nonce = ULONG_FORMAT.pack_into
+    nonce = start_nonce
+    end_nonce = start_nonce + count
+    while nonce < end_nonce:
+        batch_end = min(nonce + refresh_interval, end_nonce)
+        if refresh_timestamp:
+            UINT_FORMAT.pack_into(tail, 0, time_now())
+        for nonce in range(nonce, batch_end):
+            pack_nonce(tail, nonce_offset, nonce)
+            block_hash = copy()
+            block_hash.update(tail)
+            if block_hash.digest() < target_bytes:
+                return bytes(header)
+        nonce = batch_end
+    return None
+
+def mine_batch(previous_hash, data, target, start_nonce, count, timestamp=None):
+    """
+    Checks a whole batch of nonces with mine_range() and returns the first one that meets the target,
+    for callers that hand out nonces in batches and only want the winning nonce back.
+    Every header in the batch uses the same timestamp, so the winning header can be rebuilt from the nonce.
+
+    :param1 previous_hash: This is a 32 byte string representing the hash of a previous block
+    :param2 data: This is a 32 byte string
+    :param3 target: This is a unsigned integer representing the target number which the hash of the new block has to meet
+    :param4 start_nonce: The first nonce to try
+    :param5 count: The number of nonces to try, starting at start_nonce
+    :param6 timestamp: Integer, the timestamp used for every header in the batch. Defaults to the current time.
+                       Pass it in to rebuild the winning header afterwards
+    :returns: The first nonce in the batch whose header hash meets the target, or None if there is none
+    :raises ValueError: if a nonce in the batch does not fit in the 4 bytes of the header
+    """
+    if start_nonce < 0 or start_nonce + count > 2 ** 32:
+        raise ValueError("nonces must be between 0 and 2**32 - 1")
+    if timestamp is None:
+        timestamp = time_now()
+    header = mine_range(previous_hash, data, target, start_nonce, count, timestamp)
+    if header is None:
+        return None
+    return bytes_to_long(slice_nonce(header))
+
 def slice_nonce(block_header):
     """
     Takes a concatenated 74 byte string and returns the last 4 bytes
@@ -374,21 +532,103 @@ def hash_to_int(_hash):
     return int.from_bytes(_hash, byteorder='big')
 
 
+class BlockHeader:
+    """
+    A block header that reads its fields straight out of the bytes it was made from.
+    Fields are only decoded when they are asked for, and the hash of the header is worked out
+    the first time it is needed and then kept, so a header is never hashed twice.
+    """
+
+    __slots__ = ('view', '_block_hash')
+
+    def __init__(self, block):
+        """
+        Constructor for BlockHeader, does not copy block
+
+        :param block: a byte string, bytearray or memoryview starting with a 74 byte block header,
+                      such as the output of mine() or forge_block()
+        """
+        self.view = memoryview(block)[:HEADER_SIZE]
+        self._block_hash = None
+
+    @property
+    def prev_hash(self):
+        """
+        :returns: a 32 byte string, the hash of the previous block
+        """
+        return bytes(self.view[0:32])
+
+    @property
+    def data(self):
+        """
+        :returns: a 32 byte string, the data of the block
+        """
+        return bytes(self.view[32:TIMESTAMP_OFFSET])
+
+    @property
+    def timestamp(self):
+        """
+        :returns: an integer, the time of block creation
+        """
+        return UINT_FORMAT.unpack_from(self.view, TIMESTAMP_OFFSET)[0]
+
+    @property
+    def target_exponent(self):
+        """
+        :returns: an integer, log base 10 of the target of the block
+        """
+        return USHORT_FORMAT.unpack_from(self.view, TIMESTAMP_OFFSET + 4)[0]
+
+    @property
+    def nonce(self):
+        """
+        :returns: an integer, the nonce of the block
+        """
+        return ULONG_FORMAT.unpack_from(self.view, NONCE_OFFSET)[0]
+
+    @property
+    def block_hash(self):
+        """
+        :returns: a 32 byte string, the SHA-256 hash of the header. Only computed the first time it is asked for
+        """
+        if self._block_hash is None:
+            self._block_hash = hash_SHA(self.view)
+        return self._block_hash
+
+    def to_bytes(self):
+        """
+        :returns: a 74 byte string, a copy of the header
+        """
+        return self.view.tobytes()
+
+def as_block_header(block):
+    """
+    Wraps a block in a BlockHeader, unless it already is one
+
+    :param block: a BlockHeader, or a byte string starting with a block header
+    :returns: a BlockHeader for block
+    """
+    if isinstance(block, BlockHeader):
+        return block
+    return BlockHeader(block)
+
 def parse_block(block_header):
     """
     Takes a concatenated 74 byte string and runs it through the the previously defined slice functions
     Those functions outputs are added to a dictionary
 
-    :param1 block_header: a 74 byte string containing the information of a block
+    :param1 block_header: a 74 byte string containing the information of a block, or a BlockHeader
     :returns: a dictionary containing the previous hash, data, timestamp, target and nonce of the block
     """
+    header = as_block_header(block_header)
+    view = header.view
     parsed_block = {}
-    parsed_block["prev_hash"] = slice_prev_hash(block_header)
-    parsed_block["data"] = slice_data(block_header)
-    parsed_block["timestamp"] = slice_timestamp(block_header)
-    parsed_block["target"] = slice_target(block_header)
-    parsed_block["nonce"] = slice_nonce(block_header)
-    parsed_block["block_hash"] = hash_SHA(block_header)
+    parsed_block["prev_hash"] = header.prev_hash
+    parsed_block["data"] = header.data
+    parsed_block["timestamp"] = bytes(slice_timestamp(view))
+    parsed_block["target"] = bytes(slice_target(view))
+    parsed_block["nonce"] = bytes(slice_nonce(view))
+    parsed_block["block_hash"] = header.block_hash
     return parsed_block
 
 def is_valid_block(block, prev_block):
@@ -397,68 +637,232 @@ def is_valid_block(block, prev_block):
     Confirms that the timestamp of block is larger than that of prev_block
     Confirms that prev_hash member of block is equal to hash of prev_block
     Confirms that the target of block is greater than the hash of block
-    :param1 block: 74 byte string representing a block, output of mine()
-    :param block: 74 byte string representing the previous block in the blockchain. output of mine()
+    Passing in BlockHeader objects lets a chain be checked pair by pair while hashing each header only once
+    :param1 block: 74 byte string representing a block, output of mine(), or a BlockHeader
+    :param block: 74 byte string representing the previous block in the blockchain. output of mine(), or a BlockHeader
     :returns: boolean True if all the above conditions are met, False otherwise
     """
-    block_info = parse_block(block)
-    prev_block_info = parse_block(prev_block)
+    header = as_block_header(block)
+    prev_header = as_block_header(prev_block)
     # Ensures that time timestamp of block is greater than the timestamp of prev_block
-    if (bytes_to_int(block_info["timestamp"]) <= bytes_to_int(prev_block_info["timestamp"])):
+    if (header.timestamp <= prev_header.timestamp):
         return False
     # Ensures that the prev_hash element of block matches the hash of prev_block
-    if (block_info["prev_hash"] != hash_SHA(prev_block)):
+    if (header.view[0:32] != prev_header.block_hash):
         return False
     # Ensures that the block was mined correctly, and the block hash is less than the target
-    if not (less_than_target(hash_SHA(block), 10**(bytes_to_short(block_info["target"])))):
+    if not (less_than_target(header.block_hash, 10**header.target_exponent)):
         return False
     return True 
 
+class MerkleTree:
+    """
+    A merkle tree that keeps every level, from the transaction hashes at the bottom up to the root.
+    Levels with an odd number of hashes pair their last hash with itself, the same as get_merkle_root().
+    Appending a transaction hash only rehashes the path from that hash up to the root.
+    """
+
+    def __init__(self, hashed_tx_list=()):
+        """
+        Builds the tree level by level, without modifying hashed_tx_list
+
+        :param hashed_tx_list: any iterable of SHA-256 hashed byte strings
+        """
+        self.levels = [list(hashed_tx_list)]
+        level = self.levels[0]
+        while len(level) > 1:
+            # Pairs up adjacent hashes, the last one is paired with itself when there is an odd number
+            level = [hash_SHA(level[i] + level[min(i + 1, len(level) - 1)]) for i in range(0, len(level), 2)]
+            self.levels.append(level)
+
+    def __len__(self):
+        """
+        :returns: the number of transaction hashes in the tree
+        """
+        return len(self.levels[0])
+
+    @property
+    def root(self):
+        """
+        :returns: the merkle root as a single SHA-256 hashed byte string, None if the tree is empty
+        """
+        if len(self.levels[0]) == 0:
+            return None
+        return self.levels[-1][0]
+
+    def append(self, tx_hash):
+        """
+        Adds a transaction hash to the end of the tree.
+        Only the last hash of each level can change, so one hash per level is recomputed.
+
+        :param tx_hash: a SHA-256 hashed byte string
+        """
+        self.levels[0].append(tx_hash)
+        depth = 0
+        while len(self.levels[depth]) > 1:
+            level = self.levels[depth]
+            parent_index = (len(level) - 1) // 2
+            left = level[2 * parent_index]
+            right = level[min(2 * parent_index + 1, len(level) - 1)]
+            if depth + 1 == len(self.levels):
+                self.levels.append([])
+            parents = self.levels[depth + 1]
+            if parent_index < len(parents):
+                parents[parent_index] = hash_SHA(left + right)
+            else:
+                parents.append(hash_SHA(left + right))
+            depth += 1
+
+    def get_proof(self, index):
+        """
+        Creates an inclusion proof for the transaction hash at index, the sibling of each hash
+        on the path from that transaction hash up to the root
+
+        :param index: integer, position of the transaction hash in the tree
+        :returns: a list of SHA-256 hashed byte strings, from the bottom level up
+        """
+        proof = []
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            # The last hash of an odd length level is paired with itself
+            proof.append(level[min(sibling, len(level) - 1)])
+            index //= 2
+        return proof
+
+def merkle_depth(tx_count):
+    """
+    :param tx_count: integer, number of transaction hashes in a merkle tree
+    :returns: integer, number of levels above the transaction hashes, which is the length of every proof in the tree
+    """
+    return max(tx_count - 1, 0).bit_length()
+
+def _proof_fits(index, proof, tx_count):
+    """
+    Checks that a proof has one sibling per level of a tree with tx_count transactions and that index is in it.
+    Without this, a shorter proof could pass an interior node off as a transaction hash
+
+    :returns: boolean True if the proof has the right shape for the tree
+    """
+    return tx_count > 0 and 0 <= index < tx_count and len(proof) == merkle_depth(tx_count)
+
+def verify_merkle_proof(tx_hash, index, proof, merkle_root, tx_count):
+    """
+    Checks that a transaction hash is in a merkle tree by hashing it up to the root along its proof
+
+    :param1 tx_hash: a SHA-256 hashed byte string, the transaction hash being checked
+    :param2 index: integer, position of the transaction hash in the tree
+    :param3 proof: a list of sibling hashes, output of MerkleTree.get_proof()
+    :param4 merkle_root: a SHA-256 hashed byte string, the root the proof should lead to
+    :param5 tx_count: integer, number of transaction hashes in the tree. The proof must have merkle_depth(tx_count) hashes
+    :returns: boolean True if the proof leads to merkle_root, False otherwise
+    """
+    if not _proof_fits(index, proof, tx_count):
+        return False
+    node = tx_hash
+    for sibling in proof:
+        if index % 2 == 0:
+            node = hash_SHA(node + sibling)
+        else:
+            node = hash_SHA(sibling + node)
+        index //= 2
+    return node == merkle_root
+
+def verify_merkle_proofs(proofs, block_header, tx_count):
+    """
+    Checks many inclusion proofs against the merkle root of a block in one call.
+    Proofs for transactions in the same block share the upper part of their paths, so once a node on
+    one proof's path has been verified, later proofs that reach the same node with the same hash stop there
+    instead of hashing the rest of the way up.
+
+    :param1 proofs: an iterable of (tx_hash, index, proof) tuples
+    :param2 block_header: the header of the block, as bytes or a BlockHeader. Its data field holds the merkle root
+    :param3 tx_count: integer, number of transactions in the block
+    :returns: a list of booleans, one per proof, True if that proof is valid
+    """
+    merkle_root = as_block_header(block_header).data
+    # Hashes already known to lead up to merkle_root, keyed by (depth, index)
+    verified = {}
+    results = []
+    for tx_hash, index, proof in proofs:
+        if not _proof_fits(index, proof, tx_count):
+            results.append(False)
+            continue
+        node = tx_hash
+        path = []
+        for depth, sibling in enumerate(proof):
+            if verified.get((depth, index)) == node:
+                break
+            path.append(((depth, index), node))
+            if index % 2 == 0:
+                node = hash_SHA(node + sibling)
+            else:
+                node = hash_SHA(sibling + node)
+            index //= 2
+        else:
+            # Made it all the way up without meeting a verified hash, so it has to end at the root
+            if node != merkle_root:
+                results.append(False)
+                continue
+        verified.update(path)
+        results.append(True)
+    return results
+
 def get_merkle_root(hashed_tx_list):
     """
-    Calls the recursive helper function if the length
-    of the hashed tx list is greater than 0.
+    Builds a MerkleTree out of the hashed tx list and returns its root.
+    The list is left as it is.
 
-    :param hashed_tx_list: a collections.deque object
+    :param hashed_tx_list: a collections.deque object, or any other iterable,
     containing SHA-256 hashed byte strings
-    :return: a single SHA-256 hashed byte string 
+    :return: a single SHA-256 hashed byte string, None if hashed_tx_list is empty
     """
-    if len(hashed_tx_list) < 1:
-        return None
-    else:
-        return _get_merkle_root(hashed_tx_list)
+    return MerkleTree(hashed_tx_list).root
 
-def _get_merkle_root(merkle_list):
+class BlockBuilder:
+    """
+    Collects the transactions of a block, updating the merkle root as each one is added.
+    The finished block is handed out as a list of buffers, so it can be passed to os.writev()
+    or socket.sendmsg() as it is, without joining the transactions into one byte string first.
     """
-    Recursive helper function that pairs up
-    adjacent elements and hashes them, then repeats
-    until a single hash is left.
 
-    :param merkle_list: a collections.deque object
-    containing SHA-256 hashed byte strings
-    :return: base case is a single hash otherwise
-    a deque containing an even length deque
-    of hashed byte strings
-    """
-    if len(merkle_list) == 1:
-        return merkle_list.pop()
-    else:
-        if len(merkle_list) % 2 != 0:
-            merkle_list.append(merkle_list[-1])
-        sz = len(merkle_list)
-        for i in range(int(sz/2)):
-            p1 = merkle_list.popleft()
-            p2 = merkle_list.popleft()
-            merkle_list.append(hash_SHA(p1 + p2))
-        return _get_merkle_root(merkle_list)
+    def __init__(self):
+        """
+        Constructor for BlockBuilder, starts with no transactions
+        """
+        self.transactions = []
+        self.merkle_tree = MerkleTree()
+
+    def add_transaction(self, transaction):
+        """
+        Adds a transaction to the end of the block and to the merkle tree
+
+        :param transaction: a byte string, also used as the transaction's leaf in the merkle tree
+        """
+        self.transactions.append(transaction)
+        self.merkle_tree.append(transaction)
+
+    def build(self, previous_hash, target):
+        """
+        Mines the header of the block and returns the block in pieces
+
+        :param1 previous_hash: This is a 32 byte string representing the hash of a previous block
+        :param2 target: This is a unsigned integer representing the target number which the hash of the new block has to meet
+        :returns: a list of byte strings: the block header, the number of transactions, then every transaction in order
+        """
+        block_header = mine(previous_hash, self.merkle_tree.root, target)
+        return [block_header, int_to_bytes(len(self.transactions))] + self.transactions
+
+    def build_bytes(self, previous_hash, target):
+        """
+        Mines the header of the block and returns the whole block as one byte string
+
+        :returns: a byte string, the pieces returned by build() joined together, copied once
+        """
+        return b''.join(self.build(previous_hash, target))
 
 def forge_block(transactions):
     target=10**72
-    merkle_roots = _get_merkle_root(deque(transactions))
-    block_header = mine(hash_SHA("0".encode()), merkle_roots, target)
-    num_tx = int_to_bytes(len(transactions))
-    all_transactions = b''
+    builder = BlockBuilder()
     for trans in transactions:
-        all_transactions+=trans
-
-    return block_header + num_tx + all_transactions
\ No newline at end of file
+        builder.add_transaction(trans)
+    return builder.build_bytes(hash_SHA("0".encode()), target)
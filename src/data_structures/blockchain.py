@@ -1,39 +1,791 @@
+import os
 import os.path
-from struct import pack
-from block import int_to_bytes
+import mmap
+import zlib
+import lzma
+import threading
+from time import monotonic
+from struct import Struct
+from collections import deque, OrderedDict
+from multiprocessing import Pool
+from block import int_to_bytes, bytes_to_int, hash_SHA, BlockHeader, as_block_header, HEADER_SIZE, is_valid_block, less_than_target
 
 magic_bytes = int_to_bytes(3652501241)
+# Replaces magic_bytes in front of a record dropped by Blockchain.truncate(). The record is left where it is, framed
+# the same way, and everything that walks the blockfile steps over it
+dead_bytes = int_to_bytes(3652501240)
+
+# Layout of an entry in the index file: offset of the record in the blockfile, size of the block, hash of the block.
+# The entry for height h is stored at h * INDEX_ENTRY_FORMAT.size
+INDEX_ENTRY_FORMAT = Struct('<QI32s')
+# Entries dropped by Blockchain.truncate() are zeroed rather than cut off the index
+DEAD_INDEX_ENTRY = bytes(INDEX_ENTRY_FORMAT.size)
+
+# The top two bits of the size in front of a record say how the block body after the header is compressed,
+# the rest is the number of bytes stored. The header itself is never compressed
+COMPRESSION_SHIFT = 30
+SIZE_MASK = (1 << COMPRESSION_SHIFT) - 1
+COMPRESSION_METHODS = {None: 0, 'zlib': 1, 'lzma': 2}
+_compressors = {1: zlib.compress, 2: lzma.compress}
+_decompressors = {1: zlib.decompress, 2: lzma.decompress}
+
+def make_size_field(size, method=0):
+    """
+    Packs the size of a record and how it is compressed into the size field written in front of it
+    :param1 size: Integer, number of bytes stored for the block
+    :param2 method: Integer, a value of COMPRESSION_METHODS, 0 for a block stored raw
+    :returns: Integer, the size field
+    :raises ValueError: if size does not fit below the compression flag
+    """
+    if size > SIZE_MASK:
+        raise ValueError("a stored block can be at most %d bytes" % SIZE_MASK)
+    return size | (method << COMPRESSION_SHIFT)
+
+def compress_block(block, compression):
+    """
+    Compresses the body of a block for storing in a blockfile. The body is stored raw if
+    compressing it does not make it smaller
+    :param1 block: Byte string of the block
+    :param2 compression: String, 'zlib' or 'lzma', or None to store the block raw
+    :returns: Tuple of the bytes to store and the size field for the record, with the compression flag set
+    :raises ValueError: if the bytes to store are too big for the size field
+    """
+    method = COMPRESSION_METHODS[compression]
+    if method:
+        body = _compressors[method](block[HEADER_SIZE:])
+        if len(body) < len(block) - HEADER_SIZE:
+            stored = block[:HEADER_SIZE] + body
+            return (stored, make_size_field(len(stored), method))
+    return (block, make_size_field(len(block)))
+
+def decompress_block(stored, size_field):
+    """
+    Turns the bytes stored in a record back into the block
+    :param1 stored: Bytes of the record after the magic_bytes and size
+    :param2 size_field: Integer, the size in front of the record, with the compression flag
+    :returns: The block. stored itself if it was not compressed
+    """
+    method = size_field >> COMPRESSION_SHIFT
+    if not method:
+        return stored
+    return bytes(stored[:HEADER_SIZE]) + _decompressors[method](stored[HEADER_SIZE:])
+
+def block_prefix(block, num_bytes):
+    """
+    Gets the start of a block without joining all of it together
+    :param1 block: A byte string of a block, or a list of byte strings that make up a block
+    :param2 num_bytes: Integer, number of bytes wanted from the start of the block
+    :returns: Byte string of the first num_bytes of the block, or the whole block if it is shorter.
+        Only the pieces that hold those bytes are joined
+    """
+    if not isinstance(block, (list, tuple)):
+        return block[:num_bytes]
+    pieces = []
+    length = 0
+    for part in block:
+        if length >= num_bytes:
+            break
+        pieces.append(part)
+        length += len(part)
+    return b''.join(pieces)[:num_bytes]
+
+# Largest number of buffers a single writev() call accepts
+IOV_MAX = os.sysconf('SC_IOV_MAX') if 'SC_IOV_MAX' in os.sysconf_names else 1024
+
+# Number of bytes of blocks a Blockchain keeps in memory by default
+DEFAULT_CACHE_SIZE = 16 * 1024 * 1024
+
+class BlockCache:
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_SIZE):
+        """
+        Constructor for a cache of blocks bounded by the total size of the blocks in it, which evicts close to
+        least recently used first. Blocks are kept by height along with their decoded header, and can also be
+        found by block hash. Lookups take no lock and never reorder the cache, a hit only marks the block as
+        referenced. Adding and dropping blocks takes the lock, and eviction gives a referenced block a second
+        chance by clearing the mark and moving it to the back, the CLOCK approximation of least recently used.
+        The hit and miss counters are not locked, so they can miss a few lookups made at the same time.
+        :param max_bytes: Integer, total size of the blocks the cache can hold. 0 turns the cache off
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # Maps heights to (block, BlockHeader) tuples, in the order eviction passes over them
+        self._entries = OrderedDict()
+        # Heights looked up since eviction last passed over them. Readers only ever add to it
+        self._referenced = set()
+        self._heights = {}
+        # Changes whenever blocks are invalidated, so a block read before a reorg is not put back afterwards
+        self.generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, height):
+        """
+        :param height: Integer, height of the block
+        :returns: Tuple of the block and its BlockHeader, None if the block is not in the cache
+        """
+        entry = self._entries.get(height)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._referenced.add(height)
+        self.hits += 1
+        return entry
+
+    def get_height(self, block_hash):
+        """
+        :param block_hash: 32 byte string, hash of a block header
+        :returns: Integer, height of the block with that hash if it is in the cache, None otherwise
+        """
+        return self._heights.get(block_hash)
+
+    def put(self, height, block, generation=None):
+        """
+        Adds a block to the cache, evicting blocks that have not been looked up lately until it fits.
+        Blocks bigger than the whole cache are not kept
+        :param1 height: Integer, height of the block
+        :param2 block: Byte string of the block
+        :param3 generation: Integer, the generation the cache was at before the block was read. The block is
+            not kept if blocks have been invalidated since
+        :returns: Tuple of the block and its BlockHeader
+        """
+        entry = (block, as_block_header(block))
+        if len(block) > self.max_bytes:
+            return entry
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return entry
+            self._invalidate(height)
+            self._entries[height] = entry
+            self._heights[entry[1].block_hash] = height
+            self.size += len(block)
+            while self.size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                if oldest == height or oldest in self._referenced:
+                    self._referenced.discard(oldest)
+                    self._entries.move_to_end(oldest)
+                else:
+                    self._invalidate(oldest)
+        return entry
+
+    def invalidate(self, height):
+        """
+        Drops the block at height from the cache, if it is there
+        :param height: Integer, height of the block
+        """
+        with self._lock:
+            self.generation += 1
+            self._invalidate(height)
+
+    def _invalidate(self, height):
+        """
+        Does the work of invalidate(), with the lock already held
+        :param height: Integer, height of the block
+        """
+        entry = self._entries.pop(height, None)
+        self._referenced.discard(height)
+        if entry is not None:
+            # Another height may hold a block with the same header, in which case its hash now points there
+            if self._heights.get(entry[1].block_hash) == height:
+                del self._heights[entry[1].block_hash]
+            self.size -= len(entry[0])
+
+    def invalidate_from(self, height):
+        """
+        Drops every block at or above height, for when the chain is cut back by a reorg
+        :param height: Integer, lowest height to drop
+        """
+        with self._lock:
+            self.generation += 1
+            for cached_height in [h for h in self._entries if h >= height]:
+                self._invalidate(cached_height)
+
+    def clear(self):
+        """
+        Drops every block from the cache. The hit and miss counters are kept
+        """
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._referenced.clear()
+            self._heights.clear()
+            self.size = 0
 
 class Blockchain:
     
-    def __init__(self,filename):
+    def __init__(self, filename, sync_blocks=0, sync_interval_ms=0, cache_size=DEFAULT_CACHE_SIZE, compression=None):
         """
         Constructor that takes in a blockchain to create a copy of it
         in the class data member blockfile
+        The blockfile and its index are kept open until close() is called. How often they are flushed
+        to disk with fsync() is set by sync_blocks and sync_interval_ms. With both left at 0 they are never
+        synced and the operating system writes them out in its own time; sync_blocks=1 syncs after every block
         :param filename: local copy of the blockchain that will
                         be used to create this copy of the blockchain
+        :param sync_blocks: Integer, fsync() once at least this many blocks have been written since the last sync. 0 turns it off
+        :param sync_interval_ms: Integer, fsync() blocks at most this many milliseconds after they are written, from a timer
+            if no later write gets there first. 0 turns it off
+        :param cache_size: Integer, number of bytes of recently read blocks to keep in memory. 0 turns the cache off
+        :param compression: String, 'zlib' or 'lzma' to compress the body of each block written, None to write blocks raw.
+            Blocks are read back the same whichever way they were written
         :no return:
+
+        One thread at a time may add blocks or truncate the chain, while any number of other threads read from it
+        without taking a lock, other than briefly to put a block read from disk in the cache. The writer only publishes new blocks once their records and index entries are
+        fully written, by replacing the tip in a single assignment, and readers never look past the tip they see.
         """
         self.blockfile = filename
         # If the file does not already exist, create the file and close it
         if not (os.path.isfile(filename)):
             with open(filename, 'wb') as f: pass
-        self.block_count = 0
-        self.last_block = b''
+        # Number of blocks, length of the blockfile they take up, and the last block, published together
+        self._tip = (0, 0, b'')
+        # The index sits next to the blockfile and maps heights and block hashes to records
+        self.indexfile = filename + '.idx'
+        if not (os.path.isfile(self.indexfile)):
+            with open(self.indexfile, 'wb') as f: pass
+        # Any partly written entry at the end of the index is ignored, and overwritten by the next block
+        self.indexed_count = os.path.getsize(self.indexfile) // INDEX_ENTRY_FORMAT.size
+        # Maps block hashes to heights, only loaded the first time a block is looked up by hash.
+        # The lock is only taken to load or change the map, not to look hashes up in it
+        self._heights = None
+        self._heights_lock = threading.Lock()
+        # Long lived handles for appending, so writing a block does not have to open and close the files
+        self._block_fd = os.open(self.blockfile, os.O_WRONLY | os.O_APPEND)
+        self._index_fd = os.open(self.indexfile, os.O_WRONLY)
+        # Separate handles for reading with pread(), which does not move a shared file position
+        self._block_read_fd = os.open(self.blockfile, os.O_RDONLY)
+        self._index_read_fd = os.open(self.indexfile, os.O_RDONLY)
+        self.sync_blocks = sync_blocks
+        self.sync_interval_ms = sync_interval_ms
+        self._unsynced_blocks = 0
+        self._last_sync = monotonic()
+        # Syncs blocks left unsynced by the last write once sync_interval_ms has gone by.
+        # The lock keeps it from syncing while the writer is counting blocks or closing the files
+        self._sync_timer = None
+        self._sync_lock = threading.RLock()
+        self.cache = BlockCache(cache_size)
+        self.compression = compression
+        self.recover_tip()
+
+    def recover_tip(self):
+        """
+        Works out block_count and last_block for an existing blockfile from the end of its index, so reopening
+        a chain takes the same time no matter how long it is. Only records written after the last index entry
+        are read: complete ones are added to the index, and a record cut short by a crash is truncated away.
+        A blockfile with no index at all has its index rebuilt this way the first time it is opened.
+        This is also where the dead records and index entries truncate() leaves at the end of the files are
+        finally cut off, so nothing may have the blockfile mapped while a chain is being opened.
+        """
+        entry_size = INDEX_ENTRY_FORMAT.size
+        dead_entry = INDEX_ENTRY_FORMAT.unpack(DEAD_INDEX_ENTRY)
+        file_size = os.fstat(self._block_fd).st_size
+        # Drops index entries that were zeroed by truncate() or whose records are no longer all there
+        while self.indexed_count > 0:
+            entry = self._read_index_entry(self.indexed_count - 1)
+            offset, size, _ = entry
+            if entry != dead_entry and offset + 8 + (size & SIZE_MASK) <= file_size:
+                break
+            self.indexed_count -= 1
+        os.truncate(self.indexfile, self.indexed_count * entry_size)
+        self.cache.invalidate_from(self.indexed_count)
+        self._heights = None
+
+        end = 0
+        if self.indexed_count > 0:
+            offset, size, _ = self._read_index_entry(self.indexed_count - 1)
+            end = offset + 8 + (size & SIZE_MASK)
+        # End of the last record that is part of the chain, dead records after it are not
+        live_end = end
+        entries = []
+        with open(self.blockfile, 'rb') as file:
+            file.seek(end)
+            frame = b''
+            while end < file_size:
+                frame = file.read(8)
+                if len(frame) < 8 or frame[0:4] not in (magic_bytes, dead_bytes):
+                    break
+                size_field = bytes_to_int(frame[4:8])
+                size = size_field & SIZE_MASK
+                if end + 8 + size > file_size:
+                    break
+                if frame[0:4] == dead_bytes:
+                    file.seek(size, 1)
+                    end += 8 + size
+                    continue
+                header = file.read(min(size, HEADER_SIZE))
+                file.seek(size - len(header), 1)
+                entries.append(INDEX_ENTRY_FORMAT.pack(end, size_field, hash_SHA(header)))
+                end += 8 + size
+                live_end = end
+            # A record that starts with the magic bytes but runs past the end of the file was torn by a crash,
+            # and is cut off along with any dead records in front of it.
+            # Anything else is left alone, since it was not written by Blockchain
+            if end == file_size or magic_bytes.startswith(frame[0:4]) or dead_bytes.startswith(frame[0:4]):
+                if live_end < file_size:
+                    os.truncate(self.blockfile, live_end)
+        if entries:
+            self._add_index_entries(entries)
+
+        self._tip = (self.indexed_count, live_end, b'')
+        if self.indexed_count > 0:
+            self._tip = (self.indexed_count, live_end, self.get_block_by_height(self.indexed_count - 1))
+
+    @property
+    def block_count(self):
+        """
+        :returns: Integer, number of blocks in the chain
+        """
+        return self._tip[0]
+
+    @property
+    def last_block(self):
+        """
+        A block added as a list of pieces is not joined when it is written, so it is read back from the
+        blockfile the first time it is asked for
+        :returns: The block at the tip of the chain as a byte string, empty if there are no blocks
+        """
+        while True:
+            tip = self._tip
+            if tip[2] is not None:
+                return tip[2]
+            block = self.get_block_by_height(tip[0] - 1)
+            # Tries again with the new tip if the chain changed while the block was being read
+            if self._tip is tip:
+                return block
+
+    def committed(self):
+        """
+        Snapshot of the part of the chain that is safe to read, for readers of the blockfile that do not go
+        through Blockchain, such as a BlockReader
+        :returns: Tuple of the number of blocks and the length of the blockfile they take up
+        """
+        tip = self._tip
+        return (tip[0], tip[1])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Syncs anything not yet synced and closes the blockfile and index
+        """
+        with self._sync_lock:
+            if self._block_fd is None:
+                return
+            if self._unsynced_blocks:
+                self.sync()
+            if self._sync_timer is not None:
+                self._sync_timer.cancel()
+                self._sync_timer = None
+            for fd in (self._block_fd, self._index_fd, self._block_read_fd, self._index_read_fd):
+                os.close(fd)
+            self._block_fd = None
+            self._index_fd = None
+            self._block_read_fd = None
+            self._index_read_fd = None
+
+    def sync(self):
+        """
+        Flushes the blockfile and then the index to disk
+        """
+        with self._sync_lock:
+            if self._block_fd is None:
+                return
+            os.fsync(self._block_fd)
+            os.fsync(self._index_fd)
+            self._unsynced_blocks = 0
+            self._last_sync = monotonic()
+            # Nothing is left for a pending timer to sync, the next write starts a new one
+            if self._sync_timer is not None:
+                self._sync_timer.cancel()
+                self._sync_timer = None
+
+    def _sync_if_due(self, num_blocks):
+        """
+        Syncs if the durability policy calls for it after writing num_blocks more blocks, otherwise starts
+        the timer that syncs them once sync_interval_ms is up
+        :param num_blocks: Integer, number of blocks just written
+        """
+        with self._sync_lock:
+            self._unsynced_blocks += num_blocks
+            if self.sync_blocks and self._unsynced_blocks >= self.sync_blocks:
+                self.sync()
+            elif self.sync_interval_ms:
+                wait = self.sync_interval_ms / 1000 - (monotonic() - self._last_sync)
+                if wait <= 0:
+                    self.sync()
+                elif self._sync_timer is None:
+                    self._sync_timer = threading.Timer(wait, self._timed_sync)
+                    self._sync_timer.daemon = True
+                    self._sync_timer.start()
+
+    def _timed_sync(self):
+        """
+        Run by the sync timer, syncs whatever is still unsynced
+        """
+        with self._sync_lock:
+            self._sync_timer = None
+            if self._block_fd is not None and self._unsynced_blocks:
+                self.sync()
 
     def add_block(self, block):
         """
-        Adds a block to the blockfile by concatonating the magic_bytes, block size, and block byte string
-        and appending to the blockfile.
-        :param block: A 74 Byte string representing a block
+        Adds a block to the blockfile by writing the magic_bytes, block size, and block byte string
+        to the end of the blockfile in a single writev() call, without joining them together first.
+        With compression turned on the block is joined and its body compressed before it is written.
+        :param block: A 74 Byte string representing a block, or a list of byte strings that make up a block
+            such as the output of BlockBuilder.build()
+        """
+        self.add_blocks([block])
+
+    def add_blocks(self, blocks):
+        """
+        Adds many blocks at once. _blocks_written() is called first, then every record is written to the
+        blockfile with as few writev() calls as possible, then every index entry is written with a single write,
+        then the blocks are published to readers, then they are synced if the durability policy calls for it.
+        Blocks given as lists of pieces are written piece by piece, only their header is copied out to be hashed.
+        :param blocks: An iterable of blocks, each one in any form add_block() accepts
+        :raises ValueError: if a block is shorter than a header or too big to be stored, in which case none of
+            the blocks are written.
+            Nothing is written either if _blocks_written() raises
+        """
+        parts = []
+        entries = []
+        written = []
+        offset = os.fstat(self._block_fd).st_size
+        for block in blocks:
+            block_parts = list(block) if isinstance(block, (list, tuple)) else [block]
+            block_size = sum(map(len, block_parts))
+            # Anything shorter could not be read back as a block by iter_blocks() or read_headers()
+            if block_size < HEADER_SIZE:
+                raise ValueError("block is shorter than a block header")
+            header = block_prefix(block_parts, HEADER_SIZE)
+            if self.compression is not None:
+                stored, size_field = compress_block(b''.join(block_parts), self.compression)
+                block_parts = [stored]
+            else:
+                size_field = make_size_field(block_size)
+            parts += [magic_bytes, int_to_bytes(size_field)] + block_parts
+            entries.append(INDEX_ENTRY_FORMAT.pack(offset, size_field, hash_SHA(header)))
+            offset += 8 + (size_field & SIZE_MASK)
+            written.append(block)
+        if not entries:
+            return
+        self._blocks_written(self.indexed_count, written, [INDEX_ENTRY_FORMAT.unpack(entry)[0] for entry in entries])
+        write_parts(self._block_fd, parts)
+        # The index entries are only written once the whole records are in the blockfile,
+        # so an entry never points at a block that is not there
+        self._add_index_entries(entries)
+        # A block given in pieces is left for last_block to read back rather than joined here
+        last_block = written[-1]
+        if isinstance(last_block, (list, tuple)):
+            last_block = None
+        self._tip = (self.indexed_count, offset, last_block)
+        self._sync_if_due(len(entries))
+
+    def _blocks_written(self, start_height, blocks, offsets):
+        """
+        Called by add_blocks() before the blocks are written, for subclasses that keep more about each block.
+        If it raises, add_blocks() writes nothing, so the chain never holds a block the subclass has not
+        taken in. What it stores for heights past block_count must be ignored until the blocks are published,
+        since the write may still fail after it. Does nothing here
+        :param1 start_height: Integer, height of the first block
+        :param2 blocks: A list of the blocks in height order, each a byte string or a list of pieces as given
+            to add_blocks(). block_prefix() gets the start of either
+        :param3 offsets: A list of integers, the offset of each block's record in the blockfile
+        """
+        pass
+
+    def _add_index_entries(self, entries):
+        """
+        Writes index entries for the next heights with a single write
+        :param entries: A list of packed index entries, in height order
+        """
+        os.pwrite(self._index_fd, b''.join(entries), self.indexed_count * INDEX_ENTRY_FORMAT.size)
+        with self._heights_lock:
+            if self._heights is not None:
+                for height, entry in enumerate(entries, self.indexed_count):
+                    self._heights[entry[-32:]] = height
+            self.indexed_count += len(entries)
+
+    def _read_index_entry(self, height):
+        """
+        Reads the index entry for a height straight from its position in the index file
+        :param height: Integer, height of the block
+        :returns: Tuple of the offset of the record, the size field of the record and the hash of the block
+        """
+        return INDEX_ENTRY_FORMAT.unpack(os.pread(self._index_read_fd, INDEX_ENTRY_FORMAT.size, height * INDEX_ENTRY_FORMAT.size))
+
+    def get_block_location(self, height):
+        """
+        Finds where a block is stored in the blockfile
+        :param height: Integer, height of the block, 0 being the first block
+        :returns: Tuple of the offset where the block starts and the number of bytes stored for it, None if there
+            is no block at height. For a compressed block this is the compressed bytes, see decompress_block()
         """
-        size = get_size_bytes(block)
-        payload = magic_bytes+size+block
-        
-        with open(self.blockfile, 'ab') as fileobj:
-            fileobj.write(payload)
-        self.block_count += 1
-        self.last_block = block
+        if not 0 <= height < self.block_count:
+            return None
+        offset, size, _ = self._read_index_entry(height)
+        # Skips over the magic bytes and size in front of the block
+        return (offset + 8, size & SIZE_MASK)
+
+    def _get_cached(self, height):
+        """
+        Gets a block and its header from the cache, reading the block from the blockfile on a miss
+        :param height: Integer, height of the block, 0 being the first block
+        :returns: Tuple of the block and its BlockHeader, None if there is no block at height
+        """
+        entry = self.cache.get(height)
+        if entry is not None:
+            return entry
+        generation = self.cache.generation
+        if not 0 <= height < self.block_count:
+            return None
+        offset, size, _ = self._read_index_entry(height)
+        stored = os.pread(self._block_read_fd, size & SIZE_MASK, offset + 8)
+        return self.cache.put(height, decompress_block(stored, size), generation)
+
+    def get_block_by_height(self, height):
+        """
+        :param height: Integer, height of the block, 0 being the first block
+        :returns: The block at height as a byte string, None if there is no block at height
+        """
+        entry = self._get_cached(height)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def get_header(self, height):
+        """
+        :param height: Integer, height of the block, 0 being the first block
+        :returns: BlockHeader of the block at height, None if there is no block at height
+        """
+        entry = self._get_cached(height)
+        if entry is None:
+            return None
+        return entry[1]
+
+    def truncate(self, height):
+        """
+        Cuts the chain back so height becomes the next height to be added, for example to undo blocks
+        during a reorg. The shorter chain is published first, then the dropped blocks are evicted from the
+        cache, then their index entries are zeroed, then their records are marked dead, newest first.
+        Neither file is made shorter, since a BlockReader may still have the dropped records mapped and touching
+        a mapped page past the end of a file kills the process. Later blocks are added after the dead records,
+        and dead records at the end of the files are cut off by recover_tip() the next time the chain is opened.
+        :param height: Integer, number of blocks to keep
+        """
+        if not 0 <= height < self.indexed_count:
+            return
+        entry_size = INDEX_ENTRY_FORMAT.size
+        dropped = os.pread(self._index_read_fd, (self.indexed_count - height) * entry_size, height * entry_size)
+        offsets = [offset for offset, _, _ in INDEX_ENTRY_FORMAT.iter_unpack(dropped)]
+        last_block = self.get_block_by_height(height - 1) if height > 0 else b''
+        self._tip = (height, offsets[0], last_block)
+        self.cache.invalidate_from(height)
+        with self._heights_lock:
+            if self._heights is not None:
+                for block_hash in [block_hash for block_hash, h in self._heights.items() if h >= height]:
+                    del self._heights[block_hash]
+            self.indexed_count = height
+        # With the entries gone first, a crash part way through leaves records that are either dead or, being
+        # after the last index entry, picked up again by recover_tip(), which then undoes the truncate
+        os.pwrite(self._index_fd, DEAD_INDEX_ENTRY * len(offsets), height * entry_size)
+        # The blockfile is written through a handle opened for appending, so the records are marked through another
+        fd = os.open(self.blockfile, os.O_WRONLY)
+        try:
+            for offset in reversed(offsets):
+                os.pwrite(fd, dead_bytes, offset)
+        finally:
+            os.close(fd)
+
+    def get_height(self, block_hash):
+        """
+        :param block_hash: 32 byte string, hash of a block header
+        :returns: Integer, height of the block with that hash, None if there is no such block
+        """
+        block_count = self.block_count
+        height = self.cache.get_height(block_hash)
+        if height is None:
+            heights = self._heights
+            if heights is None:
+                heights = self._load_heights()
+            height = heights.get(block_hash)
+        # Blocks indexed by the writer but not yet published are left out
+        if height is None or height >= block_count:
+            return None
+        return height
+
+    def get_block_by_hash(self, block_hash):
+        """
+        :param block_hash: 32 byte string, hash of a block header
+        :returns: The block with that hash as a byte string, None if there is no such block
+        """
+        height = self.get_height(block_hash)
+        if height is None:
+            return None
+        return self.get_block_by_height(height)
+
+    def _load_heights(self):
+        """
+        Reads every hash in the index file into the hash to height map, unless another thread already has
+        :returns: The hash to height map
+        """
+        with self._heights_lock:
+            if self._heights is None:
+                entries = os.pread(self._index_read_fd, self.indexed_count * INDEX_ENTRY_FORMAT.size, 0)
+                heights = {}
+                for height, (_, _, block_hash) in enumerate(INDEX_ENTRY_FORMAT.iter_unpack(entries)):
+                    heights[block_hash] = height
+                self._heights = heights
+            return self._heights
+
+class MappedFile:
+
+    def __init__(self, filename):
+        """
+        Constructor for a read only memory map of a file that can grow.
+        :param filename: String, path to the file
+        """
+        self._file = open(filename, 'rb')
+        self._map = None
+        self.view = memoryview(b'')
+        self.remap()
+
+    def remap(self):
+        """
+        Maps the file again if it has grown since it was last mapped.
+        Views handed out from the old map stay valid, the old map is closed once they are all gone.
+        :returns: Integer, size of the mapped part of the file
+        """
+        size = os.fstat(self._file.fileno()).st_size
+        if size > len(self.view):
+            self._map = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ)
+            self.view = memoryview(self._map)
+        return len(self.view)
+
+    def close(self):
+        """
+        Closes the file. The map is closed once no views of it are left
+        """
+        self.view = memoryview(b'')
+        self._map = None
+        self._file.close()
+
+class BlockReader:
+
+    def __init__(self, filename, chain=None):
+        """
+        Constructor for a reader of a blockfile written by Blockchain. The blockfile, and its index if there
+        is one, are memory mapped once, and blocks are handed out as memoryview slices of the map, with no copy.
+        :param filename: String, path to the blockfile
+        :param chain: Optional Blockchain writing to the blockfile. Reads are then kept to the blocks it has
+            published, so a record or index entry still being written is never seen
+        """
+        self.blockfile = filename
+        self.chain = chain
+        self._blocks = MappedFile(filename)
+        indexfile = filename + '.idx'
+        self._index = MappedFile(indexfile) if os.path.isfile(indexfile) else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Closes the mapped files
+        """
+        self._blocks.close()
+        if self._index is not None:
+            self._index.close()
+
+    def read(self, offset, num_bytes):
+        """
+        Reads bytes out of the blockfile without copying them, remapping the file first if it has grown
+        :param offset: Integer, where in the blockfile to start reading
+        :param num_bytes: Integer, number of bytes to read
+        :returns: memoryview of the bytes, None if they go past the end of the blockfile
+        """
+        end = offset + num_bytes
+        if self.chain is not None and end > self.chain.committed()[1]:
+            return None
+        if end > len(self._blocks.view) and end > self._blocks.remap():
+            return None
+        return self._blocks.view[offset:end]
+
+    def get_block_by_height(self, height):
+        """
+        Looks the block up in the index and returns it without copying it, unless it has to be decompressed
+        :param height: Integer, height of the block, 0 being the first block
+        :returns: memoryview of the block, or bytes for a compressed block. None if there is no block at height
+        """
+        if self._index is None:
+            return None
+        if self.chain is not None and height >= self.chain.committed()[0]:
+            return None
+        entry_size = INDEX_ENTRY_FORMAT.size
+        start = height * entry_size
+        if height < 0 or (start + entry_size > len(self._index.view) and start + entry_size > self._index.remap()):
+            return None
+        if self._index.view[start:start + entry_size] == DEAD_INDEX_ENTRY:
+            return None
+        offset, size, _ = INDEX_ENTRY_FORMAT.unpack_from(self._index.view, start)
+        stored = self.read(offset + 8, size & SIZE_MASK)
+        if stored is None:
+            return None
+        return decompress_block(stored, size)
+
+    def __iter__(self):
+        """
+        Walks the magic_bytes and size framing of the blockfile from the start, stopping at the end of
+        the file or at the first record that is not framed properly. Dead records are stepped over
+        :returns: A generator of memoryviews, or bytes for compressed blocks, one per block, in order
+        """
+        offset = 0
+        while True:
+            frame = self.read(offset, 8)
+            if frame is None or frame[0:4] not in (magic_bytes, dead_bytes):
+                return
+            size_field = bytes_to_int(frame[4:8])
+            size = size_field & SIZE_MASK
+            stored = self.read(offset + 8, size)
+            if stored is None:
+                return
+            if frame[0:4] == magic_bytes:
+                yield decompress_block(stored, size_field)
+            offset += 8 + size
+
+def write_parts(fd, parts):
+    """
+    Writes a list of byte strings to a file descriptor, one after another, with as few writev() calls as possible.
+    Lists longer than IOV_MAX are split over several calls
+    :param1 fd: Integer, an open file descriptor
+    :param2 parts: A list of byte strings or other buffers
+    :returns: Integer, total number of bytes written
+    """
+    total = 0
+    for start in range(0, len(parts), IOV_MAX):
+        batch = parts[start:start + IOV_MAX]
+        size = sum(len(part) for part in batch)
+        written = os.writev(fd, batch)
+        if written < size:
+            # writev() stopped early, so the rest is written out with plain writes
+            rest = memoryview(b''.join(batch))[written:]
+            while rest:
+                rest = rest[os.write(fd, rest):]
+        total += size
+    return total
 
 def get_size_bytes(byte_string):
     """
@@ -41,7 +793,7 @@ def get_size_bytes(byte_string):
     :param1 byte_string: A string of bytes
     :returns: An integer in byte form
     """
-    return pack('I', len(byte_string))
+    return int_to_bytes(len(byte_string))
 
 def extract(filename, index, num_bytes, offset=0):
   """
@@ -59,4 +811,256 @@ def extract(filename, index, num_bytes, offset=0):
       # Moves file pointer to correct position at index + offset
       file.seek(index, offset)
       # Reads num_bytes after file pointer
-      return file.read(num_bytes)
\ No newline at end of file
+      return file.read(num_bytes)
+
+# Number of bytes iter_blocks() reads from a blockfile at a time
+READ_CHUNK_SIZE = 1024 * 1024
+
+def iter_blocks(filename, chunk_size=READ_CHUNK_SIZE, skipped=None):
+    """
+    Streams every block out of a blockfile, reading it in large sequential chunks so memory use stays the same
+    however big the file is, at most chunk_size plus the biggest record. A record is only taken as a block if it
+    starts with magic_bytes, its size leaves room for a header and fits in what is left of the file, its body decompresses if it is compressed, and either it is followed
+    by the end of the file or the magic_bytes of the next record, or no magic_bytes turn up inside it.
+    Anything else is skipped by scanning forward to the next magic_bytes, so a torn or corrupted record only
+    loses that record and not the rest of the file. Dead records left by Blockchain.truncate() are checked
+    the same way and stepped over without being counted as blocks or as skipped.
+    :param1 filename: String, path to a blockfile written by Blockchain
+    :param2 chunk_size: Integer, number of bytes to read at a time. Blocks bigger than this are still read whole
+    :param3 skipped: Optional list, an (offset, length) tuple gets appended to it for every range of bytes skipped
+    :returns: A generator of (height, offset of the record, 74 byte header, rest of the block) tuples. Heights count
+        the blocks that could be read, so they run on without a gap across a skipped range
+    """
+    for height, offset, _, header, body in _iter_records(filename, chunk_size, skipped):
+        yield (height, offset, header, body)
+
+def _starts_frame(prefix):
+    """
+    :param prefix: Up to 4 bytes found where a record could start
+    :returns: True if prefix is magic_bytes or dead_bytes, or the start of either cut off by the end of the data
+    """
+    return magic_bytes.startswith(prefix) or dead_bytes.startswith(prefix)
+
+def _find_frame(buffer, start, end=None):
+    """
+    :param1 buffer: Bytes to search
+    :param2 start: Integer, where in buffer to start searching
+    :param3 end: Integer, where in buffer to stop searching. Defaults to the end of buffer
+    :returns: Integer, position of the first magic_bytes or dead_bytes in the range, -1 if there is neither
+    """
+    found = [i for i in (buffer.find(magic_bytes, start, end), buffer.find(dead_bytes, start, end)) if i != -1]
+    return min(found, default=-1)
+
+def _iter_records(filename, chunk_size, skipped):
+    """
+    Does the work of iter_blocks(), also handing back the size field of each record
+    :returns: A generator of (height, offset of the record, size field, 74 byte header, rest of the block) tuples
+    """
+    with open(filename, 'rb') as file:
+        file_size = os.fstat(file.fileno()).st_size
+        # Unread bytes are kept in one bytearray, consumed bytes are deleted off its front rather than copying the rest
+        buffer = bytearray()
+        # Offset in the file of the start of buffer, and the position in buffer of the next record
+        start = 0
+        pos = 0
+        height = 0
+        skipped_from = None
+
+        def available(num_bytes):
+            # Reads more of the file if fewer than num_bytes are left in the buffer.
+            # Returns False if the file ends before then
+            nonlocal start, pos
+            left = len(buffer) - pos
+            if left < num_bytes:
+                del buffer[:pos]
+                start += pos
+                pos = 0
+                buffer.extend(file.read(max(chunk_size, num_bytes - left)))
+            return len(buffer) - pos >= num_bytes
+
+        while available(8):
+            body = None
+            dead = buffer[pos:pos + 4] == dead_bytes
+            if dead or buffer[pos:pos + 4] == magic_bytes:
+                size_field = bytes_to_int(buffer[pos + 4:pos + 8])
+                size = size_field & SIZE_MASK
+                end = pos + 8 + size
+                # A size that runs past the end of the file is corrupt, and is skipped without being read in
+                if HEADER_SIZE <= size <= file_size - (start + pos + 8) and (available(8 + size + 4) or available(8 + size)):
+                    # A record that does not end where the file ends or where another record starts is only
+                    # trusted if no other record starts inside it, which is what a torn record looks like
+                    if _starts_frame(buffer[end:end + 4]) or _find_frame(buffer, pos + 8, end) == -1:
+                        if dead:
+                            # Stands in for the body, a dead record is never decompressed
+                            body = b''
+                        else:
+                            with memoryview(buffer) as view:
+                                header = bytes(view[pos + 8:pos + 8 + HEADER_SIZE])
+                                body = view[pos + 8 + HEADER_SIZE:end]
+                                method = size_field >> COMPRESSION_SHIFT
+                                try:
+                                    body = _decompressors[method](body) if method else bytes(body)
+                                except (KeyError, zlib.error, lzma.LZMAError):
+                                    body = None
+            if body is not None:
+                if skipped_from is not None:
+                    if skipped is not None:
+                        skipped.append((skipped_from, start + pos - skipped_from))
+                    skipped_from = None
+                if not dead:
+                    yield (height, start + pos, size_field, header, body)
+                    height += 1
+                pos = end
+                continue
+            if skipped_from is None:
+                skipped_from = start + pos
+            marker = _find_frame(buffer, pos + 1)
+            if marker == -1:
+                # Keeps the last few bytes, which could be the start of a frame cut off by the end of the buffer
+                pos = max(pos + 1, len(buffer) - 3)
+            else:
+                pos = marker
+        if skipped_from is None and pos < len(buffer):
+            skipped_from = start + pos
+        if skipped_from is not None and skipped is not None:
+            skipped.append((skipped_from, start + len(buffer) - skipped_from))
+
+def rebuild_index(filename, skipped=None):
+    """
+    Writes a new index for a blockfile from the blocks iter_blocks() can read out of it, for example after the
+    blockfile was damaged. Must not be called while the blockfile is open in a Blockchain
+    :param1 filename: String, path to a blockfile written by Blockchain
+    :param2 skipped: Optional list, passed on to iter_blocks()
+    :returns: Integer, number of blocks in the new index
+    """
+    count = 0
+    with open(filename + '.idx', 'wb') as index:
+        for _, offset, size_field, header, _ in _iter_records(filename, READ_CHUNK_SIZE, skipped):
+            index.write(INDEX_ENTRY_FORMAT.pack(offset, size_field, hash_SHA(header)))
+            count += 1
+    return count
+
+# Number of block headers checked by a worker at a time in validate_chain()
+VALIDATION_CHUNK_SIZE = 4096
+
+def read_headers(filename, unreadable=None):
+    """
+    Streams the block headers out of a blockfile, one record at a time, without reading the block bodies.
+    Stops at the first record that is not framed by magic_bytes and a size, or that is too short to hold a header.
+    Dead records left by Blockchain.truncate() are stepped over.
+    :param1 filename: String, path to a blockfile written by Blockchain
+    :param2 unreadable: Optional list, the offset of the first record that cannot be read gets appended to it
+    :returns: A generator of 74 byte strings, the header of each block in order
+    """
+    with open(filename, 'rb') as file:
+        file_size = os.fstat(file.fileno()).st_size
+        offset = 0
+        while True:
+            frame = file.read(8)
+            if len(frame) < 8 or frame[0:4] not in (magic_bytes, dead_bytes):
+                break
+            size = bytes_to_int(frame[4:8]) & SIZE_MASK
+            if frame[0:4] == dead_bytes:
+                if offset + 8 + size > file_size:
+                    break
+                file.seek(size, 1)
+                offset += 8 + size
+                continue
+            header = file.read(HEADER_SIZE)
+            if size < HEADER_SIZE or len(header) < HEADER_SIZE or offset + 8 + size > file_size:
+                break
+            # Skips over the block body
+            file.seek(size - HEADER_SIZE, 1)
+            offset += 8 + size
+            yield header
+        if offset != file_size and unreadable is not None:
+            unreadable.append(offset)
+
+def _header_chunks(headers, chunk_size):
+    """
+    Groups headers together so that each group can be handed to a worker in one piece
+    :param1 headers: iterator of 74 byte block headers
+    :param2 chunk_size: Integer, number of headers in each group
+    :returns: A generator of (height of the first header, headers joined into one byte string) tuples
+    """
+    height = 0
+    chunk = []
+    for header in headers:
+        chunk.append(header)
+        if len(chunk) == chunk_size:
+            yield (height, b''.join(chunk))
+            height += len(chunk)
+            chunk = []
+    if chunk:
+        yield (height, b''.join(chunk))
+
+def _validate_chunk(chunk):
+    """
+    Worker function for validate_chain(). Checks the proof of work of every header in a chunk,
+    and the hash links and timestamps between neighbouring headers inside the chunk.
+    :param1 chunk: Tuple of the height of the first header and the headers joined into one byte string
+    :returns: Tuple of the first invalid height in the chunk (None if there is none),
+        the hash of the last header and the timestamp of the last header
+    """
+    start_height, headers = chunk
+    view = memoryview(headers)
+    prev_header = None
+    for i in range(len(headers) // HEADER_SIZE):
+        header = BlockHeader(view[i * HEADER_SIZE:])
+        if prev_header is None:
+            valid = less_than_target(header.block_hash, 10**header.target_exponent)
+        else:
+            valid = is_valid_block(header, prev_header)
+        if not valid:
+            return (start_height + i, None, None)
+        prev_header = header
+    return (None, prev_header.block_hash, prev_header.timestamp)
+
+def validate_chain(filename, workers=None, chunk_size=VALIDATION_CHUNK_SIZE):
+    """
+    Validates every block in a blockfile. Headers are streamed off disk and checked in chunks over a pool
+    of worker processes, then the chunks are stitched together by checking the hash link and timestamp
+    where one chunk meets the next. Every header is hashed once.
+    :param1 filename: String, path to a blockfile written by Blockchain
+    :param2 workers: Integer, number of worker processes. Defaults to the number of CPUs, 1 validates in this process
+    :param3 chunk_size: Integer, number of headers checked by a worker at a time
+    :returns: The height of the first invalid block, or None if the whole chain is valid.
+        A record that cannot be read counts as an invalid block at its height
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    unreadable = []
+    # The first header of each chunk, in chunk order, kept for stitching the chunks together
+    first_headers = deque()
+
+    def chunks():
+        for chunk in _header_chunks(read_headers(filename, unreadable), chunk_size):
+            first_headers.append((chunk[0], len(chunk[1]) // HEADER_SIZE, chunk[1][:HEADER_SIZE]))
+            yield chunk
+
+    pool = Pool(workers) if workers > 1 else None
+    try:
+        # Results come back in chunk order, so the first failure found is the lowest invalid height
+        results = pool.imap(_validate_chunk, chunks()) if pool else map(_validate_chunk, chunks())
+        last_hash = None
+        last_timestamp = None
+        height = 0
+        for invalid_height, chunk_hash, chunk_timestamp in results:
+            start_height, count, first_header = first_headers.popleft()
+            # Checks the first header of this chunk against the last header of the previous chunk
+            if last_hash is not None:
+                first_header = BlockHeader(first_header)
+                if first_header.view[0:32] != last_hash or first_header.timestamp <= last_timestamp:
+                    return start_height
+            if invalid_height is not None:
+                return invalid_height
+            last_hash = chunk_hash
+            last_timestamp = chunk_timestamp
+            height = start_height + count
+    finally:
+        if pool:
+            pool.terminate()
+    # Anything left in the file past the last readable record is an invalid block
+    if unreadable:
+        return height
+    return None
@@ -1,7 +1,124 @@
-import os, ecdsa, hashlib, json, binascii
+import os, ecdsa, hashlib, json, binascii, threading
+from collections import OrderedDict
+from ecdsa.ellipticcurve import PointJacobi
 
 from block import hash_SHA
 
+# Number of signing keys and of verifying keys kept by the key cache
+KEY_CACHE_SIZE = 1024
+# Number of times a verifying key is used before it gets precomputation tables, which take about as long to
+# build as a few verifications and then make every verification about twice as fast
+PRECOMPUTE_AFTER = 8
+
+
+class KeyCache:
+    """
+    Least recently used cache of ecdsa key objects keyed by the bytes of the key, so signing or verifying
+    with the same wallet keys over and over does not decode the key and set it up every time.
+    """
+
+    def __init__(self, max_keys=KEY_CACHE_SIZE, precompute_after=PRECOMPUTE_AFTER):
+        """
+        :param max_keys: number of signing keys and of verifying keys to keep. 0 turns the cache off
+        :param precompute_after: number of uses after which a verifying key gets precomputation tables. 0 never precomputes
+        """
+        self.max_keys = max_keys
+        self.precompute_after = precompute_after
+        self.hits = 0
+        self.misses = 0
+        # Maps key bytes to [key object, number of uses], least recently used first
+        self._signing_keys = OrderedDict()
+        self._verifying_keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, keys, key_bytes, make_key):
+        """
+        Looks a key up in one of the caches, making it and adding it on a miss
+
+        :param keys: the OrderedDict to look in
+        :param key_bytes: bytes of the key
+        :param make_key: function that makes the key object from key_bytes
+        :return: the cached [key object, number of uses] pair, with the uses already counted
+        """
+        with self._lock:
+            entry = keys.get(key_bytes)
+            if entry is not None:
+                keys.move_to_end(key_bytes)
+                entry[1] += 1
+                self.hits += 1
+                return entry
+            self.misses += 1
+        # Made outside the lock, since it is the slow part
+        entry = [make_key(key_bytes), 1]
+        if self.max_keys > 0:
+            with self._lock:
+                keys[key_bytes] = entry
+                while len(keys) > self.max_keys:
+                    keys.popitem(last=False)
+        return entry
+
+    def signing_key(self, private_key):
+        """
+        :param private_key: 32 byte private key
+        :return: ecdsa.SigningKey for private_key on the SECP256k1 curve
+        """
+        return self._get(self._signing_keys, private_key, _make_signing_key)[0]
+
+    def verifying_key(self, public_key):
+        """
+        :param public_key: 64 byte public key
+        :return: ecdsa.VerifyingKey for public_key on the SECP256k1 curve, with precomputation tables once it is hot
+        :raises MalformedPointError: if public_key is not a point on the curve
+        """
+        entry = self._get(self._verifying_keys, public_key, _make_verifying_key)
+        if entry[1] == self.precompute_after:
+            entry[0] = _precomputed_verifying_key(entry[0])
+        return entry[0]
+
+    def clear(self):
+        """
+        Drops every cached key. The hit and miss counters are kept
+        """
+        with self._lock:
+            self._signing_keys.clear()
+            self._verifying_keys.clear()
+
+def _make_signing_key(private_key):
+    return ecdsa.SigningKey.from_string(private_key, curve=ecdsa.SECP256k1)
+
+def _make_verifying_key(public_key):
+    return ecdsa.VerifyingKey.from_string(public_key, curve=ecdsa.SECP256k1)
+
+def _precomputed_verifying_key(verifying_key):
+    """
+    Makes a copy of a verifying key with precomputation tables for its point.
+    The tables need the point to know the order of the curve, which from_string() does not give it
+
+    :param verifying_key: ecdsa.VerifyingKey on the SECP256k1 curve
+    :return: an equivalent ecdsa.VerifyingKey with precomputation tables
+    """
+    curve = ecdsa.SECP256k1
+    point = verifying_key.pubkey.point.to_affine()
+    point = PointJacobi(curve.curve, point.x(), point.y(), 1, curve.order)
+    precomputed = ecdsa.VerifyingKey.from_public_point(point, curve=curve)
+    precomputed.precompute()
+    return precomputed
+
+key_cache = KeyCache()
+
+def get_signing_key(private_key):
+    """
+    :param private_key: 32 byte private key
+    :return: ecdsa.SigningKey for private_key, from the key cache
+    """
+    return key_cache.signing_key(private_key)
+
+def get_verifying_key(public_key):
+    """
+    :param public_key: 64 byte public key
+    :return: ecdsa.VerifyingKey for public_key, from the key cache
+    """
+    return key_cache.verifying_key(public_key)
 
 def generate_private_key():
     """
@@ -19,7 +136,7 @@ def generate_public_key(private_key):
     :param: private key is the randomly generated 32 byte string 
     :return:  verifying key, which effectively is the public key  
     """
-    signing_key = ecdsa.SigningKey.from_string(private_key, curve = ecdsa.SECP256k1)
+    signing_key = get_signing_key(private_key)
     verifying_key = signing_key.get_verifying_key()
     return verifying_key.to_string()
 
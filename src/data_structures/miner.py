@@ -0,0 +1,210 @@
+import os
+import threading
+from time import perf_counter
+from multiprocessing import Pool
+from block import mine_range, long_to_bytes, bytes_to_long
+
+# Number of distinct nonces that fit in the nonce field of a block header
+NONCE_SPACE = 2 ** (8 * len(long_to_bytes(0)))
+
+# Number of nonces handed to a worker at a time
+DEFAULT_CHUNK_SIZE = 2 ** 16
+
+
+def nonce_chunks(previous_hash, data, target, chunk_size=DEFAULT_CHUNK_SIZE, start_nonce=0):
+    """
+    Splits the nonce space into chunks of work for the parallel miner.
+    Once every nonce has been handed out it starts again from zero. By then the clock has moved on,
+    so the workers build the headers with a new timestamp and the search continues over fresh headers.
+
+    :param1 previous_hash: This is a 32 byte string representing the hash of a previous block
+    :param2 data: This is a 32 byte string
+    :param3 target: This is a unsigned integer representing the target number which the hash of the new block has to meet
+    :param4 chunk_size: Integer, number of nonces in each chunk
+    :param5 start_nonce: Integer, the nonce the first chunk starts at
+    :returns: A generator of (previous_hash, data, target, start_nonce, count) tuples, one per chunk
+    """
+    nonce = start_nonce % NONCE_SPACE
+    while True:
+        count = min(chunk_size, NONCE_SPACE - nonce)
+        yield (previous_hash, data, target, nonce, count)
+        nonce = (nonce + count) % NONCE_SPACE
+
+
+def _mine_chunk(chunk):
+    """
+    Worker function for the parallel miner, runs mine_range() over a single chunk
+
+    :param chunk: A tuple as generated by nonce_chunks()
+    :returns: A block header if one was found in the chunk, None otherwise
+    """
+    return mine_range(*chunk)
+
+
+def mine_parallel(previous_hash, data, target, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Creates a block header using the proof of work algorithm, spreading the nonce space over a pool
+    of worker processes. As soon as one worker finds a header whose hash is under the target every
+    other worker is stopped.
+
+    :param1 previous_hash: This is a 32 byte string representing the hash of a previous block
+    :param2 data: This is a 32 byte string
+    :param3 target: This is a unsigned integer representing the target number which the hash of the new block has to meet
+    :param4 workers: Integer, number of worker processes. Defaults to the number of CPUs
+    :param5 chunk_size: Integer, number of nonces a worker tries before asking for more work
+    :returns: A block header in the same format as the output of mine()
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    chunks = nonce_chunks(previous_hash, data, target, chunk_size)
+    # Leaving the with block terminates the pool, which stops the workers that are still mining
+    with Pool(workers) as pool:
+        for block_header in pool.imap_unordered(_mine_chunk, chunks):
+            if block_header is not None:
+                return block_header
+
+
+class MiningJob:
+
+    def __init__(self, previous_hash, data, target, start_nonce=0, workers=1, chunk_size=DEFAULT_CHUNK_SIZE, on_found=None):
+        """
+        Constructor for a mining job that runs in the background until it finds a block header,
+        is cancelled, or is pointed at a new block with retarget().
+
+        :param previous_hash: This is a 32 byte string representing the hash of a previous block
+        :param data: This is a 32 byte string
+        :param target: This is a unsigned integer representing the target number which the hash of the new block has to meet
+        :param start_nonce: Integer, nonce to start mining from. Pass in the nonce of a cancelled job to resume it
+        :param workers: Integer, number of worker processes. With 1 the job mines on its own background thread
+        :param chunk_size: Integer, number of nonces mined between checks for cancellation
+        :param on_found: Function called with the block header once it is found. Called from the background thread
+        """
+        self.previous_hash = previous_hash
+        self.data = data
+        self.target = target
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.on_found = on_found
+        self.nonce = start_nonce
+        self.hashes = 0
+        self.result = None
+        self.found = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._elapsed = 0.0
+        self._started_at = None
+
+    def start(self):
+        """
+        Starts mining on a background thread. Does nothing if the job is already running or has found a header.
+
+        :param self: reference to self
+        """
+        if self.is_running() or self.found.is_set():
+            return
+        self._stop.clear()
+        self._started_at = perf_counter()
+        self._thread = threading.Thread(target=self._run, name="Mining Job", daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        """
+        Stops mining and waits for the background thread to finish.
+        The nonce member is left at the first nonce that has not been fully tried, so the job can be resumed.
+
+        :param self: reference to self
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def retarget(self, previous_hash, data, target, start_nonce=0):
+        """
+        Points the job at a new block, for example when a peer announces a new chain tip.
+        Stops any mining on the old block, resets the statistics and starts again on the new one.
+
+        :param previous_hash: This is a 32 byte string representing the hash of the new previous block
+        :param data: This is a 32 byte string
+        :param target: This is a unsigned integer representing the target number which the hash of the new block has to meet
+        :param start_nonce: Integer, nonce to start mining from
+        """
+        self.cancel()
+        self.previous_hash = previous_hash
+        self.data = data
+        self.target = target
+        self.nonce = start_nonce
+        self.hashes = 0
+        self.result = None
+        self.found.clear()
+        self._elapsed = 0.0
+        self.start()
+
+    def is_running(self):
+        """
+        :returns: True if the job is currently mining, False otherwise
+        """
+        return self._thread is not None and self._thread.is_alive()
+
+    def elapsed(self):
+        """
+        :returns: Float, number of seconds the job has spent mining
+        """
+        started_at = self._started_at
+        if started_at is not None:
+            return self._elapsed + perf_counter() - started_at
+        return self._elapsed
+
+    def hashrate(self):
+        """
+        :returns: Float, average number of hashes tried per second
+        """
+        elapsed = self.elapsed()
+        if elapsed == 0:
+            return 0.0
+        return self.hashes / elapsed
+
+    def _run(self):
+        """
+        Body of the background thread. Mines one chunk at a time, updating the statistics and
+        nonce checkpoint after each one, until a header is found or the job is stopped.
+
+        :param self: reference to self
+        """
+        chunks = nonce_chunks(self.previous_hash, self.data, self.target, self.chunk_size, self.nonce)
+        # A second copy of the chunks, used to match each result up with the nonces it covered
+        checkpoints = nonce_chunks(self.previous_hash, self.data, self.target, self.chunk_size, self.nonce)
+        try:
+            if self.workers == 1:
+                self._mine_chunks(map(_mine_chunk, chunks), checkpoints)
+            else:
+                # imap hands back results in chunk order, so the checkpoint never skips an unfinished chunk
+                with Pool(self.workers) as pool:
+                    self._mine_chunks(pool.imap(_mine_chunk, chunks), checkpoints)
+        finally:
+            self._elapsed += perf_counter() - self._started_at
+            self._started_at = None
+
+    def _mine_chunks(self, results, chunks):
+        """
+        Goes through the results of mining each chunk in order until a header is found or the job is stopped
+
+        :param results: iterator of mine_range() results, one per chunk
+        :param chunks: iterator of the chunks the results belong to, as generated by nonce_chunks()
+        """
+        nonce_size = len(long_to_bytes(0))
+        for block_header in results:
+            if self._stop.is_set():
+                return
+            chunk_start, count = next(chunks)[3:]
+            if block_header is not None:
+                winning_nonce = bytes_to_long(block_header[-nonce_size:])
+                self.hashes += winning_nonce - chunk_start + 1
+                self.nonce = winning_nonce
+                self.result = block_header
+                self.found.set()
+                if self.on_found is not None:
+                    self.on_found(block_header)
+                return
+            self.hashes += count
+            self.nonce = (chunk_start + count) % NONCE_SPACE
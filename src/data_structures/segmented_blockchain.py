@@ -0,0 +1,293 @@
+import os
+import os.path
+import re
+from struct import Struct
+from block import int_to_bytes, hash_SHA, HEADER_SIZE
+from blockchain import magic_bytes, write_parts, extract, block_prefix, make_size_field, compress_block, decompress_block, SIZE_MASK
+
+# Size a segment can grow to before the next block goes into a new segment
+DEFAULT_SEGMENT_SIZE = 128 * 1024 * 1024
+
+# Start of every segment file: segment magic, height of the first block in the segment, number of blocks in it
+SEGMENT_HEADER_FORMAT = Struct('<IQQ')
+segment_magic = 3652501242
+# Names of segment files, anything else in the directory is left alone
+SEGMENT_NAME = re.compile(r'blk(\d+)\.dat')
+
+# Layout of an entry in the shared index: segment number, offset of the record in the segment, size field of the
+# record with the same compression flag as Blockchain, hash of the block. The entry for height h is stored at h * SEGMENT_INDEX_ENTRY_FORMAT.size
+SEGMENT_INDEX_ENTRY_FORMAT = Struct('<IQI32s')
+
+# Every block header is also kept in one file of fixed size entries, which survives pruning
+HEADER_ENTRY_FORMAT = Struct('<%ds' % HEADER_SIZE)
+
+
+def segment_filename(directory, number):
+    """
+    :param1 directory: String, directory the segments are stored in
+    :param2 number: Integer, number of the segment
+    :returns: String, path to the segment file
+    """
+    return os.path.join(directory, 'blk%05d.dat' % number)
+
+
+def read_segment_header(filename):
+    """
+    Reads the height range out of the header of a segment file
+    :param filename: String, path to the segment file
+    :returns: Tuple of the height of the first block and the number of blocks, None if the file is not a segment
+    """
+    with open(filename, 'rb') as file:
+        header = file.read(SEGMENT_HEADER_FORMAT.size)
+    if len(header) < SEGMENT_HEADER_FORMAT.size:
+        return None
+    magic, first_height, count = SEGMENT_HEADER_FORMAT.unpack(header)
+    if magic != segment_magic:
+        return None
+    return (first_height, count)
+
+
+class SegmentedBlockchain:
+
+    def __init__(self, directory, segment_size=DEFAULT_SEGMENT_SIZE, compression=None):
+        """
+        Constructor for a blockchain stored in numbered segment files in a directory, blk00000.dat, blk00001.dat...
+        Blocks are written with the same magic_bytes and size framing as Blockchain. Once a segment reaches
+        segment_size the next block starts a new one, and old segments can then be deleted with prune().
+        Every block header is also kept in headers.dat, and the shared index maps heights to segments,
+        so headers and block lookups keep working after the segments holding the blocks are gone.
+        :param directory: String, directory to keep the segments in. Created if it does not exist
+        :param segment_size: Integer, number of bytes a segment can grow to before a new one is started
+        :param compression: String, 'zlib' or 'lzma' to compress the body of each block written, None to write blocks raw.
+            Records are framed and flagged the same as in a compressed Blockchain
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self.compression = compression
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.indexfile = os.path.join(directory, 'index.idx')
+        self.headerfile = os.path.join(directory, 'headers.dat')
+        for filename in (self.indexfile, self.headerfile):
+            if not os.path.isfile(filename):
+                with open(filename, 'wb') as f: pass
+
+        # Height range of every segment still on disk, keyed by segment number
+        self.segments = {}
+        for name in os.listdir(directory):
+            match = SEGMENT_NAME.fullmatch(name)
+            if match:
+                height_range = read_segment_header(os.path.join(directory, name))
+                if height_range is not None:
+                    self.segments[int(match.group(1))] = height_range
+
+        self.block_count = os.path.getsize(self.indexfile) // SEGMENT_INDEX_ENTRY_FORMAT.size
+        # The last block, None until it is read back from its segment
+        self._last_block = None
+        self._segment_fd = None
+        self._recover()
+
+    def _recover(self):
+        """
+        Makes the segments and headers agree with the index, which is written last for every batch of blocks.
+        Index entries whose records are not all there are dropped, and records and headers written after the
+        last index entry are cut off. Segments started after the last index entry hold no blocks of the chain
+        and are deleted, so the newest segment left always starts at or below block_count.
+        """
+        while self.block_count > 0:
+            number, offset, size, _ = self._read_index_entry(self.block_count - 1)
+            filename = segment_filename(self.directory, number)
+            if number in self.segments and offset + 8 + (size & SIZE_MASK) <= os.path.getsize(filename):
+                break
+            self.block_count -= 1
+        os.truncate(self.indexfile, self.block_count * SEGMENT_INDEX_ENTRY_FORMAT.size)
+        os.truncate(self.headerfile, self.block_count * HEADER_ENTRY_FORMAT.size)
+
+        dropped = [number for number, (first_height, _) in self.segments.items() if first_height > self.block_count]
+        for number in dropped:
+            os.remove(segment_filename(self.directory, number))
+            del self.segments[number]
+        if not self.segments:
+            self._start_segment(min(dropped, default=0))
+            return
+        number = max(self.segments)
+        first_height = self.segments[number][0]
+        end = SEGMENT_HEADER_FORMAT.size
+        if self.block_count > first_height:
+            _, offset, size, _ = self._read_index_entry(self.block_count - 1)
+            end = offset + 8 + (size & SIZE_MASK)
+        os.truncate(segment_filename(self.directory, number), end)
+        self._open_segment(number)
+        self._write_segment_count(max(0, self.block_count - first_height))
+
+    @property
+    def last_block(self):
+        """
+        :returns: The block at the tip of the chain as a byte string, empty if there are no blocks or it has been pruned
+        """
+        if self._last_block is None:
+            self._last_block = self.get_block_by_height(self.block_count - 1) or b''
+        return self._last_block
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Closes the segment being written to
+        """
+        if self._segment_fd is not None:
+            os.close(self._segment_fd)
+            self._segment_fd = None
+
+    def _start_segment(self, number):
+        """
+        Creates a new, empty segment whose first block will be the next block added
+        :param number: Integer, number of the new segment
+        """
+        self.close()
+        with open(segment_filename(self.directory, number), 'wb') as file:
+            file.write(SEGMENT_HEADER_FORMAT.pack(segment_magic, self.block_count, 0))
+        self.segments[number] = (self.block_count, 0)
+        self._open_segment(number)
+
+    def _open_segment(self, number):
+        """
+        Opens a segment for appending
+        :param number: Integer, number of the segment
+        """
+        self.current_segment = number
+        self._segment_fd = os.open(segment_filename(self.directory, number), os.O_WRONLY | os.O_APPEND)
+
+    def _write_segment_count(self, count):
+        """
+        Updates the number of blocks in the header of the current segment
+        :param count: Integer, number of blocks in the current segment
+        """
+        first_height = self.segments[self.current_segment][0]
+        with open(segment_filename(self.directory, self.current_segment), 'r+b') as file:
+            file.write(SEGMENT_HEADER_FORMAT.pack(segment_magic, first_height, count))
+        self.segments[self.current_segment] = (first_height, count)
+
+    def add_block(self, block):
+        """
+        Adds a block to the end of the current segment, starting a new segment first if it is full
+        :param block: A byte string representing a block, or a list of byte strings that make up a block
+            such as the output of BlockBuilder.build()
+        """
+        self.add_blocks([block])
+
+    def add_blocks(self, blocks):
+        """
+        Adds many blocks at once. Records going into the same segment are written together, then their
+        headers, then their index entries, which is what makes them part of the chain.
+        Blocks given as lists of pieces are written piece by piece without being joined, unless they are compressed.
+        :param blocks: An iterable of blocks, each one in any form add_block() accepts
+        :raises ValueError: if a block is shorter than a header or too big to be stored. Blocks before it in
+            the same segment are not written either
+        """
+        batch = []
+        batch_size = 0
+        segment_end = os.fstat(self._segment_fd).st_size
+        for block in blocks:
+            block_parts = list(block) if isinstance(block, (list, tuple)) else [block]
+            block_size = sum(map(len, block_parts))
+            if block_size < HEADER_SIZE:
+                raise ValueError("block is shorter than a block header")
+            if self.compression is not None:
+                stored, size_field = compress_block(b''.join(block_parts), self.compression)
+                block_parts = [stored]
+            else:
+                size_field = make_size_field(block_size)
+            record_size = 8 + (size_field & SIZE_MASK)
+            # Rolls over to a new segment when this block would take the current one past segment_size,
+            # unless the segment is still empty
+            if segment_end + batch_size + record_size > self.segment_size and self.block_count + len(batch) > self.segments[self.current_segment][0]:
+                self._write_batch(batch, segment_end)
+                self._start_segment(self.current_segment + 1)
+                batch = []
+                batch_size = 0
+                segment_end = SEGMENT_HEADER_FORMAT.size
+            batch.append((block_parts, size_field))
+            batch_size += record_size
+        self._write_batch(batch, segment_end)
+
+    def _write_batch(self, blocks, offset):
+        """
+        Writes blocks to the end of the current segment and records them in the headers file and index
+        :param1 blocks: A list of (pieces of the stored block, size field) tuples
+        :param2 offset: Integer, where the first record starts in the current segment
+        """
+        if not blocks:
+            return
+        parts = []
+        headers = []
+        entries = []
+        for block_parts, size_field in blocks:
+            header = block_prefix(block_parts, HEADER_SIZE)
+            parts += [magic_bytes, int_to_bytes(size_field)] + block_parts
+            headers.append(HEADER_ENTRY_FORMAT.pack(header))
+            entries.append(SEGMENT_INDEX_ENTRY_FORMAT.pack(self.current_segment, offset, size_field, hash_SHA(header)))
+            offset += 8 + (size_field & SIZE_MASK)
+        write_parts(self._segment_fd, parts)
+        with open(self.headerfile, 'ab') as file:
+            file.write(b''.join(headers))
+        with open(self.indexfile, 'ab') as file:
+            file.write(b''.join(entries))
+        self.block_count += len(blocks)
+        # A block stored raw in one piece is kept as it is, any other is read back when last_block is asked for
+        block_parts, size_field = blocks[-1]
+        self._last_block = block_parts[0] if len(block_parts) == 1 and size_field <= SIZE_MASK else None
+        self._write_segment_count(self.block_count - self.segments[self.current_segment][0])
+
+    def _read_index_entry(self, height):
+        """
+        :param height: Integer, height of the block
+        :returns: Tuple of the segment number, offset of the record, size field of the record and hash of the block
+        """
+        return SEGMENT_INDEX_ENTRY_FORMAT.unpack(extract(self.indexfile, height * SEGMENT_INDEX_ENTRY_FORMAT.size, SEGMENT_INDEX_ENTRY_FORMAT.size))
+
+    def get_block_by_height(self, height):
+        """
+        :param height: Integer, height of the block, 0 being the first block
+        :returns: The block at height as a byte string, None if there is no block at height or it has been pruned
+        """
+        if not 0 <= height < self.block_count:
+            return None
+        number, offset, size, _ = self._read_index_entry(height)
+        if number not in self.segments:
+            return None
+        return decompress_block(extract(segment_filename(self.directory, number), offset + 8, size & SIZE_MASK), size)
+
+    def get_header(self, height):
+        """
+        :param height: Integer, height of the block, 0 being the first block
+        :returns: The header of the block at height, still available after the block has been pruned. None if there is no block at height
+        """
+        if not 0 <= height < self.block_count:
+            return None
+        return extract(self.headerfile, height * HEADER_ENTRY_FORMAT.size, HEADER_ENTRY_FORMAT.size)
+
+    def prune(self, height):
+        """
+        Deletes every segment that only holds blocks below height. The segment being written to is never deleted,
+        and the headers and index are kept
+        :param height: Integer, lowest height whose block has to be kept
+        :returns: List of the numbers of the segments that were deleted
+        """
+        deleted = []
+        for number, (first_height, count) in sorted(self.segments.items()):
+            if number != self.current_segment and first_height + count <= height:
+                os.remove(segment_filename(self.directory, number))
+                del self.segments[number]
+                deleted.append(number)
+        return deleted
+
+    def pruned_height(self):
+        """
+        :returns: Integer, height of the lowest block still stored in a segment
+        """
+        return min(first_height for first_height, _ in self.segments.values())
@@ -0,0 +1,182 @@
+import sqlite3
+import threading
+from block import bytes_to_int, HEADER_SIZE, BlockHeader
+from blockchain import Blockchain, block_prefix
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS blocks (
+    height INTEGER PRIMARY KEY,
+    hash BLOB NOT NULL,
+    prev_hash BLOB NOT NULL,
+    offset INTEGER NOT NULL,
+    timestamp INTEGER NOT NULL,
+    target_exponent INTEGER NOT NULL,
+    tx_count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blocks_hash ON blocks (hash);
+CREATE INDEX IF NOT EXISTS blocks_prev_hash ON blocks (prev_hash);
+CREATE INDEX IF NOT EXISTS blocks_timestamp ON blocks (timestamp);
+'''
+
+COLUMNS = ('height', 'hash', 'prev_hash', 'offset', 'timestamp', 'target_exponent', 'tx_count')
+INSERT_SQL = 'INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?, ?, ?, ?)'
+
+# Number of blocks whose rows are made and inserted at a time when the database is caught up with the blockfile
+CATCH_UP_BATCH_SIZE = 1024
+
+
+def block_metadata(height, offset, block):
+    """
+    Works out the row stored for a block
+    :param1 height: Integer, height of the block
+    :param2 offset: Integer, offset of the block's record in the blockfile
+    :param3 block: Byte string of the block, or a list of byte strings that make up the block.
+        Blocks made by BlockBuilder have the number of transactions after the header
+    :returns: Tuple of the values for COLUMNS
+    """
+    start = block_prefix(block, HEADER_SIZE + 4)
+    header = BlockHeader(start)
+    tx_count = bytes_to_int(start[HEADER_SIZE:]) if len(start) == HEADER_SIZE + 4 else 0
+    return (height, header.block_hash, header.prev_hash, offset, header.timestamp, header.target_exponent, tx_count)
+
+
+class SQLiteBlockchain(Blockchain):
+
+    def __init__(self, filename, database=None, **kwargs):
+        """
+        Constructor for a Blockchain that also keeps the metadata of every block in an SQLite database, so
+        blocks can be looked up by timestamp or previous hash with an indexed query. Blocks stay in the
+        blockfile and its index, which remain the record of what is in the chain: the database is brought
+        back in line with them when the chain is opened.
+        The database is in write ahead log mode, so threads reading metadata run alongside the thread adding
+        blocks. Every thread gets its own connection. Like the rest of Blockchain, queries never return blocks
+        that have not been published yet.
+        :param filename: String, path to the blockfile
+        :param database: String, path to the database. Defaults to the blockfile's path with .sqlite on the end
+        :param kwargs: Passed on to Blockchain
+        """
+        self.database = database if database is not None else filename + '.sqlite'
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        # The writer's connection is made first, so the tables exist before anyone reads them
+        self._writer = self._connection()
+        self._writer.execute('PRAGMA journal_mode=WAL')
+        self._writer.executescript(SCHEMA)
+        super().__init__(filename, **kwargs)
+        self._catch_up()
+
+    def _connection(self):
+        """
+        :returns: The calling thread's connection to the database, opened the first time it is needed
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.database, check_same_thread=False)
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def _catch_up(self):
+        """
+        Drops rows for blocks no longer in the blockfile and adds rows for blocks the database is missing,
+        for example after a crash between writing blocks and writing their metadata. Missing rows are found
+        anywhere in the table, not just after the highest one, and are filled in CATCH_UP_BATCH_SIZE blocks
+        at a time in a single transaction, so only one batch of rows is held in memory
+        """
+        with self._writer:
+            self._writer.execute('DELETE FROM blocks WHERE height >= ?', (self.block_count,))
+            # Every row left is for a height below block_count, so the table is complete if the counts agree
+            if self._writer.execute('SELECT COUNT(*) FROM blocks').fetchone()[0] == self.block_count:
+                return
+            for start, end in self._missing_ranges():
+                for batch_start in range(start, end, CATCH_UP_BATCH_SIZE):
+                    heights = range(batch_start, min(batch_start + CATCH_UP_BATCH_SIZE, end))
+                    # Each block is dropped as soon as its row is made
+                    rows = [block_metadata(h, self.get_block_location(h)[0] - 8, self.get_block_by_height(h)) for h in heights]
+                    self._writer.executemany(INSERT_SQL, rows)
+
+    def _missing_ranges(self):
+        """
+        :returns: A list of (first height, height after the last) tuples, one for each run of heights below
+            block_count that have no row in the database
+        """
+        starts = self._writer.execute(
+            'SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM blocks WHERE height = 0) '
+            'UNION SELECT height + 1 FROM blocks WHERE height + 1 < ? AND height + 1 NOT IN (SELECT height FROM blocks) '
+            'ORDER BY 1', (self.block_count,)).fetchall()
+        ranges = []
+        for (start,) in starts:
+            end = self._writer.execute('SELECT COALESCE(MIN(height), ?) FROM blocks WHERE height > ?', (self.block_count, start)).fetchone()[0]
+            if start < end:
+                ranges.append((start, end))
+        return ranges
+
+    def close(self):
+        """
+        Closes the blockfile, the index and every connection to the database
+        """
+        super().close()
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+        self._local = threading.local()
+
+    def _blocks_written(self, start_height, blocks, offsets):
+        """
+        Stores the metadata of blocks added by add_blocks() with a single transaction, before the blocks
+        are written, so a reader that sees a block can always find its metadata and a block whose metadata
+        cannot be stored is never added. Rows left for heights past block_count by a write that failed after
+        this are never returned by queries, and are replaced when blocks are next added at those heights
+        :param1 start_height: Integer, height of the first block
+        :param2 blocks: A list of the blocks in height order, as given to add_blocks()
+        :param3 offsets: A list of integers, the offset of each block's record in the blockfile
+        """
+        rows = [block_metadata(start_height + i, offsets[i], block) for i, block in enumerate(blocks)]
+        with self._writer:
+            self._writer.executemany(INSERT_SQL, rows)
+
+    def truncate(self, height):
+        """
+        Cuts the chain back like Blockchain.truncate(), then deletes the metadata of the dropped blocks
+        :param height: Integer, number of blocks to keep
+        """
+        super().truncate(height)
+        with self._writer:
+            self._writer.execute('DELETE FROM blocks WHERE height >= ?', (height,))
+
+    def _query(self, where, parameters):
+        """
+        Runs a query for blocks on the calling thread's connection, leaving out blocks that are not published
+        :param1 where: String, SQL condition on the columns of the blocks table
+        :param2 parameters: Tuple of the values for the placeholders in where
+        :returns: List of dictionaries, one per block, in height order
+        """
+        sql = 'SELECT * FROM blocks WHERE height < ? AND (%s) ORDER BY height' % where
+        rows = self._connection().execute(sql, (self.block_count,) + tuple(parameters)).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def get_metadata(self, height):
+        """
+        :param height: Integer, height of the block, 0 being the first block
+        :returns: Dictionary of the block's metadata keyed by COLUMNS, None if there is no block at height
+        """
+        rows = self._query('height = ?', (height,))
+        return rows[0] if rows else None
+
+    def get_blocks_between(self, start_time, end_time):
+        """
+        :param1 start_time: Integer, earliest timestamp to include
+        :param2 end_time: Integer, latest timestamp to include
+        :returns: List of metadata dictionaries for the blocks with a timestamp from start_time to end_time
+        """
+        return self._query('timestamp BETWEEN ? AND ?', (start_time, end_time))
+
+    def get_children(self, block_hash):
+        """
+        :param block_hash: 32 byte string, hash of a block header
+        :returns: List of metadata dictionaries for the blocks whose previous hash is block_hash
+        """
+        return self._query('prev_hash = ?', (block_hash,))
@@ -1,6 +1,89 @@
-from block import hash_SHA, long_to_bytes, short_to_bytes, bytes_to_short, bytes_to_long
+from block import hash_SHA, long_to_bytes, short_to_bytes, bytes_to_short, bytes_to_long, get_merkle_root
+from keys import get_signing_key, get_verifying_key
+import os
 import ecdsa
-from collections import deque
+from ecdsa.errors import MalformedPointError
+import threading
+from collections import deque, OrderedDict
+from multiprocessing import Pool
+from struct import Struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Number of inputs handed to a worker at a time by verify_transaction_inputs()
+VERIFY_CHUNK_SIZE = 16
+# Number of verified signatures remembered by the signature cache
+SIGNATURE_CACHE_SIZE = 100000
+
+# Sizes of the records made by create_input() and create_output()
+INPUT_SIZE = 162
+OUTPUT_SIZE = 36
+OUTPUT_FORMAT = Struct('<L32s')
+
+# Layouts of the same records for NumPy, used by parse_inputs() and parse_outputs().
+# Byte fields are void rather than 'S' so trailing zero bytes of a hash or key are not dropped
+if np is not None:
+    INPUT_DTYPE = np.dtype([('previous_tx_hash', 'V32'), ('index', '<u2'), ('signature', 'V64'), ('public_key', 'V64')])
+    OUTPUT_DTYPE = np.dtype([('value', '<u4'), ('recipient', 'V32')])
+else:
+    INPUT_DTYPE = OUTPUT_DTYPE = None
+
+
+class SignatureCache:
+    """
+    Least recently used set of signatures that have already been checked and found valid, so an input checked
+    when its transaction is first seen is not checked again when the transaction turns up in a block.
+    Only valid signatures are kept, so a bad input can never be let through by the cache.
+    """
+
+    def __init__(self, max_entries=SIGNATURE_CACHE_SIZE):
+        """
+        :param max_entries: number of verified signatures to keep. 0 turns the cache off
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # Maps the keys made by signature_cache_key() to None, least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def add(self, key):
+        """
+        Remembers a signature that was found valid
+
+        :param key: key made by signature_cache_key()
+        """
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = None
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Drops every cached signature. The hit and miss counters are kept
+        """
+        with self._lock:
+            self._entries.clear()
+
+signature_cache = SignatureCache()
 
 
 def create_output(value, recipient):
@@ -27,8 +110,8 @@ def sign_transaction(private_key, prev_tx_hash, prev_tx_locking_script, new_tx_o
     concat = prev_tx_hash + prev_tx_locking_script + new_tx_output
     # hashes the concatenated keys
     unsigned_tx_hash = hash_SHA(concat)
-    # creates signing key
-    signing_key = ecdsa.SigningKey.from_string(private_key,curve=ecdsa.SECP256k1)
+    # gets the signing key, decoded once and then kept in the key cache
+    signing_key = get_signing_key(private_key)
     # signs the hashed transaction
     return signing_key.sign(unsigned_tx_hash)
 
@@ -78,3 +161,156 @@ def parse_output(output):
     parsed_output["recipient"] = output[4:36]
     # Return the dictionary
     return parsed_output
+
+def _view_records(data, dtype, size, offset, count):
+    """
+    Views a run of fixed size records in a buffer as a NumPy structured array, without copying it
+
+    :param data: bytes-like object holding the records back to back
+    :param dtype: NumPy dtype of one record
+    :param size: size of one record in bytes
+    :param offset: byte offset of the first record in data
+    :param count: number of records, or -1 for every record up to the end of data
+    :return: read only structured array over data
+    :raises ValueError: if data does not hold a whole number of records
+    """
+    if np is None:
+        raise ImportError("NumPy is needed to parse transaction records in bulk")
+    if count < 0 and (memoryview(data).nbytes - offset) % size:
+        raise ValueError("data is not a whole number of %d byte records" % size)
+    return np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+
+def parse_inputs(data, offset=0, count=-1):
+    """
+    Parses many transaction inputs, made by create_input() and laid out back to back, at once.
+    Field names match parse_input(), so records['index'] is an array of every index. Bytes of one
+    field of one input are given by bytes(records['public_key'][i])
+
+    :param data: bytes-like object holding the inputs
+    :param offset: byte offset of the first input in data
+    :param count: number of inputs, or -1 for every input up to the end of data
+    :return: NumPy structured array of INPUT_DTYPE viewing data
+    :raises ValueError: if data does not hold a whole number of inputs
+    """
+    return _view_records(data, INPUT_DTYPE, INPUT_SIZE, offset, count)
+
+def parse_outputs(data, offset=0, count=-1):
+    """
+    Parses many transaction outputs, made by create_output() and laid out back to back, at once.
+    Field names match parse_output()
+
+    :param data: bytes-like object holding the outputs
+    :param offset: byte offset of the first output in data
+    :param count: number of outputs, or -1 for every output up to the end of data
+    :return: NumPy structured array of OUTPUT_DTYPE viewing data
+    :raises ValueError: if data does not hold a whole number of outputs
+    """
+    return _view_records(data, OUTPUT_DTYPE, OUTPUT_SIZE, offset, count)
+
+def total_output_value(data):
+    """
+    Adds up the value of many transaction outputs laid out back to back, such as every output in a block.
+    Uses NumPy when it is installed
+
+    :param data: bytes-like object holding the outputs
+    :return: Integer, sum of the values of the outputs
+    :raises ValueError: if data does not hold a whole number of outputs
+    """
+    if np is not None:
+        return int(parse_outputs(data)['value'].sum(dtype=np.uint64))
+    if memoryview(data).nbytes % OUTPUT_SIZE:
+        raise ValueError("data is not a whole number of %d byte records" % OUTPUT_SIZE)
+    return sum(value for value, recipient in OUTPUT_FORMAT.iter_unpack(data))
+
+def signature_cache_key(input, prev_tx_locking_script, new_tx_output):
+    """
+    Makes the key a transaction input is kept under in a SignatureCache, the hash of what the input signed
+    followed by its signature and public key
+
+    :param input: Transaction input, as made by create_input()
+    :param prev_tx_locking_script: locking script to the previous transaction
+    :param new_tx_output: the output of the new transaction
+    :return: 32 byte key
+    """
+    parsed_input = parse_input(input)
+    unsigned_tx_hash = hash_SHA(parsed_input["previous_tx_hash"] + prev_tx_locking_script + new_tx_output)
+    return hash_SHA(unsigned_tx_hash + parsed_input["signature"] + parsed_input["public_key"])
+
+def _check_signature(input, prev_tx_locking_script, new_tx_output):
+    """
+    Checks the signature in a transaction input without looking at any cache
+
+    :return: True if the signature is valid, False otherwise
+    """
+    parsed_input = parse_input(input)
+    unsigned_tx_hash = hash_SHA(parsed_input["previous_tx_hash"] + prev_tx_locking_script + new_tx_output)
+    try:
+        verifying_key = get_verifying_key(parsed_input["public_key"])
+        return verifying_key.verify(parsed_input["signature"], unsigned_tx_hash)
+    except (ecdsa.BadSignatureError, MalformedPointError):
+        return False
+
+def verify_transaction_input(input, prev_tx_locking_script, new_tx_output, cache=signature_cache):
+    """
+    Checks the signature in a transaction input, by rebuilding the hash that sign_transaction() signed
+
+    :param input: Transaction input, as made by create_input()
+    :param prev_tx_locking_script: locking script to the previous transaction
+    :param new_tx_output: the output of the new transaction
+    :param cache: SignatureCache to look the input up in and to add it to once verified. None always checks the signature
+    :return: True if the signature was made with the private key of the input's public key, False otherwise
+    """
+    if cache is None:
+        return _check_signature(input, prev_tx_locking_script, new_tx_output)
+    key = signature_cache_key(input, prev_tx_locking_script, new_tx_output)
+    if key in cache:
+        return True
+    valid = _check_signature(input, prev_tx_locking_script, new_tx_output)
+    if valid:
+        cache.add(key)
+    return valid
+
+def _verify_item(item):
+    """
+    Worker function for verify_transaction_inputs()
+
+    :param item: Tuple of the arguments to _check_signature()
+    :return: result of _check_signature()
+    """
+    return _check_signature(*item)
+
+def verify_transaction_inputs(items, workers=None, chunk_size=VERIFY_CHUNK_SIZE, cache=signature_cache):
+    """
+    Checks the signatures of many transaction inputs, such as every input in a block, spread over a pool
+    of worker processes. Inputs already in the cache, such as those checked when their transaction was first
+    seen, are not checked again, so only the new ones are handed to the workers
+
+    :param items: iterable of (input, prev_tx_locking_script, new_tx_output) tuples
+    :param workers: number of worker processes. Defaults to the number of CPUs. With 1 the inputs are checked in this process
+    :param chunk_size: number of inputs handed to a worker at a time
+    :param cache: SignatureCache shared with verify_transaction_input(). None checks every input
+    :return: list of booleans, the result of verify_transaction_input() for each item in order
+    """
+    items = list(items)
+    if cache is None:
+        keys = [None] * len(items)
+        unchecked = list(range(len(items)))
+    else:
+        keys = [signature_cache_key(*item) for item in items]
+        unchecked = [i for i, key in enumerate(keys) if key not in cache]
+    results = [True] * len(items)
+    if not unchecked:
+        return results
+    if workers is None:
+        workers = os.cpu_count() or 1
+    # Starting a pool costs more than checking a handful of signatures
+    if workers == 1 or len(unchecked) <= chunk_size:
+        checked = [_verify_item(items[i]) for i in unchecked]
+    else:
+        with Pool(min(workers, -(-len(unchecked) // chunk_size))) as pool:
+            checked = pool.map(_verify_item, [items[i] for i in unchecked], chunk_size)
+    for i, valid in zip(unchecked, checked):
+        results[i] = valid
+        if valid and cache is not None:
+            cache.add(keys[i])
+    return results
@@ -0,0 +1,160 @@
+import os
+from struct import Struct
+from block import short_to_bytes
+
+# Start of a snapshot file: snapshot magic, number of blocks applied, hash of the last block applied, number of outputs
+SNAPSHOT_HEADER_FORMAT = Struct('<IQ32sQ')
+snapshot_magic = 3652501243
+
+# An unspent output is keyed by the hash of its transaction followed by its index as a short, which is exactly
+# how the first 34 bytes of an input spending it are laid out, and stored as the 36 bytes made by create_output()
+KEY_SIZE = 34
+OUTPUT_SIZE = 36
+SNAPSHOT_ENTRY_FORMAT = Struct('<%ds%ds' % (KEY_SIZE, OUTPUT_SIZE))
+
+
+def outpoint(tx_hash, index):
+    """
+    :param1 tx_hash: 32 byte hash of a transaction
+    :param2 index: Integer, index of the output in the transaction
+    :returns: 34 byte key of the output in a UTXOSet
+    """
+    return tx_hash + short_to_bytes(index)
+
+
+class UTXOSet:
+
+    def __init__(self):
+        """
+        Constructor for an empty set of unspent transaction outputs.
+        Outputs are kept in a dictionary keyed by the 34 byte outpoint() of the output with the 36 byte
+        output as the value, so checking an input is a single lookup of its first 34 bytes.
+        """
+        self.outputs = {}
+        self.height = 0
+        self.tip_hash = bytes(32)
+
+    def __len__(self):
+        return len(self.outputs)
+
+    def __contains__(self, key):
+        return key in self.outputs
+
+    def get_output(self, tx_hash, index):
+        """
+        :param1 tx_hash: 32 byte hash of a transaction
+        :param2 index: Integer, index of the output in the transaction
+        :returns: The 36 byte output if it is unspent, None otherwise
+        """
+        return self.outputs.get(outpoint(tx_hash, index))
+
+    def is_unspent(self, input):
+        """
+        :param input: Transaction input, as made by create_input()
+        :returns: True if the output the input spends is in the set, False otherwise
+        """
+        return input[:KEY_SIZE] in self.outputs
+
+    def apply_block(self, block_hash, transactions):
+        """
+        Spends the outputs used by the inputs of every transaction in a block and adds the new outputs, in order,
+        so a transaction may spend an output made earlier in the same block.
+        If any input spends an output that is not in the set, or any output is already in the set, the set is
+        left as it was. The same goes for anything else raised part way through
+        :param1 block_hash: 32 byte hash of the block's header
+        :param2 transactions: list of (tx_hash, inputs, outputs) tuples, inputs being made by create_input() and
+            outputs by create_output(). A transaction with no inputs, such as a block reward, only adds outputs
+        :returns: Undo data for undo_block(), a list of the (key, output) pairs spent, in order
+        :raises ValueError: if an input spends an output that is missing or already spent, or a transaction
+            would add an output that is still unspent, such as one with the same hash as an earlier transaction,
+            or an output is not OUTPUT_SIZE bytes
+        """
+        # Checked before anything changes, since save() lays outputs out at a fixed size
+        for _, _, outputs in transactions:
+            for output in outputs:
+                if len(output) != OUTPUT_SIZE:
+                    raise ValueError("output is not %d bytes" % OUTPUT_SIZE)
+        spent = []
+        # Every change made to the set, in order, as (key, output spent) for a spend and (key, None) for an add
+        changes = []
+        try:
+            for tx_hash, inputs, outputs in transactions:
+                for input in inputs:
+                    key = input[:KEY_SIZE]
+                    output = self.outputs.pop(key, None)
+                    if output is None:
+                        raise ValueError("input spends a missing or spent output")
+                    spent.append((key, output))
+                    changes.append((key, output))
+                for index, output in enumerate(outputs):
+                    key = outpoint(tx_hash, index)
+                    # Replacing an unspent output would lose it for good, even if the block were undone
+                    if key in self.outputs:
+                        raise ValueError("output is already in the set")
+                    self.outputs[key] = output
+                    changes.append((key, None))
+        except BaseException:
+            # Undone newest first, so an output made, spent and made again in the block ends up as it started.
+            # No add replaced an output that was already there, so removing what was added loses nothing
+            for key, output in reversed(changes):
+                if output is None:
+                    self.outputs.pop(key, None)
+                else:
+                    self.outputs[key] = output
+            raise
+        self.height += 1
+        self.tip_hash = block_hash
+        return spent
+
+    def undo_block(self, prev_block_hash, transactions, undo):
+        """
+        Reverses apply_block() for the last block applied, for example when it is dropped by a reorg
+        :param1 prev_block_hash: 32 byte hash of the block before the one being undone, which becomes the tip
+        :param2 transactions: the same list of transactions given to apply_block()
+        :param3 undo: the undo data returned by apply_block()
+        """
+        # Goes back through the transactions one at a time, so an output made and spent in the block is not restored
+        end = len(undo)
+        for tx_hash, inputs, outputs in reversed(transactions):
+            for index in range(len(outputs)):
+                self.outputs.pop(outpoint(tx_hash, index), None)
+            for key, output in undo[end - len(inputs):end]:
+                self.outputs[key] = output
+            end -= len(inputs)
+        self.height -= 1
+        self.tip_hash = prev_block_hash
+
+    def save(self, filename):
+        """
+        Writes a snapshot of the set to a file. The snapshot is written to a temporary file first and then
+        moved into place, so a crash part way through leaves the previous snapshot as it was
+        :param filename: String, path to the snapshot file
+        """
+        temporary = filename + '.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(SNAPSHOT_HEADER_FORMAT.pack(snapshot_magic, self.height, self.tip_hash, len(self.outputs)))
+            file.write(b''.join(key + output for key, output in self.outputs.items()))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, filename)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Reads a snapshot written by save()
+        :param filename: String, path to the snapshot file
+        :returns: UTXOSet holding the outputs in the snapshot, at the height and tip it was saved at
+        :raises ValueError: if the file is not a complete snapshot
+        """
+        with open(filename, 'rb') as file:
+            data = file.read()
+        if len(data) < SNAPSHOT_HEADER_FORMAT.size:
+            raise ValueError("not a UTXO snapshot")
+        magic, height, tip_hash, count = SNAPSHOT_HEADER_FORMAT.unpack_from(data)
+        if magic != snapshot_magic or len(data) != SNAPSHOT_HEADER_FORMAT.size + count * SNAPSHOT_ENTRY_FORMAT.size:
+            raise ValueError("not a UTXO snapshot")
+        utxo_set = cls()
+        utxo_set.outputs = dict(SNAPSHOT_ENTRY_FORMAT.iter_unpack(memoryview(data)[SNAPSHOT_HEADER_FORMAT.size:]))
+        utxo_set.height = height
+        utxo_set.tip_hash = tip_hash
+        return utxo_set
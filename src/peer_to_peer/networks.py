@@ -3,10 +3,14 @@ SIG Blockchain
 Peer-to-Peer Node class
 """
 
+import os
 import threading
 import socket
 import json
 
+# Largest number of buffers a single sendmsg() call accepts
+IOV_MAX = os.sysconf('SC_IOV_MAX') if 'SC_IOV_MAX' in os.sysconf_names else 1024
+
 
 def get_ip():
     """
@@ -21,6 +25,29 @@ def get_ip():
     return ip
 
 
+def send_parts(sock, parts):
+    """
+    Sends a list of byte strings over a socket with as few sendmsg calls as possible.
+    Lists longer than IOV_MAX are split over several calls, and anything a call leaves unsent
+    goes out with the next one
+
+    :param sock: socket object
+    :param parts: list of byte strings to be sent, in order
+    """
+    parts = [memoryview(part) for part in parts if len(part)]
+    i = 0
+    while i < len(parts):
+        sent = sock.sendmsg(parts[i:i + IOV_MAX])
+        # Drops the parts that went out whole and cuts the front off one that only went out in part
+        while sent:
+            if sent >= len(parts[i]):
+                sent -= len(parts[i])
+                i += 1
+            else:
+                parts[i] = parts[i][sent:]
+                sent = 0
+
+
 class Node:
 
     def __init__(self, port=9001):
@@ -147,6 +174,17 @@ class Node:
         """
         [s.send(message) for s in self.sockets if not s == exc]
 
+    def broadcast_parts(self, parts, exc=None):
+        """
+        Broadcasts a message made of several byte strings, such as a block from BlockBuilder.build(),
+        without joining the pieces together first.
+
+        :param self: reference to self
+        :param parts: list of byte strings that make up the message, in order
+        :param exc: socket object defaulted to None, will not broadcast to it
+        """
+        [send_parts(s, parts) for s in self.sockets if not s == exc]
+
     def disconnect(self):
         """
         Shuts down all sockets.
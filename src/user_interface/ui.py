@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/../data_structures")
 from PyQt5.QtWidgets import QApplication, QWidget, QMainWindow, QLabel, QGridLayout, QFrame, QHBoxLayout, QPushButton
 from PyQt5.QtGui import QIcon, QFont
 from PyQt5 import QtCore
 import socket
+from block import hash_SHA, time_now
+from miner import MiningJob
 
 class Gui(QMainWindow):
     '''Create a window and display the title of the project in the center'''
@@ -16,6 +20,7 @@ class Gui(QMainWindow):
         self.width = 1000
         self.height = 280
         self.port = port
+        self.miningJob = None
         self.initUI()
 
     def initUI(self):
@@ -128,7 +133,30 @@ class Gui(QMainWindow):
         return PeersFrame
         
     def mine(self):
-        print("Mine was called")	
+        '''Starts a mining job in the background, or cancels the one that is running'''
+        if self.miningJob is not None and self.miningJob.is_running():
+            self.miningJob.cancel()
+            self.miningTimer.stop()
+            self.mineButton.setText("Mine")
+            self.StatusLabel.setText("Offline")
+            return
+        self.miningJob = MiningJob(hash_SHA("0".encode()), hash_SHA(str(time_now()).encode()), 10**72)
+        self.miningJob.start()
+        self.mineButton.setText("Stop")
+        # Polls the job for its statistics, so the window never waits on the miner
+        self.miningTimer = QtCore.QTimer(self)
+        self.miningTimer.timeout.connect(self.updateMiningStatus)
+        self.miningTimer.start(500)
+
+    def updateMiningStatus(self):
+        '''Shows the hashrate of the running mining job, or the result once it is done'''
+        if self.miningJob.found.is_set():
+            self.miningTimer.stop()
+            self.mineButton.setText("Mine")
+            self.StatusLabel.setText("Block found after %d hashes" % self.miningJob.hashes)
+        else:
+            self.StatusLabel.setText("Mining: %.0f H/s, %d hashes, %.0f s" % (
+                self.miningJob.hashrate(), self.miningJob.hashes, self.miningJob.elapsed()))
 
 def get_ip() :
 
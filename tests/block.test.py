@@ -4,7 +4,8 @@ import sys
 sys.path.append(sys.path[0] + "/../src/data_structures")
 from block import *
 import time
-from struct import unpack
+from struct import pack, unpack
+from collections import deque
 
 # unit test class
 
@@ -105,16 +106,16 @@ class TestBlock(unittest.TestCase):
         """
         byte1 = int_to_bytes(1)
         #if we unpack the bytes as a unsigned integer, we should get the same value
-        self.assertEqual(unpack('I', byte1)[0], 1)
+        self.assertEqual(unpack('<I', byte1)[0], 1)
         #test out 0
         byte0 = int_to_bytes(0)
-        self.assertEqual(unpack('I', byte0)[0], 0)
+        self.assertEqual(unpack('<I', byte0)[0], 0)
         #test out max signed 32 bit int
         byte_max_32 = int_to_bytes(2**31 -1)
-        self.assertEqual(unpack('I', byte_max_32)[0], 2**31 -1)
+        self.assertEqual(unpack('<I', byte_max_32)[0], 2**31 -1)
         #test out max unsigned 32 bit int
         byte_max_u32 = int_to_bytes(2**32 -1)
-        self.assertEqual(unpack('I', byte_max_u32)[0], 2**32 -1)
+        self.assertEqual(unpack('<I', byte_max_u32)[0], 2**32 -1)
 
     def test_short_to_bytes(self):
         """
@@ -122,13 +123,13 @@ class TestBlock(unittest.TestCase):
         """
         byte1 = short_to_bytes(1)
         #if we unpack the bytes as a unsigned integer, we should get the same value
-        self.assertEqual(unpack('H', byte1)[0], 1)
+        self.assertEqual(unpack('<H', byte1)[0], 1)
         #test out 0
         byte0 = short_to_bytes(0)
-        self.assertEqual(unpack('H', byte0)[0], 0)
+        self.assertEqual(unpack('<H', byte0)[0], 0)
         #test out max unsigned 32 bit int
         byte_max_short = short_to_bytes(2**8 -1)
-        self.assertEqual(unpack('H', byte_max_short)[0], 2**8 -1)
+        self.assertEqual(unpack('<H', byte_max_short)[0], 2**8 -1)
 
     def test_long_to_bytes(self):
         """
@@ -136,13 +137,13 @@ class TestBlock(unittest.TestCase):
         """
         byte1 = long_to_bytes(1)
         #if we unpack the bytes as a unsigned integer, we should get the same value
-        self.assertEqual(unpack('L', byte1)[0], 1)
+        self.assertEqual(unpack('<L', byte1)[0], 1)
         #test out 0
         byte0 = long_to_bytes(0)
-        self.assertEqual(unpack('L', byte0)[0], 0)
+        self.assertEqual(unpack('<L', byte0)[0], 0)
         #test out max unsigned 32 bit int
         byte_max_long = long_to_bytes(2**32 -1)
-        self.assertEqual(unpack('L', byte_max_long)[0], 2**32 -1)
+        self.assertEqual(unpack('<L', byte_max_long)[0], 2**32 -1)
 
     # Tests time_now() by printing the current time, converting it
     # to an int manually, and comparing it to the output of time_now
@@ -162,21 +163,21 @@ class TestBlock(unittest.TestCase):
     # integer, compares this integer to the output of bytes_to_int()
     def test_bytes_to_int(self):
         convert = 20
-        byte_s = pack('I', convert)
+        byte_s = pack('<I', convert)
         self.assertEqual(convert, bytes_to_int(byte_s))
 
     # Converts a known value to a byte string, manually converts it back into an
     # integer, compares this integer to the output of bytes_to_int()
     def test_bytes_to_short(self):
         convert = 30
-        byte_s = pack('H', convert)
+        byte_s = pack('<H', convert)
         self.assertEqual(convert, bytes_to_short(byte_s))
 
     # Converts a known value to a byte string, manually converts it back into an
     # integer, compares this integer to the output of bytes_to_int()
     def test_bytes_to_long(self):
         convert = 40
-        byte_s = pack('L', convert)
+        byte_s = pack('<L', convert)
         self.assertEqual(convert, bytes_to_long(byte_s))
 
     # Gets the log of a given whole number of base 10 and converts it into bytes
@@ -199,6 +200,72 @@ class TestBlock(unittest.TestCase):
         #Tests if result block header is less than target
         self.assertTrue(less_than_target(hash_SHA(bytestring), 10**77))
 
+    # Packs a header with the codec and checks that it matches the fixed 74 byte layout field by field
+    def test_header_codec(self):
+        prev_hash = hash_SHA("0".encode())
+        data = hash_SHA("codec".encode())
+        header = pack_header(prev_hash, data, 1541000000, 72, 2**32 - 1)
+        self.assertEqual(74, HEADER_SIZE)
+        self.assertEqual(prev_hash + data + pack('<IHL', 1541000000, 72, 2**32 - 1), header)
+        self.assertEqual((prev_hash, data, 1541000000, 72, 2**32 - 1), unpack_header(header))
+        # Packing into a buffer at an offset gives the same bytes, and they unpack from the same offset
+        buffer = bytearray(100)
+        pack_header_into(buffer, 10, prev_hash, data, 1541000000, 72, 2**32 - 1)
+        self.assertEqual(header, bytes(buffer[10:84]))
+        self.assertEqual(unpack_header(header), unpack_header(buffer, 10))
+        # The slice functions agree with the codec
+        self.assertEqual(2**32 - 1, bytes_to_long(slice_nonce(header)))
+        self.assertEqual(1541000000, bytes_to_int(slice_timestamp(header)))
+        self.assertEqual(72, bytes_to_short(slice_target(header)))
+        # Hashes that are not 32 bytes are rejected rather than padded or cut down
+        with self.assertRaises(ValueError):
+            pack_header(prev_hash + bytes(8), data, 1541000000, 72, 0)
+        with self.assertRaises(ValueError):
+            pack_header_into(buffer, 10, prev_hash, data[:31], 1541000000, 72, 0)
+        with self.assertRaises(ValueError):
+            mine_range(prev_hash, "codec".encode(), 10**200, 0, 1, 1541000000)
+        # A block of one transaction that is not a hash has no 32 byte merkle root to commit to
+        with self.assertRaises(ValueError):
+            forge_block([bytes(198)])
+
+    # Mines over a range of nonces with a fixed timestamp, and checks the result against
+    # the first nonce found by building and hashing every header the slow way
+    def test_mine_range(self):
+        prev_hash = hash_SHA("0".encode())
+        data = hash_SHA("range".encode())
+        target = 10**75
+        timestamp = time_now()
+        header = mine_range(prev_hash, data, target, 0, 10000, timestamp)
+        prefix = prev_hash + data + int_to_bytes(timestamp) + log_target_bytes(target)
+        nonce = 0
+        while not less_than_target(hash_SHA(prefix + long_to_bytes(nonce)), target):
+            nonce += 1
+        self.assertEqual(prefix + long_to_bytes(nonce), header)
+        # An empty range, or one where no nonce meets the target, gives back None
+        self.assertIsNone(mine_range(prev_hash, data, target, 0, 0, timestamp))
+        self.assertIsNone(mine_range(prev_hash, data, 1, 0, 100, timestamp))
+
+    # Checks a batch of nonces and compares the winning nonce with the header found by mine_range()
+    def test_mine_batch(self):
+        prev_hash = hash_SHA("0".encode())
+        data = hash_SHA("batch".encode())
+        target = 10**75
+        timestamp = time_now()
+        header = mine_range(prev_hash, data, target, 500, 10000, timestamp)
+        expected = bytes_to_long(header[len(header) - len(long_to_bytes(0)):])
+        self.assertEqual(expected, mine_batch(prev_hash, data, target, 500, 10000, timestamp))
+        # Rebuilding the header with the same timestamp gives back the mined header
+        self.assertEqual(header, prev_hash + data + int_to_bytes(timestamp) + log_target_bytes(target) + long_to_bytes(expected))
+        self.assertIsNone(mine_batch(prev_hash, data, 1, 0, 100, timestamp))
+        # Any nonce works once the target is above every possible hash
+        self.assertEqual(7, mine_batch(prev_hash, data, 10**200, 7, 100, timestamp))
+        # Nonces past the 4 bytes of the header are rejected rather than wrapped around
+        self.assertEqual(2**32 - 1, mine_batch(prev_hash, data, 10**200, 2**32 - 1, 1, timestamp))
+        with self.assertRaises(ValueError):
+            mine_batch(prev_hash, data, 10**200, 2**32 - 10, 100, timestamp)
+        with self.assertRaises(ValueError):
+            mine_batch(prev_hash, data, 10**200, -1, 100, timestamp)
+
     # Generates a block based on an incredibly large target, so the nonce will be zero
     # Compares the result of splice_nonce converted to an integer to zero
     def test_slice_nonce(self):
@@ -341,12 +408,148 @@ class TestBlock(unittest.TestCase):
         #Tests if block is a valid block, it should be
         self.assertTrue(is_valid_block(candidate_block, prev_block))
 
+    # Decodes every field of a BlockHeader and compares them with the values the header was packed from
+    def test_block_header(self):
+        prev_hash = hash_SHA("0".encode())
+        data = hash_SHA("header".encode())
+        raw = pack_header(prev_hash, data, 1541000000, 72, 12345)
+        # Any trailing block body is left out of the header
+        header = BlockHeader(raw + b'transactions')
+        self.assertEqual(prev_hash, header.prev_hash)
+        self.assertEqual(data, header.data)
+        self.assertEqual(1541000000, header.timestamp)
+        self.assertEqual(72, header.target_exponent)
+        self.assertEqual(12345, header.nonce)
+        self.assertEqual(raw, header.to_bytes())
+        self.assertEqual(hash_SHA(raw), header.block_hash)
+        self.assertIs(header, as_block_header(header))
+        # parse_block gives the same dictionary for a BlockHeader as for the raw header
+        self.assertEqual(parse_block(raw), parse_block(header))
+
+    # Validates a chain of BlockHeader objects pair by pair and counts how many times a header gets hashed
+    def test_is_valid_block_hashes_once(self):
+        import block
+        target = 10**75
+        timestamp = time_now()
+        headers = [BlockHeader(mine_range(hash_SHA("0".encode()), hash_SHA("0".encode()), target, 0, 100000, timestamp))]
+        for i in range(1, 5):
+            prev_hash = hash_SHA(headers[-1].to_bytes())
+            headers.append(BlockHeader(mine_range(prev_hash, hash_SHA(str(i).encode()), target, 0, 100000, timestamp + i)))
+        headers = [BlockHeader(h.to_bytes()) for h in headers]
+        calls = []
+        hash_function = block.hash_SHA
+        block.hash_SHA = lambda byte_string: calls.append(1) or hash_function(byte_string)
+        try:
+            for prev_header, header in zip(headers, headers[1:]):
+                self.assertTrue(is_valid_block(header, prev_header))
+        finally:
+            block.hash_SHA = hash_function
+        self.assertEqual(len(headers), len(calls))
+        # Swapping the order breaks both the timestamp and the hash link
+        self.assertFalse(is_valid_block(headers[0], headers[1]))
+
+    # Builds merkle trees of every size up to 17 and compares their roots with get_merkle_root()
+    def test_merkle_tree(self):
+        tx_hashes = [hash_SHA(str(i).encode()) for i in range(17)]
+        # Roots worked out with the original recursive get_merkle_root(), which copies the last hash of an odd level
+        expected = {
+            1: "5feceb66ffc86f38d952786c6d696c79c2dbc239dd4e91b46729d73a27fb57e9",
+            2: "b9b10a1bc77d2a241d120324db7f3b81b2edb67eb8e9cf02af9c95d30329aef5",
+            3: "4fe118c5cf4ea0fe9bd2f32fd29d788899e889a539f1850554a8b5c828c64dd4",
+            5: "ac099a1ac20c81168ed2e93ca53f8c5e951f9f35741067df028577319aa0dea0",
+            8: "3b828c4f4b48c5d4cb5562a474ec9e2fd8d5546fae40e90732ef635892e42720",
+            17: "13f6fa3fc74e7f949351501132ee425646e12f746ea92354386a7145f1eba94d",
+        }
+        for size, root in expected.items():
+            tree = MerkleTree(tx_hashes[:size])
+            self.assertEqual(size, len(tree))
+            self.assertEqual(root, tree.root.hex())
+            self.assertEqual(root, get_merkle_root(deque(tx_hashes[:size])).hex())
+        self.assertIsNone(MerkleTree().root)
+        self.assertEqual(hash_SHA(tx_hashes[0] + tx_hashes[1]), MerkleTree(tx_hashes[:2]).root)
+
+    # Appends hashes one at a time and checks the root against a tree built from scratch after each one
+    def test_merkle_tree_append(self):
+        tx_hashes = [hash_SHA(str(i).encode()) for i in range(33)]
+        tree = MerkleTree()
+        for size in range(1, len(tx_hashes) + 1):
+            tree.append(tx_hashes[size - 1])
+            expected = MerkleTree(tx_hashes[:size])
+            self.assertEqual(expected.root, tree.root)
+            self.assertEqual(expected.levels, tree.levels)
+
+    # Creates a proof for every transaction of every tree size up to 17 and checks each one against the root
+    def test_merkle_proof(self):
+        tx_hashes = [hash_SHA(str(i).encode()) for i in range(17)]
+        for size in range(1, 18):
+            tree = MerkleTree(tx_hashes[:size])
+            for index in range(size):
+                proof = tree.get_proof(index)
+                self.assertTrue(verify_merkle_proof(tx_hashes[index], index, proof, tree.root, size))
+                # The proof does not work for another transaction, or at another position
+                self.assertFalse(verify_merkle_proof(hash_SHA("other".encode()), index, proof, tree.root, size))
+                self.assertFalse(verify_merkle_proof(tx_hashes[index], index, proof, hash_SHA("root".encode()), size))
+            # An interior node with the top of a proof, or the root with no proof at all, is not a transaction
+            if size > 1:
+                self.assertFalse(verify_merkle_proof(tree.levels[1][0], 0, tree.get_proof(0)[1:], tree.root, size))
+                self.assertFalse(verify_merkle_proof(tree.root, 0, [], tree.root, size))
+            # Nor is a position past the last transaction, even though it would pair the last hash with itself
+            self.assertFalse(verify_merkle_proof(tx_hashes[size - 1], size, tree.get_proof(size - 1), tree.root, size))
+        self.assertEqual(0, merkle_depth(1))
+        self.assertEqual(1, merkle_depth(2))
+        self.assertEqual(5, merkle_depth(17))
+
+    # Checks every proof of a forged block in one batch, with a couple of bad proofs mixed in
+    def test_verify_merkle_proofs(self):
+        transactions = [hash_SHA(str(i).encode()) for i in range(11)]
+        tree = MerkleTree(transactions)
+        header = pack_header(hash_SHA("0".encode()), tree.root, time_now(), 72, 0)
+        proofs = [(tx, i, tree.get_proof(i)) for i, tx in enumerate(transactions)]
+        self.assertEqual([True] * 11, verify_merkle_proofs(proofs, header, 11))
+        self.assertEqual([True] * 11, verify_merkle_proofs(reversed(proofs), BlockHeader(header), 11))
+        bad_proof = list(tree.get_proof(3))
+        bad_proof[0] = hash_SHA("forged".encode())
+        mixed = [proofs[0], (transactions[3], 3, bad_proof), (hash_SHA("missing".encode()), 5, tree.get_proof(5)), proofs[5]]
+        self.assertEqual([True, False, False, True], verify_merkle_proofs(mixed, header, 11))
+        # Proofs of the wrong length are rejected, including a short one for an interior node
+        short = [(tree.levels[1][0], 0, tree.get_proof(0)[1:]), proofs[0]]
+        self.assertEqual([False, True], verify_merkle_proofs(short, header, 11))
+        self.assertEqual([False], verify_merkle_proofs([proofs[0]], header, 17))
+
+    # get_merkle_root() should leave the collection it is given as it was
+    def test_get_merkle_root_non_destructive(self):
+        tx_hashes = deque([hash_SHA(str(i).encode()) for i in range(5)])
+        copy = list(tx_hashes)
+        get_merkle_root(tx_hashes)
+        self.assertEqual(copy, list(tx_hashes))
+
     def test_forge_block(self):
         transactions = []
         transactions.append(hash_SHA("merkle".encode()))
         transactions.append(hash_SHA("root".encode()))
         transactions.append(hash_SHA("testing".encode()))
         f_block = forge_block(transactions)
+        # The header commits to the transactions through the merkle root, followed by the count and the transactions
+        self.assertEqual(get_merkle_root(transactions), slice_data(f_block))
+        self.assertEqual(3, bytes_to_int(f_block[74:78]))
+        self.assertEqual(b''.join(transactions), f_block[78:])
+
+    # Builds a block one transaction at a time and checks the pieces handed back by build()
+    def test_block_builder(self):
+        transactions = [hash_SHA(str(i).encode()) * (i % 3 + 1) for i in range(9)]
+        builder = BlockBuilder()
+        for transaction in transactions:
+            builder.add_transaction(transaction)
+        self.assertEqual(get_merkle_root(transactions), builder.merkle_tree.root)
+        parts = builder.build(hash_SHA("0".encode()), 10**75)
+        self.assertEqual(2 + len(transactions), len(parts))
+        header = BlockHeader(parts[0])
+        self.assertEqual(builder.merkle_tree.root, header.data)
+        self.assertTrue(less_than_target(header.block_hash, 10**75))
+        self.assertEqual(int_to_bytes(9), parts[1])
+        # The transactions are handed back as they were given, not copied
+        for transaction, part in zip(transactions, parts[2:]):
+            self.assertIs(transaction, part)
 
 if __name__ == '__main__':
     unittest.main()
@@ -2,16 +2,22 @@
 import unittest
 import os
 import sys
+import time
+import threading
+import tracemalloc
+from struct import pack
 sys.path.append(sys.path[0] + "/../src/data_structures")
 from blockchain import *
-from block import mine, hash_SHA, bytes_to_int
+from block import mine, mine_range, hash_SHA, bytes_to_int, time_now, BlockBuilder
 
 class TestBlock(unittest.TestCase):
 	def setUp(self):
 		self.bc = Blockchain("testfile.db")
 
 	def tearDown(self):
+		self.bc.close()
 		os.remove("testfile.db")
+		os.remove("testfile.db.idx")
 
 	def test_constructor(self):
 		filename = "testfile.db"
@@ -22,6 +28,7 @@ class TestBlock(unittest.TestCase):
 		    fileobj.write(b'0')
 		# Creates another blockchain with the same filename as test_blockchain
 		test_blockchain_2 = Blockchain(self.bc.blockfile)
+		test_blockchain_2.close()
 		# Ensures that the file of test_blockchain is not overwritten
 		with open(self.bc.blockfile, 'rb') as fileobj:
 		    char = fileobj.read(1)
@@ -30,11 +37,11 @@ class TestBlock(unittest.TestCase):
 	def test_get_size_bytes(self):
 		# Testing with integer 4, length should be 4
 		testint = 4
-		testbytes = pack('I', testint)
+		testbytes = pack('<I', testint)
 		testlen = len(testbytes)
 		# Compares result of get_size_bytes() to known size
 		size_bytes = get_size_bytes(testbytes)
-		self.assertEqual(pack('I', testlen), size_bytes)
+		self.assertEqual(pack('<I', testlen), size_bytes)
 
 	def test_extract(self):
 		# Generates byte strings
@@ -97,28 +104,28 @@ class TestBlock(unittest.TestCase):
 		self.assertEqual(b'', self.bc.last_block)
 
 		# Creates 4 blocks and add to file
-		b1 = mine(hash_SHA("Root".encode()), "Block1".encode(), target)
+		b1 = mine(hash_SHA("Root".encode()), hash_SHA("Block1".encode()), target)
 		self.bc.add_block(b1)
 		# Ensures that block count is being updated correctly
 		self.assertEqual(1, self.bc.block_count)
 		# Ensures that last_block member of blockchain properly updated
 		self.assertEqual(b1, self.bc.last_block)
 
-		b2 = mine(hash_SHA("Block1".encode()), "Block2".encode(), target)
+		b2 = mine(hash_SHA("Block1".encode()), hash_SHA("Block2".encode()), target)
 		self.bc.add_block(b2)
 		# Ensures that block count is being updated correctly
 		self.assertEqual(2, self.bc.block_count)
 		# Ensures that last_block member of blockchain properly updated
 		self.assertEqual(b2, self.bc.last_block)
 
-		b3 = mine(hash_SHA("Block2".encode()), "Block3".encode(), target)
+		b3 = mine(hash_SHA("Block2".encode()), hash_SHA("Block3".encode()), target)
 		self.bc.add_block(b3)
 		# Ensures that block count is being updated correctly
 		self.assertEqual(3, self.bc.block_count)
 		# Ensures that last_block member of blockchain properly updated
 		self.assertEqual(b3, self.bc.last_block)
 
-		b4 = mine(hash_SHA("Block3".encode()), "Block4".encode(), target)
+		b4 = mine(hash_SHA("Block3".encode()), hash_SHA("Block4".encode()), target)
 		self.bc.add_block(b4)
 		# Ensures that block count is being updated correctly
 		self.assertEqual(4, self.bc.block_count)
@@ -138,5 +145,584 @@ class TestBlock(unittest.TestCase):
 		# Confirms that extracted blocks is identical to actual blocks
 		self.assertEqual(expected, actual)
 
+	def test_add_block_parts(self):
+		builder = BlockBuilder()
+		for i in range(5):
+			builder.add_transaction(hash_SHA(str(i).encode()))
+		parts = builder.build(hash_SHA("Root".encode()), 10**75)
+		block = b''.join(parts)
+		# A block handed over in pieces is written out the same as the whole block
+		self.bc.add_block(parts)
+		self.assertEqual(1, self.bc.block_count)
+		self.assertEqual(block, self.bc.last_block)
+		self.bc.add_block(block)
+		expected = magic_bytes + get_size_bytes(block) + block
+		self.assertEqual(expected + expected, extract(self.bc.blockfile, 0, 2 * len(expected)))
+		# Pieces that split the header are hashed the same as the whole block
+		self.bc.add_blocks([[block[:10], block[10:100], block[100:]]])
+		self.assertEqual(block, self.bc.last_block)
+		self.assertEqual(hash_SHA(block[:74]), self.bc._read_index_entry(2)[2])
+		self.assertEqual(block, self.bc.get_block_by_height(2))
+
+	def test_index(self):
+		blocks = self.mine_chain(4)
+		blocks[2] += b'body'
+		for block in blocks:
+			self.bc.add_block(block)
+		self.assertTrue(os.path.isfile(self.bc.indexfile))
+		for height, block in enumerate(blocks):
+			self.assertEqual(block, self.bc.get_block_by_height(height))
+			self.assertEqual(height, self.bc.get_height(hash_SHA(block[:74])))
+			self.assertEqual(block, self.bc.get_block_by_hash(hash_SHA(block[:74])))
+		offset, size = self.bc.get_block_location(2)
+		self.assertEqual(len(blocks[2]), size)
+		self.assertEqual(blocks[2], extract(self.bc.blockfile, offset, size))
+		self.assertIsNone(self.bc.get_block_by_height(4))
+		self.assertIsNone(self.bc.get_block_by_hash(hash_SHA("missing".encode())))
+
+	def test_index_reopen(self):
+		blocks = self.mine_chain(3)
+		self.bc.add_block(blocks[0])
+		# Looking a hash up loads the hash map, which then has to stay up to date
+		self.assertEqual(0, self.bc.get_height(hash_SHA(blocks[0])))
+		self.bc.add_block(blocks[1])
+		self.assertEqual(1, self.bc.get_height(hash_SHA(blocks[1])))
+		# A torn entry at the end of the index is ignored and then overwritten
+		with open(self.bc.indexfile, 'ab') as file:
+			file.write(b'torn')
+		reopened = Blockchain(self.bc.blockfile)
+		self.assertEqual(2, reopened.indexed_count)
+		self.assertEqual(blocks[1], reopened.get_block_by_hash(hash_SHA(blocks[1])))
+		reopened.add_block(blocks[2])
+		reopened.close()
+		with Blockchain(self.bc.blockfile) as reopened:
+			self.assertEqual(blocks[2], reopened.get_block_by_height(2))
+
+	def test_block_reader(self):
+		blocks = self.mine_chain(3)
+		# An empty blockfile can be read before anything is written to it
+		with BlockReader(self.bc.blockfile) as reader:
+			self.assertEqual([], list(reader))
+			self.assertIsNone(reader.get_block_by_height(0))
+			self.bc.add_block(blocks[0])
+			self.bc.add_block(blocks[1] + b'body')
+			# The reader picks up blocks written after it was opened
+			self.assertEqual([blocks[0], blocks[1] + b'body'], [bytes(block) for block in reader])
+			self.assertIsInstance(reader.get_block_by_height(1), memoryview)
+			self.assertEqual(blocks[1] + b'body', reader.get_block_by_height(1))
+			view = reader.get_block_by_height(0)
+			self.bc.add_block(blocks[2])
+			self.assertEqual(blocks[2], reader.get_block_by_height(2))
+			# Views handed out before the file was remapped still hold the same bytes
+			self.assertEqual(blocks[0], view)
+			self.assertIsNone(reader.get_block_by_height(3))
+			self.assertIsNone(reader.read(0, 10**6))
+
+	def test_unpublished_blocks_hidden(self):
+		blocks = self.mine_chain(2)
+		self.bc.add_block(blocks[0])
+		# A record and index entry written but not yet published, as seen by a reader halfway through add_blocks()
+		offset = os.path.getsize(self.bc.blockfile)
+		os.write(self.bc._block_fd, magic_bytes + get_size_bytes(blocks[1]) + blocks[1])
+		self.bc._add_index_entries([INDEX_ENTRY_FORMAT.pack(offset, len(blocks[1]), hash_SHA(blocks[1]))])
+		self.assertEqual(1, self.bc.block_count)
+		self.assertEqual((1, offset), self.bc.committed())
+		self.assertIsNone(self.bc.get_block_by_height(1))
+		self.assertIsNone(self.bc.get_height(hash_SHA(blocks[1])))
+		with BlockReader(self.bc.blockfile, chain=self.bc) as reader:
+			self.assertEqual([blocks[0]], [bytes(block) for block in reader])
+			self.assertIsNone(reader.get_block_by_height(1))
+		with BlockReader(self.bc.blockfile) as reader:
+			self.assertEqual(blocks[1], reader.get_block_by_height(1))
+
+	def test_concurrent_readers(self):
+		blocks = [hash_SHA(str(i).encode()) * 3 for i in range(300)]
+		errors = []
+		done = threading.Event()
+
+		def read():
+			with BlockReader(self.bc.blockfile, chain=self.bc) as reader:
+				while not done.is_set():
+					count = self.bc.block_count
+					last_block = self.bc.last_block
+					# block_count and last_block always belong to the same tip, or a later one
+					if count > 0 and last_block not in blocks[count - 1:]:
+						errors.append(("tip", count))
+					# Heights below 150 are never dropped by the truncate() below
+					for height in {0, count // 2, count - 1}:
+						if not 0 <= height < min(count, 150):
+							continue
+						if self.bc.get_block_by_height(height) != blocks[height]:
+							errors.append(("height", height))
+						if self.bc.get_height(hash_SHA(blocks[height][:74])) != height:
+							errors.append(("hash", height))
+						if reader.get_block_by_height(height) != blocks[height]:
+							errors.append(("reader", height))
+					if self.bc.get_block_by_height(len(blocks)) is not None:
+						errors.append(("past tip", len(blocks)))
+
+		self.bc.close()
+		self.bc = Blockchain(self.bc.blockfile, cache_size=8 * 74)
+		readers = [threading.Thread(target=read) for _ in range(4)]
+		for reader in readers:
+			reader.start()
+		for i in range(0, len(blocks), 3):
+			self.bc.add_blocks(blocks[i:i + 3])
+		self.bc.truncate(150)
+		self.bc.add_blocks(blocks[150:])
+		done.set()
+		for reader in readers:
+			reader.join()
+		self.assertEqual([], errors)
+		self.assertEqual(len(blocks), self.bc.block_count)
+
+	def test_add_blocks(self):
+		# Enough blocks that the records take more buffers than one writev() call accepts
+		blocks = [hash_SHA(str(i).encode()) * 3 for i in range(500)]
+		blocks[7] = [blocks[7][:74], blocks[7][74:]]
+		self.bc.add_blocks(blocks)
+		blocks[7] = b''.join(blocks[7])
+		self.assertEqual(500, self.bc.block_count)
+		self.assertEqual(blocks[-1], self.bc.last_block)
+		expected = b''.join(magic_bytes + get_size_bytes(block) + block for block in blocks)
+		self.assertEqual(expected, extract(self.bc.blockfile, 0, len(expected) + 1))
+		for height in (0, 7, 499):
+			self.assertEqual(blocks[height], self.bc.get_block_by_height(height))
+			self.assertEqual(height, self.bc.get_height(hash_SHA(blocks[height][:74])))
+		# Adding nothing changes nothing
+		self.bc.add_blocks([])
+		self.assertEqual(500, self.bc.block_count)
+
+	def test_sync_policy(self):
+		synced = []
+		# Blocks made of three hashes, long enough to hold a header
+		bc = Blockchain("testfile_sync.db", sync_blocks=3)
+		bc.sync = lambda: synced.append(bc.block_count) or Blockchain.sync(bc)
+		for i in range(7):
+			bc.add_block(hash_SHA(str(i).encode()) * 3)
+		bc.add_blocks([hash_SHA(str(i).encode()) * 3 for i in range(4)])
+		# Synced after the 3rd and 6th block, then after the batch took it past 3 unsynced blocks
+		self.assertEqual([3, 6, 11], synced)
+		bc.add_block(hash_SHA("last".encode()) * 3)
+		bc.close()
+		# Closing syncs the block that had not been synced yet
+		self.assertEqual([3, 6, 11, 12], synced)
+		bc = Blockchain("testfile_sync.db", sync_interval_ms=60000)
+		bc.sync = lambda: synced.append(bc.block_count) or Blockchain.sync(bc)
+		bc.add_block(hash_SHA("first".encode()) * 3)
+		# Not a minute since the last sync yet
+		self.assertEqual([3, 6, 11, 12], synced)
+		bc.sync_interval_ms = 1
+		time.sleep(0.01)
+		bc.add_block(hash_SHA("second".encode()) * 3)
+		self.assertEqual([3, 6, 11, 12, 14], synced)
+		# The last write before the writer goes quiet is synced by the timer, without waiting for another write
+		bc.sync_interval_ms = 50
+		bc.add_block(hash_SHA("third".encode()) * 3)
+		self.assertEqual([3, 6, 11, 12, 14], synced)
+		time.sleep(0.5)
+		self.assertEqual([3, 6, 11, 12, 14, 15], synced)
+		bc.close()
+		os.remove("testfile_sync.db")
+		os.remove("testfile_sync.db.idx")
+
+	def test_recover_tip(self):
+		blocks = self.mine_chain(3)
+		for block in blocks:
+			self.bc.add_block(block)
+		self.bc.close()
+		self.bc = Blockchain(self.bc.blockfile)
+		# Reopening picks up where the chain left off
+		self.assertEqual(3, self.bc.block_count)
+		self.assertEqual(blocks[2], self.bc.last_block)
+		self.bc.add_block(blocks[0])
+		with Blockchain(self.bc.blockfile) as reopened:
+			self.assertEqual(4, reopened.block_count)
+
+	def test_recover_unindexed_blocks(self):
+		blocks = self.mine_chain(4)
+		self.bc.add_blocks(blocks[:2])
+		# Blocks written without index entries, as if the index write was lost in a crash
+		with open(self.bc.blockfile, 'ab') as file:
+			for block in blocks[2:]:
+				file.write(magic_bytes + get_size_bytes(block) + block)
+		self.bc.close()
+		self.bc = Blockchain(self.bc.blockfile)
+		self.assertEqual(4, self.bc.block_count)
+		self.assertEqual(blocks[3], self.bc.last_block)
+		self.assertEqual(3, self.bc.get_height(hash_SHA(blocks[3])))
+		# Without any index at all, the index is rebuilt from the blockfile
+		self.bc.close()
+		os.remove(self.bc.indexfile)
+		self.bc = Blockchain(self.bc.blockfile)
+		self.assertEqual(4, self.bc.block_count)
+		for height, block in enumerate(blocks):
+			self.assertEqual(block, self.bc.get_block_by_height(height))
+
+	def test_recover_torn_write(self):
+		blocks = self.mine_chain(3)
+		self.bc.add_blocks(blocks[:2])
+		size = os.path.getsize(self.bc.blockfile)
+		# Only part of the third record made it to disk
+		with open(self.bc.blockfile, 'ab') as file:
+			file.write((magic_bytes + get_size_bytes(blocks[2]) + blocks[2])[:40])
+		self.bc.close()
+		self.bc = Blockchain(self.bc.blockfile)
+		self.assertEqual(2, self.bc.block_count)
+		self.assertEqual(blocks[1], self.bc.last_block)
+		self.assertEqual(size, os.path.getsize(self.bc.blockfile))
+		# The next block goes where the torn one was
+		self.bc.add_block(blocks[2])
+		self.assertIsNone(validate_chain(self.bc.blockfile, workers=1))
+		self.assertEqual(blocks[2], self.bc.get_block_by_height(2))
+
+	def test_recover_truncated_blockfile(self):
+		blocks = self.mine_chain(3)
+		self.bc.add_blocks(blocks)
+		self.bc.close()
+		# The index has an entry for a block that is no longer in the blockfile
+		os.truncate(self.bc.blockfile, os.path.getsize(self.bc.blockfile) - 1)
+		self.bc = Blockchain(self.bc.blockfile)
+		self.assertEqual(2, self.bc.block_count)
+		self.assertEqual(blocks[1], self.bc.last_block)
+		self.assertIsNone(self.bc.get_block_by_height(2))
+
+	def test_cache_hits(self):
+		blocks = self.mine_chain(3)
+		self.bc.add_blocks(blocks)
+		hits, misses = self.bc.cache.hits, self.bc.cache.misses
+		self.assertEqual(blocks[1], self.bc.get_block_by_height(1))
+		self.assertEqual(misses + 1, self.bc.cache.misses)
+		# The second read, and reads of the header or by hash, come from the cache
+		self.assertEqual(blocks[1], self.bc.get_block_by_height(1))
+		self.assertEqual(hash_SHA(blocks[1]), self.bc.get_header(1).block_hash)
+		self.assertEqual(blocks[1], self.bc.get_block_by_hash(hash_SHA(blocks[1])))
+		self.assertEqual(hits + 3, self.bc.cache.hits)
+		self.assertEqual(misses + 1, self.bc.cache.misses)
+		self.assertIsNone(self.bc.get_header(3))
+
+	def test_cache_byte_bound(self):
+		self.bc.close()
+		# Room for two 74 byte blocks
+		self.bc = Blockchain(self.bc.blockfile, cache_size=150)
+		blocks = self.mine_chain(3)
+		self.bc.add_blocks(blocks)
+		for height in range(3):
+			self.bc.get_block_by_height(height)
+		self.assertEqual(2, len(self.bc.cache))
+		self.assertEqual(148, self.bc.cache.size)
+		# Height 0 was the least recently used and was evicted
+		self.assertIsNone(self.bc.cache.get(0))
+		self.assertIsNotNone(self.bc.cache.get(2))
+		# Height 2 was looked up since, so it gets a second chance and height 1 is evicted instead
+		self.bc.get_block_by_height(0)
+		self.assertIsNone(self.bc.cache.get(1))
+		self.assertIsNotNone(self.bc.cache.get(2))
+
+	def test_cache_disabled(self):
+		self.bc.close()
+		self.bc = Blockchain(self.bc.blockfile, cache_size=0)
+		blocks = self.mine_chain(2)
+		self.bc.add_blocks(blocks)
+		self.assertEqual(blocks[0], self.bc.get_block_by_height(0))
+		self.assertEqual(blocks[0], self.bc.get_block_by_height(0))
+		self.assertEqual(0, len(self.bc.cache))
+		self.assertEqual(0, self.bc.cache.hits)
+
+	def test_truncate(self):
+		blocks = self.mine_chain(4)
+		self.bc.add_blocks(blocks)
+		for height in range(4):
+			self.bc.get_block_by_height(height)
+		self.assertEqual(3, self.bc.get_height(hash_SHA(blocks[3])))
+		self.bc.truncate(2)
+		self.assertEqual(2, self.bc.block_count)
+		self.assertEqual(blocks[1], self.bc.last_block)
+		# The dropped blocks are gone from the cache and the hash lookup as well as from disk
+		self.assertIsNone(self.bc.cache.get(2))
+		self.assertIsNone(self.bc.get_block_by_height(2))
+		self.assertIsNone(self.bc.get_block_by_hash(hash_SHA(blocks[3])))
+		# The files stay the same size, the dropped records are marked dead
+		self.assertEqual(os.path.getsize(self.bc.blockfile), 4 * (8 + 74))
+		self.assertEqual(dead_bytes, extract(self.bc.blockfile, 2 * (8 + 74), 4))
+		# A different block can then be added at the same height
+		fork = mine_range(hash_SHA(blocks[1]), hash_SHA("fork".encode()), 10**75, 0, 100000, time_now() + 10)
+		self.bc.add_block(fork)
+		self.assertEqual(fork, self.bc.get_block_by_height(2))
+		self.assertEqual(2, self.bc.get_height(hash_SHA(fork)))
+		# Everything that walks the blockfile steps over the dead records
+		skipped = []
+		self.assertEqual([blocks[0], blocks[1], fork], [header + body for _, _, header, body in iter_blocks(self.bc.blockfile, skipped=skipped)])
+		self.assertEqual([], skipped)
+		with BlockReader(self.bc.blockfile) as reader:
+			self.assertEqual([blocks[0], blocks[1], fork], [bytes(block) for block in reader])
+		self.assertIsNone(validate_chain(self.bc.blockfile, workers=1))
+		self.bc.close()
+		self.bc = Blockchain(self.bc.blockfile)
+		self.assertEqual(3, self.bc.block_count)
+		self.assertEqual(fork, self.bc.last_block)
+		self.assertEqual(os.path.getsize(self.bc.blockfile), 5 * (8 + 74))
+		# Dead records at the end of the blockfile are cut off when the chain is opened again
+		self.bc.truncate(1)
+		self.bc.close()
+		self.bc = Blockchain(self.bc.blockfile)
+		self.assertEqual(1, self.bc.block_count)
+		self.assertEqual(os.path.getsize(self.bc.blockfile), 8 + 74)
+		self.assertEqual(os.path.getsize(self.bc.indexfile), INDEX_ENTRY_FORMAT.size)
+		self.assertEqual(blocks[0], self.bc.last_block)
+
+	def test_truncate_mapped(self):
+		# Blocks spanning many pages, so a shrunk file would leave pages of the map with nothing behind them
+		blocks = [block + bytes(3200) for block in self.mine_chain(300)]
+		self.bc.add_blocks(blocks)
+		with BlockReader(self.bc.blockfile) as reader:
+			views = [reader.get_block_by_height(height) for height in range(300)]
+			self.bc.truncate(10)
+			# Views of the dropped blocks can still be read
+			self.assertEqual(blocks[299], views[299])
+			self.assertEqual(sum(map(len, blocks[10:])), sum(len(bytes(view)) for view in views[10:]))
+			self.assertIsNone(reader.get_block_by_height(10))
+			self.assertEqual(blocks[9], reader.get_block_by_height(9))
+			self.assertEqual(10, len(list(reader)))
+			self.bc.add_block(blocks[10])
+			self.assertEqual(blocks[10], reader.get_block_by_height(10))
+			del views
+
+	def test_cache_concurrent(self):
+		blocks = self.mine_chain(20)
+		self.bc.add_blocks(blocks)
+		errors = []
+		done = threading.Event()
+
+		def read():
+			try:
+				while not done.is_set():
+					for height in range(20):
+						self.bc.cache.get(height)
+			except Exception as e:
+				errors.append(e)
+
+		readers = [threading.Thread(target=read) for _ in range(3)]
+		for reader in readers:
+			reader.start()
+		# Invalidating and filling the cache walks its entries while the readers move them around
+		for _ in range(200):
+			self.bc.cache.invalidate_from(0)
+			for height in range(20):
+				self.bc.get_block_by_height(height)
+		done.set()
+		for reader in readers:
+			reader.join()
+		self.assertEqual([], errors)
+
+	def test_block_too_short(self):
+		block = self.mine_chain(1)[0]
+		# A block that cannot hold a header could not be read back by iter_blocks() or validate_chain()
+		with self.assertRaises(ValueError):
+			self.bc.add_blocks([block, hash_SHA("short".encode())])
+		with self.assertRaises(ValueError):
+			self.bc.add_block([block[:10], block[10:20]])
+		self.assertEqual(0, self.bc.block_count)
+		self.assertEqual(0, os.path.getsize(self.bc.blockfile))
+
+	def test_block_too_big(self):
+		self.assertEqual(SIZE_MASK | (2 << COMPRESSION_SHIFT), make_size_field(SIZE_MASK, 2))
+		with self.assertRaises(ValueError):
+			make_size_field(SIZE_MASK + 1)
+		# A block of just over 1 GiB, made of pieces that all share one buffer, would overwrite the compression flag
+		piece = memoryview(bytes(1024 * 1024))
+		block = self.mine_chain(1)[0]
+		with self.assertRaises(ValueError):
+			self.bc.add_blocks([block, [block] + [piece] * 1024])
+		# Nothing was written, not even the block before it
+		self.assertEqual(0, self.bc.block_count)
+		self.assertEqual(0, os.path.getsize(self.bc.blockfile))
+
+	def test_iter_blocks(self):
+		blocks = [self.mine_chain(1)[0] + bytes([i]) * (i * 10) for i in range(5)]
+		self.bc.add_blocks(blocks)
+		skipped = []
+		# A tiny chunk size makes records straddle the reads
+		read = list(iter_blocks(self.bc.blockfile, chunk_size=16, skipped=skipped))
+		self.assertEqual([], skipped)
+		self.assertEqual(list(range(5)), [height for height, _, _, _ in read])
+		for height, offset, header, body in read:
+			self.assertEqual(blocks[height], header + body)
+			self.assertEqual(self.bc._read_index_entry(height)[0], offset)
+
+	def test_iter_blocks_resync(self):
+		blocks = self.mine_chain(4)
+		self.bc.add_blocks(blocks[:2])
+		self.bc.close()
+		record_size = 8 + 74
+		with open(self.bc.blockfile, 'ab') as file:
+			# A torn record whose size runs over the record written after it
+			file.write(magic_bytes + get_size_bytes(bytes(200)) + bytes(20))
+			file.write(magic_bytes + get_size_bytes(blocks[2]) + blocks[2])
+			# Junk with no magic bytes in it
+			file.write(b'junk')
+			file.write(magic_bytes + get_size_bytes(blocks[3]) + blocks[3])
+			# A torn record at the end of the file
+			file.write(magic_bytes + get_size_bytes(bytes(500)) + bytes(30))
+		skipped = []
+		read = list(iter_blocks(self.bc.blockfile, chunk_size=32, skipped=skipped))
+		self.assertEqual(blocks, [header + body for _, _, header, body in read])
+		self.assertEqual([0, 1, 2, 3], [height for height, _, _, _ in read])
+		self.assertEqual([(2 * record_size, 28), (3 * record_size + 28, 4), (4 * record_size + 32, 38)], skipped)
+		self.bc = Blockchain(self.bc.blockfile)
+
+	def test_iter_blocks_corrupt_size(self):
+		blocks = self.mine_chain(3)
+		self.bc.add_blocks(blocks[:1])
+		self.bc.close()
+		with open(self.bc.blockfile, 'ab') as file:
+			# A size field corrupted to nearly 1 GiB, far more than is left in the file
+			file.write(magic_bytes + int_to_bytes(SIZE_MASK) + bytes(10))
+			for block in blocks[1:]:
+				file.write(magic_bytes + get_size_bytes(block) + block)
+		skipped = []
+		tracemalloc.start()
+		read = list(iter_blocks(self.bc.blockfile, skipped=skipped))
+		peak = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+		self.assertEqual(blocks, [header + body for _, _, header, body in read])
+		self.assertEqual([(82, 18)], skipped)
+		# Never reads anywhere near the corrupt size into memory
+		self.assertLess(peak, 16 * 1024 * 1024)
+		self.bc = Blockchain(self.bc.blockfile)
+
+	def test_rebuild_index(self):
+		blocks = self.mine_chain(3)
+		self.bc.add_blocks(blocks[:1])
+		with open(self.bc.blockfile, 'ab') as file:
+			file.write(b'corrupted')
+		self.bc.close()
+		with open(self.bc.blockfile, 'ab') as file:
+			for block in blocks[1:]:
+				file.write(magic_bytes + get_size_bytes(block) + block)
+		self.assertEqual(3, rebuild_index(self.bc.blockfile))
+		self.bc = Blockchain(self.bc.blockfile)
+		self.assertEqual(3, self.bc.block_count)
+		self.assertEqual(blocks[2], self.bc.get_block_by_hash(hash_SHA(blocks[2])))
+
+	def compressible_chain(self, length):
+		# Blocks with a body that compresses well after a mined header
+		return [header + (b'transaction' * 20) + bytes([height]) for height, header in enumerate(self.mine_chain(length))]
+
+	def test_compression(self):
+		for compression in ('zlib', 'lzma'):
+			self.bc.close()
+			os.remove(self.bc.blockfile)
+			os.remove(self.bc.indexfile)
+			self.bc = Blockchain(self.bc.blockfile, compression=compression)
+			blocks = self.compressible_chain(3)
+			self.bc.add_blocks(blocks)
+			self.assertLess(os.path.getsize(self.bc.blockfile), sum(8 + len(block) for block in blocks))
+			# The header is stored raw after the size, with the compression flag in the top bits of the size
+			size_field = bytes_to_int(extract(self.bc.blockfile, 4, 4))
+			self.assertEqual(COMPRESSION_METHODS[compression], size_field >> COMPRESSION_SHIFT)
+			self.assertEqual(blocks[0][:74], extract(self.bc.blockfile, 8, 74))
+			self.assertEqual(blocks[2], self.bc.last_block)
+			self.assertEqual(blocks[1], self.bc.get_block_by_height(1))
+			self.assertEqual(blocks[1], self.bc.get_block_by_hash(hash_SHA(blocks[1][:74])))
+			# A compressed chain reopens and validates like a raw one
+			self.bc.close()
+			self.bc = Blockchain(self.bc.blockfile, cache_size=0)
+			self.assertEqual(3, self.bc.block_count)
+			self.assertEqual(blocks[2], self.bc.last_block)
+			self.assertIsNone(validate_chain(self.bc.blockfile, workers=1))
+			with BlockReader(self.bc.blockfile) as reader:
+				self.assertEqual(blocks[1], bytes(reader.get_block_by_height(1)))
+				self.assertEqual(blocks, [bytes(block) for block in reader])
+			self.assertEqual(blocks, [header + body for _, _, header, body in iter_blocks(self.bc.blockfile)])
+
+	def test_compression_mixed(self):
+		raw = self.compressible_chain(2)
+		self.bc.add_blocks(raw[:1])
+		self.bc.close()
+		self.bc = Blockchain(self.bc.blockfile, compression='zlib')
+		# A header only block does not get any smaller, so it is stored raw
+		incompressible = self.mine_chain(1)[0]
+		self.bc.add_blocks([raw[1], incompressible])
+		self.assertEqual(len(incompressible), self.bc.get_block_location(2)[1])
+		self.assertEqual([raw[0], raw[1], incompressible], [self.bc.get_block_by_height(h) for h in range(3)])
+		os.remove(self.bc.indexfile)
+		self.assertEqual(3, rebuild_index(self.bc.blockfile))
+		self.bc.close()
+		self.bc = Blockchain(self.bc.blockfile)
+		self.assertEqual(raw[1], self.bc.get_block_by_height(1))
+
+	def test_compression_corrupted_body(self):
+		blocks = self.compressible_chain(3)
+		self.bc.close()
+		self.bc = Blockchain(self.bc.blockfile, compression='zlib')
+		self.bc.add_blocks(blocks)
+		# Damages the compressed body of the middle block, which iter_blocks() then skips
+		offset, size = self.bc.get_block_location(1)
+		with open(self.bc.blockfile, 'r+b') as file:
+			file.seek(offset + 80)
+			file.write(b'\xff' * 8)
+		skipped = []
+		read = [header + body for _, _, header, body in iter_blocks(self.bc.blockfile, skipped=skipped)]
+		self.assertEqual([blocks[0], blocks[2]], read)
+		self.assertEqual([(offset - 8, size + 8)], skipped)
+
+	def mine_chain(self, length, bad_link=None, timestamp=None):
+		# Mines a chain of block headers with increasing timestamps, optionally with one header
+		# pointing at the wrong previous block
+		target = 10**75
+		if timestamp is None:
+			timestamp = time_now()
+		headers = []
+		prev_hash = hash_SHA("Root".encode())
+		for height in range(length):
+			if height == bad_link:
+				prev_hash = hash_SHA("wrong".encode())
+			header = mine_range(prev_hash, hash_SHA(str(height).encode()), target, 0, 100000, timestamp + height)
+			headers.append(header)
+			prev_hash = hash_SHA(header)
+		return headers
+
+	def test_validate_chain(self):
+		for block in self.mine_chain(7):
+			# Block bodies after the header are skipped over
+			self.bc.add_block(block + b'body')
+		self.assertIsNone(validate_chain(self.bc.blockfile, workers=1))
+		# Small chunks spread over a pool have to be stitched back together
+		self.assertIsNone(validate_chain(self.bc.blockfile, workers=2, chunk_size=2))
+		self.assertIsNone(validate_chain(self.bc.blockfile, workers=2, chunk_size=3))
+
+	def test_validate_chain_bad_link(self):
+		for block in self.mine_chain(7, bad_link=4):
+			self.bc.add_block(block)
+		self.assertEqual(4, validate_chain(self.bc.blockfile, workers=1))
+		# Height 4 starts a chunk, so the bad link is found while stitching
+		self.assertEqual(4, validate_chain(self.bc.blockfile, workers=2, chunk_size=2))
+		self.assertEqual(4, validate_chain(self.bc.blockfile, workers=2, chunk_size=3))
+
+	def test_validate_chain_bad_timestamp(self):
+		headers = self.mine_chain(3)
+		# A block that links up correctly but has an older timestamp than the block before it
+		headers.append(mine_range(hash_SHA(headers[2]), hash_SHA("3".encode()), 10**75, 0, 100000, time_now() - 100))
+		for block in headers:
+			self.bc.add_block(block)
+		self.assertEqual(3, validate_chain(self.bc.blockfile, workers=2, chunk_size=2))
+
+	def test_validate_chain_bad_proof_of_work(self):
+		headers = self.mine_chain(5)
+		# Claims a target of 10^1, which the hash of the block will not be under
+		headers[2] = headers[2][:68] + b'\x01\x00' + headers[2][70:]
+		for block in headers:
+			self.bc.add_block(block)
+		self.assertEqual(2, validate_chain(self.bc.blockfile, workers=2, chunk_size=2))
+
+	def test_validate_chain_unreadable_record(self):
+		for block in self.mine_chain(3):
+			self.bc.add_block(block)
+		# A torn record at the end of the file
+		with open(self.bc.blockfile, 'ab') as file:
+			file.write(magic_bytes + get_size_bytes(bytes(74)) + bytes(10))
+		self.assertEqual(3, validate_chain(self.bc.blockfile, workers=1))
+
 if __name__ == '__main__':
 	unittest.main()
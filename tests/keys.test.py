@@ -89,5 +89,45 @@ class Test(unittest.TestCase):
         self.assertTrue('pk_hash' in key_set)
         os.remove('keys.json')
 
+    def test_key_cache(self):
+        cache = KeyCache(max_keys=2)
+        private_keys = [generate_private_key() for _ in range(3)]
+        signing_key = cache.signing_key(private_keys[0])
+        # The same object comes back for the same key bytes
+        self.assertIs(signing_key, cache.signing_key(private_keys[0]))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+        self.assertEqual(generate_public_key(private_keys[0]), signing_key.get_verifying_key().to_string())
+        # Keys past max_keys push out the least recently used one
+        cache.signing_key(private_keys[1])
+        cache.signing_key(private_keys[0])
+        cache.signing_key(private_keys[2])
+        self.assertIs(signing_key, cache.signing_key(private_keys[0]))
+        misses = cache.misses
+        cache.signing_key(private_keys[1])
+        self.assertEqual(misses + 1, cache.misses)
+
+    def test_key_cache_precompute(self):
+        cache = KeyCache(precompute_after=3)
+        private_key = generate_private_key()
+        public_key = generate_public_key(private_key)
+        message = hash_SHA("message".encode())
+        signature = cache.signing_key(private_key).sign(message)
+        cold = cache.verifying_key(public_key)
+        self.assertIs(cold, cache.verifying_key(public_key))
+        # The third use swaps in a key with precomputation tables, which verifies the same way
+        hot = cache.verifying_key(public_key)
+        self.assertIsNot(cold, hot)
+        self.assertIs(hot, cache.verifying_key(public_key))
+        self.assertEqual(public_key, hot.to_string())
+        self.assertTrue(hot.verify(signature, message))
+        with self.assertRaises(ecdsa.BadSignatureError):
+            hot.verify(signature, hash_SHA("other".encode()))
+
+    def test_key_cache_disabled(self):
+        cache = KeyCache(max_keys=0)
+        private_key = generate_private_key()
+        self.assertIsNot(cache.signing_key(private_key), cache.signing_key(private_key))
+        self.assertEqual(0, cache.hits)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+import sys
+import time
+sys.path.append(sys.path[0] + "/../src/data_structures")
+from miner import *
+from block import hash_SHA, less_than_target, slice_prev_hash, slice_data, mine
+
+
+class Test(unittest.TestCase):
+
+    def test_nonce_chunks(self):
+        chunks = nonce_chunks(b'prev', b'data', 10**72, chunk_size=100)
+        first = next(chunks)
+        second = next(chunks)
+        # Chunks should cover consecutive, non overlapping ranges of nonces
+        self.assertEqual((b'prev', b'data', 10**72, 0, 100), first)
+        self.assertEqual((b'prev', b'data', 10**72, 100, 100), second)
+
+    def test_nonce_chunks_wrap(self):
+        # The last chunk is cut short at the end of the nonce space, then it starts over from zero
+        chunks = nonce_chunks(b'prev', b'data', 10**72, chunk_size=100, start_nonce=NONCE_SPACE - 50)
+        self.assertEqual(NONCE_SPACE - 50, next(chunks)[3])
+        self.assertEqual((0, 100), next(chunks)[3:])
+
+    def test_mine_parallel(self):
+        prev_hash = hash_SHA("0".encode())
+        data = hash_SHA("parallel".encode())
+        target = 10**74
+        header = mine_parallel(prev_hash, data, target, workers=2, chunk_size=64)
+        # The header should have the same layout as one made by mine()
+        self.assertEqual(len(mine(prev_hash, data, 10**200)), len(header))
+        self.assertEqual(prev_hash, slice_prev_hash(header))
+        self.assertEqual(data, slice_data(header))
+        self.assertTrue(less_than_target(hash_SHA(header), target))
+
+    def test_mining_job_finds_header(self):
+        prev_hash = hash_SHA("0".encode())
+        data = hash_SHA("job".encode())
+        target = 10**74
+        found = []
+        job = MiningJob(prev_hash, data, target, chunk_size=256, on_found=found.append)
+        job.start()
+        self.assertTrue(job.found.wait(30))
+        job.cancel()
+        self.assertEqual([job.result], found)
+        self.assertEqual(prev_hash, slice_prev_hash(job.result))
+        self.assertTrue(less_than_target(hash_SHA(job.result), target))
+        # Every nonce up to and including the winning one was tried
+        self.assertEqual(job.nonce + 1, job.hashes)
+        self.assertGreater(job.elapsed(), 0)
+        self.assertGreater(job.hashrate(), 0)
+
+    def test_mining_job_cancel_and_resume(self):
+        prev_hash = hash_SHA("0".encode())
+        data = hash_SHA("job".encode())
+        # A target of 1 will never be met, so the job keeps running until it is cancelled
+        job = MiningJob(prev_hash, data, 1, chunk_size=256)
+        job.start()
+        while job.hashes < 1024:
+            time.sleep(0.01)
+        job.cancel()
+        self.assertFalse(job.is_running())
+        self.assertFalse(job.found.is_set())
+        # The checkpoint sits on a chunk boundary and matches the number of nonces tried
+        self.assertEqual(0, job.nonce % 256)
+        self.assertEqual(job.nonce, job.hashes)
+        # A new job resumes from the checkpoint
+        resumed = MiningJob(prev_hash, data, 1, start_nonce=job.nonce, chunk_size=256)
+        resumed.start()
+        while resumed.hashes < 256:
+            time.sleep(0.01)
+        resumed.cancel()
+        self.assertEqual(job.nonce + resumed.hashes, resumed.nonce)
+
+    def test_mining_job_retarget(self):
+        job = MiningJob(hash_SHA("0".encode()), hash_SHA("stale".encode()), 1, chunk_size=256)
+        job.start()
+        new_prev_hash = hash_SHA("new tip".encode())
+        job.retarget(new_prev_hash, hash_SHA("fresh".encode()), 10**74)
+        self.assertTrue(job.found.wait(30))
+        job.cancel()
+        # The header found is for the new tip, not the stale one
+        self.assertEqual(new_prev_hash, slice_prev_hash(job.result))
+
+    def test_mining_job_workers(self):
+        prev_hash = hash_SHA("0".encode())
+        job = MiningJob(prev_hash, hash_SHA("pool".encode()), 10**74, workers=2, chunk_size=256)
+        job.start()
+        self.assertTrue(job.found.wait(30))
+        job.cancel()
+        self.assertTrue(less_than_target(hash_SHA(job.result), 10**74))
+
+
+if __name__ == '__main__':
+    unittest.main()
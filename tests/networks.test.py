@@ -59,6 +59,41 @@ class Test(unittest.TestCase):
         n2.disconnect()
         n3.disconnect()
 
+    def test_04_send_parts(self):
+        a, b = socket.socketpair()
+        parts = [b'header', b'count', b'transaction' * 1000]
+        send_parts(a, parts)
+        a.close()
+        received = b''
+        while True:
+            chunk = b.recv(65536)
+            if not chunk:
+                break
+            received += chunk
+        b.close()
+        self.assertEqual(b''.join(parts), received)
+
+    def test_05_send_many_parts(self):
+        # More parts than one sendmsg call takes, and more bytes than the socket buffer holds
+        a, b = socket.socketpair()
+        parts = [str(i).encode() * 100 for i in range(2 * IOV_MAX + 10)]
+        received = []
+
+        def receive():
+            while True:
+                chunk = b.recv(65536)
+                if not chunk:
+                    break
+                received.append(chunk)
+
+        receiver = threading.Thread(target=receive)
+        receiver.start()
+        send_parts(a, parts)
+        a.close()
+        receiver.join()
+        b.close()
+        self.assertEqual(b''.join(parts), b''.join(received))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,174 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+sys.path.append(sys.path[0] + "/../src/data_structures")
+from segmented_blockchain import *
+from block import hash_SHA, HEADER_SIZE
+
+
+def make_block(height, body_size=100):
+    # A fake block: a header sized prefix unique to the height followed by a body
+    header = hash_SHA(str(height).encode()) * 3
+    return header[:HEADER_SIZE] + bytes([height % 256]) * body_size
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # Each record is 8 + 74 + 100 = 182 bytes, so a segment holds 3 blocks after its header
+        self.chain = SegmentedBlockchain(self.directory, segment_size=600)
+
+    def tearDown(self):
+        self.chain.close()
+        shutil.rmtree(self.directory)
+
+    def test_add_and_read(self):
+        blocks = [make_block(height) for height in range(10)]
+        self.chain.add_blocks(blocks[:4])
+        for block in blocks[4:]:
+            self.chain.add_block(block)
+        self.assertEqual(10, self.chain.block_count)
+        self.assertEqual(blocks[-1], self.chain.last_block)
+        for height, block in enumerate(blocks):
+            self.assertEqual(block, self.chain.get_block_by_height(height))
+            self.assertEqual(block[:HEADER_SIZE], self.chain.get_header(height))
+        self.assertIsNone(self.chain.get_block_by_height(10))
+        self.assertIsNone(self.chain.get_header(-1))
+
+    def test_add_block_parts(self):
+        # A block in pieces is sized by its bytes, not by the number of pieces
+        block = make_block(0)
+        self.chain.add_block([block[:10], block[10:HEADER_SIZE + 1], block[HEADER_SIZE + 1:]])
+        self.chain.add_block(make_block(1))
+        self.assertEqual(block, self.chain.get_block_by_height(0))
+        self.assertEqual(block[:HEADER_SIZE], self.chain.get_header(0))
+        self.assertEqual(make_block(1), self.chain.get_block_by_height(1))
+        self.chain.add_blocks([[make_block(2)[:50], make_block(2)[50:]]])
+        self.assertEqual(make_block(2), self.chain.last_block)
+
+    def test_compression(self):
+        self.chain.close()
+        self.chain = SegmentedBlockchain(self.directory, segment_size=600, compression='zlib')
+        # Compresses well, so each record is much smaller than the 182 bytes of a raw one
+        blocks = [make_block(height) for height in range(10)]
+        self.chain.add_blocks(blocks[:5])
+        self.chain.add_block([blocks[5][:10], blocks[5][10:]])
+        self.chain.add_blocks(blocks[6:])
+        self.assertEqual(blocks[-1], self.chain.last_block)
+        self.assertLess(len(self.chain.segments), 4)
+        self.chain.close()
+        self.chain = SegmentedBlockchain(self.directory, segment_size=600)
+        self.assertEqual(10, self.chain.block_count)
+        self.assertEqual(blocks[-1], self.chain.last_block)
+        for height, block in enumerate(blocks):
+            self.assertEqual(block, self.chain.get_block_by_height(height))
+            self.assertEqual(block[:HEADER_SIZE], self.chain.get_header(height))
+
+    def test_block_too_big(self):
+        piece = memoryview(bytes(1024 * 1024))
+        with self.assertRaises(ValueError):
+            self.chain.add_block([make_block(0)] + [piece] * 1024)
+        self.assertEqual(0, self.chain.block_count)
+
+    def test_block_too_short(self):
+        with self.assertRaises(ValueError):
+            self.chain.add_blocks([make_block(0), make_block(1)[:HEADER_SIZE - 1]])
+        self.assertEqual(0, self.chain.block_count)
+
+    def test_rollover(self):
+        self.chain.add_blocks([make_block(height) for height in range(10)])
+        self.assertEqual({0: (0, 3), 1: (3, 3), 2: (6, 3), 3: (9, 1)}, self.chain.segments)
+        for number in range(4):
+            self.assertTrue(os.path.getsize(segment_filename(self.directory, number)) <= 600)
+            self.assertEqual(self.chain.segments[number], read_segment_header(segment_filename(self.directory, number)))
+
+    def test_oversized_block(self):
+        # A block bigger than a segment still gets a segment to itself
+        self.chain.add_block(make_block(0, body_size=1000))
+        self.chain.add_block(make_block(1))
+        self.assertEqual({0: (0, 1), 1: (1, 1)}, self.chain.segments)
+        self.assertEqual(make_block(0, body_size=1000), self.chain.get_block_by_height(0))
+
+    def test_prune(self):
+        self.chain.add_blocks([make_block(height) for height in range(10)])
+        # Only segments whose blocks are all below the height go
+        self.assertEqual([0], self.chain.prune(5))
+        self.assertFalse(os.path.exists(segment_filename(self.directory, 0)))
+        self.assertEqual(3, self.chain.pruned_height())
+        self.assertIsNone(self.chain.get_block_by_height(2))
+        self.assertEqual(make_block(3), self.chain.get_block_by_height(3))
+        # Headers are kept
+        self.assertEqual(make_block(0)[:HEADER_SIZE], self.chain.get_header(0))
+        # The segment being written to is never pruned
+        self.assertEqual([1, 2], self.chain.prune(100))
+        self.assertEqual(make_block(9), self.chain.get_block_by_height(9))
+        self.chain.add_block(make_block(10))
+        self.assertEqual(make_block(10), self.chain.get_block_by_height(10))
+
+    def test_reopen(self):
+        self.chain.add_blocks([make_block(height) for height in range(10)])
+        self.chain.prune(6)
+        self.chain.close()
+        self.chain = SegmentedBlockchain(self.directory, segment_size=600)
+        self.assertEqual(10, self.chain.block_count)
+        self.assertEqual(make_block(9), self.chain.last_block)
+        self.assertEqual({2: (6, 3), 3: (9, 1)}, self.chain.segments)
+        self.chain.add_block(make_block(10))
+        self.assertEqual(make_block(10), self.chain.get_block_by_height(10))
+        self.assertEqual(make_block(1)[:HEADER_SIZE], self.chain.get_header(1))
+
+    def test_recover_torn_write(self):
+        self.chain.add_blocks([make_block(height) for height in range(5)])
+        self.chain.close()
+        # A record that made it into the segment but not into the index is dropped
+        with open(segment_filename(self.directory, 1), 'ab') as file:
+            file.write(make_block(99)[:50])
+        # So is an index entry whose record is missing
+        with open(os.path.join(self.directory, 'index.idx'), 'ab') as file:
+            file.write(SEGMENT_INDEX_ENTRY_FORMAT.pack(1, 10**6, 100, b'\x00' * 32))
+        self.chain = SegmentedBlockchain(self.directory, segment_size=600)
+        self.assertEqual(5, self.chain.block_count)
+        self.assertEqual(make_block(4), self.chain.last_block)
+        self.chain.add_block(make_block(5))
+        self.assertEqual(make_block(5), self.chain.get_block_by_height(5))
+
+
+    def test_recover_empty_segment(self):
+        # A crash right after a new segment was started leaves it empty, the tip is in the segment before it
+        self.chain.add_blocks([make_block(height) for height in range(3)])
+        self.chain._start_segment(1)
+        self.chain.close()
+        # Stray files that only look like segments are ignored
+        for name in ('blk_old.dat', 'blk00009.dat.bak', 'blkfoo.dat'):
+            with open(os.path.join(self.directory, name), 'wb') as file:
+                file.write(b'junk')
+        self.chain = SegmentedBlockchain(self.directory, segment_size=600)
+        self.assertEqual(3, self.chain.block_count)
+        self.assertEqual(make_block(2), self.chain.last_block)
+        self.assertEqual({0: (0, 3), 1: (3, 0)}, self.chain.segments)
+        self.chain.add_block(make_block(3))
+        self.assertEqual(make_block(3), self.chain.get_block_by_height(3))
+        self.assertEqual((3, 1), read_segment_header(segment_filename(self.directory, 1)))
+
+    def test_recover_segment_past_index(self):
+        # Index entries for blocks 2 to 4 were lost, so segment 1, which starts at height 3, holds none of the chain
+        self.chain.add_blocks([make_block(height) for height in range(5)])
+        self.chain.close()
+        os.truncate(os.path.join(self.directory, 'index.idx'), 2 * SEGMENT_INDEX_ENTRY_FORMAT.size)
+        self.chain = SegmentedBlockchain(self.directory, segment_size=600)
+        self.assertEqual(2, self.chain.block_count)
+        self.assertEqual(make_block(1), self.chain.last_block)
+        self.assertEqual({0: (0, 2)}, self.chain.segments)
+        self.assertFalse(os.path.exists(segment_filename(self.directory, 1)))
+        self.chain.add_blocks([make_block(height) for height in range(2, 6)])
+        for height in range(6):
+            self.assertEqual(make_block(height), self.chain.get_block_by_height(height))
+        self.assertEqual({0: (0, 3), 1: (3, 3)}, self.chain.segments)
+        self.assertEqual((3, 3), read_segment_header(segment_filename(self.directory, 1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
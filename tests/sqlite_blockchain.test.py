@@ -0,0 +1,153 @@
+import unittest
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import threading
+sys.path.append(sys.path[0] + "/../src/data_structures")
+from sqlite_blockchain import *
+import sqlite_blockchain
+from block import BlockBuilder, mine_range, hash_SHA, time_now, int_to_bytes
+
+
+def build_chain(length, timestamp):
+    # Blocks with a transaction count after the header, one second apart
+    blocks = []
+    prev_hash = hash_SHA("Root".encode())
+    for height in range(length):
+        builder = BlockBuilder()
+        for i in range(height + 1):
+            builder.add_transaction(hash_SHA(("%d %d" % (height, i)).encode()))
+        header = mine_range(prev_hash, builder.merkle_tree.root, 10**76, 0, 100000, timestamp + height)
+        block = b''.join([header, int_to_bytes(len(builder.transactions))] + builder.transactions)
+        blocks.append(block)
+        prev_hash = hash_SHA(header)
+    return blocks
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "chain.db")
+        self.chain = SQLiteBlockchain(self.filename)
+        self.timestamp = time_now()
+        self.blocks = build_chain(5, self.timestamp)
+
+    def tearDown(self):
+        self.chain.close()
+        shutil.rmtree(self.directory)
+
+    def test_wal_mode(self):
+        self.assertTrue(os.path.isfile(self.filename + '.sqlite'))
+        mode = self.chain._connection().execute('PRAGMA journal_mode').fetchone()[0]
+        self.assertEqual('wal', mode)
+
+    def test_metadata(self):
+        self.chain.add_blocks(self.blocks[:3])
+        self.chain.add_block(self.blocks[3])
+        metadata = self.chain.get_metadata(2)
+        self.assertEqual(2, metadata['height'])
+        self.assertEqual(hash_SHA(self.blocks[2][:74]), metadata['hash'])
+        self.assertEqual(hash_SHA(self.blocks[1][:74]), metadata['prev_hash'])
+        self.assertEqual(self.chain.get_block_location(2)[0] - 8, metadata['offset'])
+        self.assertEqual(self.timestamp + 2, metadata['timestamp'])
+        self.assertEqual(76, metadata['target_exponent'])
+        self.assertEqual(3, metadata['tx_count'])
+        self.assertIsNone(self.chain.get_metadata(4))
+        # Blocks are still stored in the blockfile
+        self.assertEqual(self.blocks[3], self.chain.get_block_by_height(3))
+        # A block added in pieces, with the transaction count in a piece of its own, gets the same row
+        block = self.blocks[4]
+        self.chain.add_block([block[:74], block[74:78], block[78:]])
+        self.assertEqual(5, self.chain.get_metadata(4)['tx_count'])
+        self.assertEqual(hash_SHA(block[:74]), self.chain.get_metadata(4)['hash'])
+
+    def test_metadata_failure(self):
+        # A block whose metadata cannot be stored is not added, and does not turn up with the next block
+        def fail(start_height, blocks, offsets):
+            raise sqlite3.OperationalError("disk I/O error")
+        self.chain._blocks_written = fail
+        with self.assertRaises(sqlite3.OperationalError):
+            self.chain.add_block(self.blocks[0])
+        del self.chain._blocks_written
+        self.assertEqual(0, self.chain.block_count)
+        self.assertEqual(0, os.path.getsize(self.filename))
+        self.chain.add_block(self.blocks[0])
+        self.assertEqual(1, self.chain.block_count)
+        self.assertEqual(0, self.chain.get_metadata(0)['height'])
+
+    def test_queries(self):
+        self.chain.add_blocks(self.blocks)
+        between = self.chain.get_blocks_between(self.timestamp + 1, self.timestamp + 3)
+        self.assertEqual([1, 2, 3], [row['height'] for row in between])
+        children = self.chain.get_children(hash_SHA(self.blocks[2][:74]))
+        self.assertEqual([3], [row['height'] for row in children])
+        self.assertEqual([], self.chain.get_children(hash_SHA(self.blocks[4][:74])))
+        # The queries are answered from the indexes
+        plan = self.chain._connection().execute('EXPLAIN QUERY PLAN SELECT * FROM blocks WHERE prev_hash = ?', (b'',)).fetchall()
+        self.assertIn('blocks_prev_hash', str(plan))
+
+    def test_truncate(self):
+        self.chain.add_blocks(self.blocks)
+        self.chain.truncate(2)
+        self.assertIsNone(self.chain.get_metadata(2))
+        self.assertEqual([], self.chain.get_children(hash_SHA(self.blocks[1][:74])))
+        self.chain.add_blocks(self.blocks[2:])
+        self.assertEqual(4, self.chain.get_metadata(4)['height'])
+
+    def test_catch_up(self):
+        self.chain.add_blocks(self.blocks[:3])
+        self.chain.close()
+        # Metadata lost for a block, and a row left behind for a block that is not in the blockfile
+        with sqlite3.connect(self.filename + '.sqlite') as connection:
+            connection.execute('DELETE FROM blocks WHERE height = 2')
+            connection.execute('INSERT INTO blocks VALUES (7, ?, ?, 0, 0, 0, 0)', (b'', b''))
+        connection.close()
+        self.chain = SQLiteBlockchain(self.filename)
+        self.assertEqual(3, self.chain.get_metadata(2)['tx_count'])
+        self.chain.add_blocks(self.blocks[3:])
+        self.assertEqual(5, len(self.chain.get_blocks_between(0, 2**32)))
+
+    def test_catch_up_gaps(self):
+        self.chain.add_blocks(self.blocks)
+        self.chain.close()
+        # Rows missing from the start and the middle of the table, below the highest row
+        with sqlite3.connect(self.filename + '.sqlite') as connection:
+            connection.execute('DELETE FROM blocks WHERE height IN (0, 2, 3)')
+        connection.close()
+        batch_size = sqlite_blockchain.CATCH_UP_BATCH_SIZE
+        sqlite_blockchain.CATCH_UP_BATCH_SIZE = 1
+        try:
+            self.chain = SQLiteBlockchain(self.filename)
+        finally:
+            sqlite_blockchain.CATCH_UP_BATCH_SIZE = batch_size
+        self.assertEqual([0, 1, 2, 3, 4], [row['height'] for row in self.chain.get_blocks_between(0, 2**32)])
+        self.assertEqual(hash_SHA(self.blocks[2][:74]), self.chain.get_metadata(2)['hash'])
+        self.assertEqual(4, self.chain.get_metadata(3)['tx_count'])
+
+    def test_concurrent_readers(self):
+        errors = []
+        done = threading.Event()
+
+        def read():
+            while not done.is_set():
+                count = self.chain.block_count
+                rows = self.chain.get_blocks_between(0, 2**32)
+                if [row['height'] for row in rows[:count]] != list(range(count)):
+                    errors.append(count)
+
+        readers = [threading.Thread(target=read) for _ in range(3)]
+        for reader in readers:
+            reader.start()
+        for block in self.blocks:
+            self.chain.add_block(block)
+        done.set()
+        for reader in readers:
+            reader.join()
+        self.assertEqual([], errors)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -126,5 +126,114 @@ class Test(unittest.TestCase):
 		parsed_output = parse_output(create_output(value, recipient))
 		self.assertEqual(parsed_output["value"], value)
 		self.assertEqual(parsed_output["recipient"], recipient)
+
+	def signed_input(self, key_dict, name):
+		# Makes an input spending a made up previous transaction, along with the rest of what it signs
+		previous_tx_hash = hash_SHA(name.encode())
+		prev_tx_locking_script = create_output(30000000, key_dict["pk_hash"])
+		new_tx_output = create_output(20000000, hash_SHA((name + ' recipient').encode()))
+		signature = sign_transaction(key_dict["private_key"], previous_tx_hash, prev_tx_locking_script, new_tx_output)
+		return (create_input(previous_tx_hash, 0, signature, key_dict["public_key"]), prev_tx_locking_script, new_tx_output)
+
+	def test_verify_transaction_input(self):
+		key_dict = generate_key_set()
+		tx_input, prev_tx_locking_script, new_tx_output = self.signed_input(key_dict, 'previous')
+		self.assertTrue(verify_transaction_input(tx_input, prev_tx_locking_script, new_tx_output))
+		# Changing what was signed breaks the signature
+		self.assertFalse(verify_transaction_input(tx_input, prev_tx_locking_script, create_output(1, hash_SHA('thief'.encode()))))
+		self.assertFalse(verify_transaction_input(hash_SHA('other'.encode()) + tx_input[32:], prev_tx_locking_script, new_tx_output))
+		# So does swapping in someone else's public key, or one that is not on the curve
+		other_key = generate_key_set()["public_key"]
+		self.assertFalse(verify_transaction_input(tx_input[:98] + other_key, prev_tx_locking_script, new_tx_output))
+		self.assertFalse(verify_transaction_input(tx_input[:98] + bytes(64), prev_tx_locking_script, new_tx_output))
+
+	def test_verify_transaction_inputs(self):
+		key_dict = generate_key_set()
+		items = [self.signed_input(key_dict, str(i)) for i in range(40)]
+		# Breaks a few of the inputs
+		for i in (3, 17, 39):
+			tx_input, prev_tx_locking_script, new_tx_output = items[i]
+			items[i] = (tx_input, prev_tx_locking_script, create_output(1, hash_SHA('thief'.encode())))
+		expected = [i not in (3, 17, 39) for i in range(40)]
+		self.assertEqual(expected, verify_transaction_inputs(items, workers=2, chunk_size=4))
+		self.assertEqual(expected, verify_transaction_inputs(items, workers=1))
+		self.assertEqual([], verify_transaction_inputs([]))
+
+	def test_signature_cache(self):
+		cache = SignatureCache()
+		key_dict = generate_key_set()
+		items = [self.signed_input(key_dict, 'cached ' + str(i)) for i in range(4)]
+		self.assertTrue(verify_transaction_input(*items[0], cache=cache))
+		self.assertEqual(1, len(cache))
+		# Checking the same input again, as block validation would after mempool admission, is a cache hit
+		self.assertTrue(verify_transaction_input(*items[0], cache=cache))
+		self.assertEqual(1, cache.hits)
+		# The batch verifier only checks the inputs it has not seen and adds them once verified
+		self.assertEqual([True] * 4, verify_transaction_inputs(items, workers=1, cache=cache))
+		self.assertEqual(2, cache.hits)
+		self.assertEqual(4, len(cache))
+		# A bad signature is not cached, and a cached input with a different output is still rejected
+		tx_input, prev_tx_locking_script, new_tx_output = items[1]
+		thief_output = create_output(1, hash_SHA('thief'.encode()))
+		self.assertEqual([False, False], [verify_transaction_input(tx_input, prev_tx_locking_script, thief_output, cache=cache) for i in range(2)])
+		self.assertEqual(4, len(cache))
+		self.assertFalse(verify_transaction_input(tx_input[:98] + generate_key_set()["public_key"], prev_tx_locking_script, new_tx_output, cache=cache))
+
+	def test_signature_cache_bounded(self):
+		cache = SignatureCache(max_entries=2)
+		for i in range(3):
+			cache.add(hash_SHA(str(i).encode()))
+		self.assertEqual(2, len(cache))
+		self.assertFalse(hash_SHA('0'.encode()) in cache)
+		self.assertTrue(hash_SHA('2'.encode()) in cache)
+		cache.clear()
+		self.assertEqual(0, len(cache))
+		# With no room the cache never keeps anything
+		cache = SignatureCache(max_entries=0)
+		cache.add(hash_SHA('0'.encode()))
+		self.assertEqual(0, len(cache))
+
+	@unittest.skipIf(np is None, "NumPy is not installed")
+	def test_parse_inputs(self):
+		key_dict = generate_key_set()
+		inputs = [self.signed_input(key_dict, str(i))[0] for i in range(5)]
+		# A hash ending in a zero byte keeps all 32 bytes
+		inputs.append(create_input(b'\x01' + bytes(31), 65535, bytes(64), key_dict["public_key"]))
+		records = parse_inputs(b''.join(inputs))
+		self.assertEqual(6, len(records))
+		for i, tx_input in enumerate(inputs):
+			parsed_input = parse_input(tx_input)
+			self.assertEqual(parsed_input["previous_tx_hash"], bytes(records['previous_tx_hash'][i]))
+			self.assertEqual(parsed_input["index"], int(records['index'][i]))
+			self.assertEqual(parsed_input["signature"], bytes(records['signature'][i]))
+			self.assertEqual(parsed_input["public_key"], bytes(records['public_key'][i]))
+		# Inputs can be read from the middle of a larger buffer
+		records = parse_inputs(b'header' + b''.join(inputs), offset=6, count=2)
+		self.assertEqual(inputs[1][32:34], records['index'][1:2].tobytes())
+		with self.assertRaises(ValueError):
+			parse_inputs(b''.join(inputs)[:-1])
+
+	@unittest.skipIf(np is None, "NumPy is not installed")
+	def test_parse_outputs(self):
+		outputs = [create_output(i * 1000, hash_SHA(str(i).encode())) for i in range(10)]
+		records = parse_outputs(b''.join(outputs))
+		self.assertEqual([i * 1000 for i in range(10)], records['value'].tolist())
+		self.assertEqual(hash_SHA('3'.encode()), bytes(records['recipient'][3]))
+
+	def test_total_output_value(self):
+		import transaction
+		# Values near the top of a long do not overflow the sum
+		outputs = b''.join(create_output(4294967295 - i, hash_SHA(str(i).encode())) for i in range(10))
+		expected = sum(4294967295 - i for i in range(10))
+		self.assertEqual(expected, total_output_value(outputs))
+		self.assertEqual(0, total_output_value(b''))
+		numpy, transaction.np = transaction.np, None
+		try:
+			self.assertEqual(expected, total_output_value(outputs))
+			with self.assertRaises(ValueError):
+				total_output_value(outputs[:-1])
+		finally:
+			transaction.np = numpy
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,118 @@
+import unittest
+import os
+import sys
+import tempfile
+sys.path.append(sys.path[0] + "/../src/data_structures")
+from utxo import *
+from block import hash_SHA
+from transaction import create_input, create_output
+
+
+def spend(tx_hash, index):
+    # An input spending an output, with a made up signature and public key
+    return create_input(tx_hash, index, bytes(64), bytes(64))
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.utxo_set = UTXOSet()
+        self.alice = hash_SHA("alice".encode())
+        self.bob = hash_SHA("bob".encode())
+        # Block 1 has a single reward transaction paying alice twice
+        self.reward = hash_SHA("reward".encode())
+        self.block_1 = [(self.reward, [], [create_output(50, self.alice), create_output(25, self.alice)])]
+        # Block 2 spends the first output and then spends its change in the same block
+        self.payment = hash_SHA("payment".encode())
+        self.change = hash_SHA("change".encode())
+        self.block_2 = [
+            (self.payment, [spend(self.reward, 0)], [create_output(30, self.bob), create_output(20, self.alice)]),
+            (self.change, [spend(self.payment, 1)], [create_output(20, self.bob)]),
+        ]
+
+    def test_apply_block(self):
+        self.utxo_set.apply_block(hash_SHA("1".encode()), self.block_1)
+        self.assertEqual(2, len(self.utxo_set))
+        self.assertEqual(create_output(50, self.alice), self.utxo_set.get_output(self.reward, 0))
+        self.assertTrue(self.utxo_set.is_unspent(spend(self.reward, 1)))
+        self.utxo_set.apply_block(hash_SHA("2".encode()), self.block_2)
+        self.assertEqual(2, self.utxo_set.height)
+        self.assertEqual(hash_SHA("2".encode()), self.utxo_set.tip_hash)
+        self.assertFalse(self.utxo_set.is_unspent(spend(self.reward, 0)))
+        self.assertFalse(self.utxo_set.is_unspent(spend(self.payment, 1)))
+        self.assertEqual({outpoint(self.reward, 1), outpoint(self.payment, 0), outpoint(self.change, 0)}, set(self.utxo_set.outputs))
+
+    def test_double_spend(self):
+        self.utxo_set.apply_block(hash_SHA("1".encode()), self.block_1)
+        before = dict(self.utxo_set.outputs)
+        # The second transaction spends the same output as the first, so the whole block is rejected
+        double_spend = [
+            (self.payment, [spend(self.reward, 0)], [create_output(50, self.bob)]),
+            (self.change, [spend(self.reward, 0)], [create_output(50, self.bob)]),
+        ]
+        with self.assertRaises(ValueError):
+            self.utxo_set.apply_block(hash_SHA("2".encode()), double_spend)
+        self.assertEqual(before, self.utxo_set.outputs)
+        self.assertEqual(1, self.utxo_set.height)
+        with self.assertRaises(ValueError):
+            self.utxo_set.apply_block(hash_SHA("2".encode()), [(self.payment, [spend(self.bob, 0)], [])])
+
+    def test_duplicate_output(self):
+        self.utxo_set.apply_block(hash_SHA("1".encode()), self.block_1)
+        before = dict(self.utxo_set.outputs)
+        # A transaction with the same hash as the reward would replace its second output, which is still unspent.
+        # The payment before it makes and spends an output of its own, which has to be gone afterwards too
+        duplicate = self.block_2 + [(self.reward, [], [create_output(1, self.bob), create_output(1, self.bob)])]
+        with self.assertRaises(ValueError):
+            self.utxo_set.apply_block(hash_SHA("2".encode()), duplicate)
+        self.assertEqual(before, self.utxo_set.outputs)
+        self.assertEqual(1, self.utxo_set.height)
+
+    def test_output_size(self):
+        self.utxo_set.apply_block(hash_SHA("1".encode()), self.block_1)
+        before = dict(self.utxo_set.outputs)
+        # An output of the wrong size would make a snapshot that load() cannot read back
+        wrong_size = [(self.payment, [spend(self.reward, 0)], [create_output(30, self.bob) + b'\x00'])]
+        with self.assertRaises(ValueError):
+            self.utxo_set.apply_block(hash_SHA("2".encode()), wrong_size)
+        self.assertEqual(before, self.utxo_set.outputs)
+        self.assertEqual(1, self.utxo_set.height)
+
+    def test_rollback_on_any_error(self):
+        self.utxo_set.apply_block(hash_SHA("1".encode()), self.block_1)
+        before = dict(self.utxo_set.outputs)
+        # An output that is not a byte string makes the key fail to build after an input has been spent
+        broken = [(self.payment, [spend(self.reward, 0)], [create_output(30, self.bob)]), (None, [], [create_output(1, self.bob)])]
+        with self.assertRaises(TypeError):
+            self.utxo_set.apply_block(hash_SHA("2".encode()), broken)
+        self.assertEqual(before, self.utxo_set.outputs)
+
+    def test_undo_block(self):
+        self.utxo_set.apply_block(hash_SHA("1".encode()), self.block_1)
+        after_1 = dict(self.utxo_set.outputs)
+        undo = self.utxo_set.apply_block(hash_SHA("2".encode()), self.block_2)
+        self.utxo_set.undo_block(hash_SHA("1".encode()), self.block_2, undo)
+        self.assertEqual(after_1, self.utxo_set.outputs)
+        self.assertEqual(1, self.utxo_set.height)
+        self.assertEqual(hash_SHA("1".encode()), self.utxo_set.tip_hash)
+
+    def test_snapshot(self):
+        self.utxo_set.apply_block(hash_SHA("1".encode()), self.block_1)
+        self.utxo_set.apply_block(hash_SHA("2".encode()), self.block_2)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "utxo.dat")
+            self.utxo_set.save(filename)
+            self.assertEqual(SNAPSHOT_HEADER_FORMAT.size + 3 * (KEY_SIZE + OUTPUT_SIZE), os.path.getsize(filename))
+            loaded = UTXOSet.load(filename)
+            self.assertEqual(self.utxo_set.outputs, loaded.outputs)
+            self.assertEqual(2, loaded.height)
+            self.assertEqual(hash_SHA("2".encode()), loaded.tip_hash)
+            # A snapshot cut short is rejected
+            with open(filename, 'r+b') as file:
+                file.truncate(os.path.getsize(filename) - 1)
+            with self.assertRaises(ValueError):
+                UTXOSet.load(filename)
+
+
+if __name__ == '__main__':
+    unittest.main()